@@ -0,0 +1,147 @@
+"""
+int8 矩阵乘法基准测试: 与 float32 矩阵乘法对比延迟、吞吐和精度
+
+对每个形状 (M, N, K)（M=1 即 GEMV）测量:
+  - float32        x @ W.T（基线）
+  - int8 blas      quantized_linear，int8 GEMM 在 float32 BLAS 上分块精确累加到 int32
+  - int8 integer   同上，纯 int32 累加（--include-integer，较慢，仅作参考）
+  - dequant int8   融合的逐块反量化 + 乘法（仅权重量化）
+  - dequant int4   同上，int4 分组量化权重
+  - torch dynamic  torch.ops.quantized.linear_dynamic（安装了 torch 时）
+
+输出每种方法的中位延迟、GFLOP/s、相对 float32 的加速比与相对误差，以及权重占用的字节数，
+可用 --output 保存为 CSV，据此判断在当前 CPU 主机上量化什么时候真正划算。
+
+用法:
+  python benchmark_quantized_matmul.py
+  python benchmark_quantized_matmul.py --shapes 1x4096x4096 32x4096x4096 --repeats 20 --output matmul.csv
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from quantization import quantize
+from quantized_matmul import dequant_matmul, quantized_linear, torch_dynamic_linear
+
+DEFAULT_SHAPES = ['1x4096x4096', '8x4096x4096', '64x4096x4096', '256x1024x1024', '1024x1024x4096']
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='int8 矩阵乘法与 float32 的延迟、吞吐和精度对比')
+
+    parser.add_argument('--shapes', type=str, nargs='+', default=DEFAULT_SHAPES,
+                        help='要测试的形状，格式为 MxNxK（y = x[M,K] @ W[N,K].T）')
+    parser.add_argument('--repeats', type=int, default=10, help='每种方法的计时次数')
+    parser.add_argument('--warmup', type=int, default=2, help='计时前的预热次数')
+    parser.add_argument('--include-integer', action='store_true', help='同时测试纯 int32 累加的参考实现')
+    parser.add_argument('--output', type=str, help='结果CSV文件路径')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+
+    return parser.parse_args()
+
+
+def parse_shape(text):
+    """解析 MxNxK 形式的形状。"""
+    try:
+        m, n, k = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"无效的形状: {text}，应为 MxNxK") from None
+    return m, n, k
+
+
+def time_call(fn, repeats, warmup):
+    """返回 (中位延迟秒数, 最后一次的结果)。"""
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)), result
+
+
+def build_methods(x, weight, include_integer):
+    """返回 [(方法名, 权重字节数, 可调用对象)]，量化与预打包不计入计时。"""
+    w8, p8 = quantize(weight, bits=8, granularity='channel')
+    w4, p4 = quantize(weight, bits=4, granularity='group', group_size=128 if weight.shape[1] % 128 == 0 else 2)
+    methods = [
+        ('float32', weight.nbytes, lambda: x @ weight.T),
+        ('int8 blas', w8.nbytes + p8['scale'].nbytes, lambda: quantized_linear(x, w8, p8)),
+    ]
+    if include_integer:
+        methods.append(('int8 integer', w8.nbytes + p8['scale'].nbytes,
+                        lambda: quantized_linear(x, w8, p8, backend='integer')))
+    methods += [
+        ('dequant int8', w8.nbytes + p8['scale'].nbytes, lambda: dequant_matmul(x, w8, p8)),
+        ('dequant int4', w4.nbytes + p4['scale'].nbytes, lambda: dequant_matmul(x, w4, p4)),
+    ]
+    try:
+        linear = torch_dynamic_linear(weight)
+        methods.append(('torch dynamic', w8.nbytes + p8['scale'].nbytes, lambda: linear(x)))
+    except ImportError:
+        pass
+    return methods
+
+
+def benchmark_shape(m, n, k, args, rng):
+    """测试单个形状，返回结果行列表。"""
+    # np.sqrt返回float64标量，先缩放再转换，否则按NumPy 2的类型提升规则权重会是float64
+    weight = (rng.standard_normal((n, k)) / np.sqrt(k)).astype(np.float32)
+    x = rng.standard_normal((m, k)).astype(np.float32)
+    flops = 2.0 * m * n * k
+
+    rows = []
+    reference = None
+    baseline = None
+    for name, weight_bytes, fn in build_methods(x, weight, args.include_integer):
+        latency, result = time_call(fn, args.repeats, args.warmup)
+        if reference is None:
+            reference, baseline = result, latency
+        error = float(np.linalg.norm(result - reference) / np.linalg.norm(reference))
+        rows.append({
+            'shape': f"{m}x{n}x{k}",
+            'method': name,
+            'latency_ms': latency * 1000,
+            'gflops': flops / latency / 1e9,
+            'speedup': baseline / latency,
+            'relative_error': error,
+            'weight_mb': weight_bytes / 1e6
+        })
+    return rows
+
+
+def main():
+    args = parse_arguments()
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    for text in args.shapes:
+        m, n, k = parse_shape(text)
+        rows = benchmark_shape(m, n, k, args, rng)
+        results.extend(rows)
+        print(f"\n形状 M={m} N={n} K={k}{'（GEMV）' if m == 1 else ''}")
+        for row in rows:
+            print(f"  {row['method']:<14} {row['latency_ms']:9.3f} ms  {row['gflops']:8.2f} GFLOP/s  "
+                  f"加速比 {row['speedup']:5.2f}x  相对误差 {row['relative_error']:.2e}  权重 {row['weight_mb']:.1f} MB")
+
+    df = pd.DataFrame(results)
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f"\n结果已保存到: {args.output}")
+
+    # 每个形状上最快的方法
+    fastest = df.loc[df.groupby('shape', sort=False)['latency_ms'].idxmin(), ['shape', 'method', 'speedup']]
+    print("\n各形状最快的方法:")
+    for _, row in fastest.iterrows():
+        print(f"  {row['shape']:<16} {row['method']:<14} {row['speedup']:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
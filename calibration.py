@@ -0,0 +1,291 @@
+"""
+基于直方图的量化校准（percentile / MSE / KL 散度 搜索 scale）
+
+test.py 中的 simple_quantize_float32_to_int8 与 pytorch_quantization_example 都按 absmax 计算 scale，
+一个离群值就会拉大整个张量的量化步长。这里先分块收集 |x| 的直方图（可以跨多个批次累积），
+再在直方图上搜索截断阈值 amax:
+
+- absmax: 不截断，作为基线
+- percentile: 按累积分布截断到指定百分位
+- mse: 最小化 截断误差 + 舍入噪声(step²/12) 的期望，用后缀和一次性向量化评估所有候选阈值
+- kl: TensorRT 式熵校准，最小化原始分布与量化后分布的 KL 散度
+
+得到的是对称、整个张量一个 scale 的参数（与 quantization.make_qparams 的参数字典兼容），
+输入可以是 NumPy 数组、np.memmap 或 CPU 上的 torch 张量（零拷贝转换，不强制依赖 torch）。
+
+用法:
+  python calibration.py                      # 使用带离群值的合成数据演示
+  python calibration.py activations.npy --bits 8 --bins 2048
+"""
+
+import sys
+import argparse
+
+import numpy as np
+
+from quantization import DEFAULT_CHUNK_BYTES, QUANT_RANGES, iter_chunks, make_qparams, quantization_error, quantize
+
+CALIBRATION_METHODS = ('absmax', 'percentile', 'mse', 'kl')
+
+# 直方图默认分箱数（与 TensorRT / pytorch-quantization 的默认值一致）
+DEFAULT_NUM_BINS = 2048
+
+
+def as_numpy(data):
+    """把 NumPy 数组或 CPU torch 张量转换为 C 连续的 NumPy 数组（尽量不复制）。"""
+    if type(data).__module__.startswith('torch'):
+        if data.device.type != 'cpu':
+            raise ValueError(f"只支持CPU上的torch张量，当前设备: {data.device}")
+        data = data.detach()
+        if not data.is_floating_point():
+            raise ValueError(f"不支持的张量类型: {data.dtype}")
+        # float16 / bfloat16 等类型无法零拷贝转换，先转为 float32
+        if str(data.dtype) not in ('torch.float32', 'torch.float64'):
+            data = data.float()
+        return data.contiguous().numpy()
+
+    data = np.asarray(data) if not isinstance(data, np.ndarray) else data
+    if not np.issubdtype(data.dtype, np.floating):
+        raise ValueError(f"不支持的数组类型: {data.dtype}")
+    return data if data.flags['C_CONTIGUOUS'] else np.ascontiguousarray(data)
+
+
+# 示例1: 分块收集 |x| 的直方图
+class HistogramCalibrator:
+    """跨分块、跨批次累积 |x| 的直方图，并按不同方法计算截断阈值 amax。
+
+    直方图覆盖 [0, amax)；遇到更大的值时把范围扩大为原来的 2^n 倍，
+    旧的计数每 2^n 个分箱合并为一个，因此重新分箱是精确的。
+    """
+
+    def __init__(self, num_bins=DEFAULT_NUM_BINS, bits=8, chunk_bytes=DEFAULT_CHUNK_BYTES):
+        if bits not in QUANT_RANGES:
+            raise ValueError(f"不支持的位宽: {bits}，可选 {sorted(QUANT_RANGES)}")
+        self.num_bins = num_bins
+        self.bits = bits
+        self.chunk_elements = max(1, chunk_bytes // 4)
+        self.histogram = np.zeros(num_bins, dtype=np.int64)
+        self.range_max = 0.0
+        self.observed_max = 0.0
+        self.count = 0
+
+    @property
+    def bin_width(self):
+        return self.range_max / self.num_bins
+
+    def _expand_range(self, new_max):
+        """把直方图范围扩大到不小于 new_max 的 range_max * 2^n，合并旧分箱。"""
+        if self.range_max == 0.0:
+            self.range_max = float(new_max)
+            return
+        factor = 2 ** int(np.ceil(np.log2(new_max / self.range_max)))
+        target_bins = np.arange(self.num_bins) // factor
+        self.histogram = np.bincount(target_bins, weights=self.histogram,
+                                     minlength=self.num_bins).astype(np.int64)
+        self.range_max *= factor
+
+    def collect(self, data):
+        """收集一个批次的数据（NumPy 数组、np.memmap 或 CPU torch 张量）。"""
+        flat = as_numpy(data).reshape(-1)
+        chunk = min(self.chunk_elements, max(1, flat.size))
+        work = np.empty(chunk, dtype=np.float32)
+        index = np.empty(chunk, dtype=np.intp)
+
+        for start, end in iter_chunks(flat.size, chunk):
+            buffer = work[:end - start]
+            np.abs(flat[start:end], out=buffer, casting='same_kind' if flat.dtype == np.float32 else 'unsafe')
+            chunk_max = float(buffer.max())
+            if not np.isfinite(chunk_max):
+                raise ValueError("校准数据中包含 NaN 或 Inf")
+            self.observed_max = max(self.observed_max, chunk_max)
+            if chunk_max == 0.0 and self.range_max == 0.0:
+                # 还没有非零值时全部计入第一个分箱
+                self.histogram[0] += end - start
+                continue
+            if chunk_max >= self.range_max:
+                self._expand_range(chunk_max * (1 + 1e-6))
+
+            np.multiply(buffer, self.num_bins / self.range_max, out=buffer)
+            bins = index[:end - start]
+            np.copyto(bins, buffer, casting='unsafe')
+            np.minimum(bins, self.num_bins - 1, out=bins)
+            self.histogram += np.bincount(bins, minlength=self.num_bins)
+
+        self.count += flat.size
+        return self
+
+    def compute_amax(self, method='mse', percentile=99.99, stride=1):
+        """按指定方法计算截断阈值 amax。"""
+        if method not in CALIBRATION_METHODS:
+            raise ValueError(f"不支持的校准方法: {method}，可选 {CALIBRATION_METHODS}")
+        if self.count == 0:
+            raise ValueError("尚未收集任何校准数据")
+        if self.observed_max == 0.0 or method == 'absmax':
+            return self.observed_max
+        if method == 'percentile':
+            return percentile_amax(self.histogram, self.bin_width, percentile)
+        if method == 'mse':
+            return mse_amax(self.histogram, self.bin_width, self.bits, stride)
+        return kl_amax(self.histogram, self.bin_width, self.bits, stride)
+
+    def qparams(self, shape, method='mse', percentile=99.99, stride=1):
+        """返回整个张量一个 scale 的对称量化参数字典。"""
+        amax = self.compute_amax(method, percentile, stride)
+        return make_qparams(-amax, amax, shape, self.bits, 'tensor', symmetric=True)
+
+
+# 示例2: 基于直方图的阈值搜索
+def percentile_amax(histogram, bin_width, percentile):
+    """取累积分布首次达到 percentile% 的分箱上边界。"""
+    cdf = np.cumsum(histogram, dtype=np.float64)
+    index = int(np.searchsorted(cdf, cdf[-1] * percentile / 100.0))
+    return float(min(index + 1, len(histogram)) * bin_width)
+
+
+def mse_amax(histogram, bin_width, bits=8, stride=1):
+    """最小化期望量化误差的阈值。
+
+    对候选阈值 c（分箱边界）: 误差 = 截断部分 Σ h·(x - c)² + 未截断部分 N_in · step² / 12，
+    step = c / qmax。截断部分用 h、h·x、h·x² 的后缀和展开，所有候选一次性向量化计算。
+    """
+    _, qmax = QUANT_RANGES[bits]
+    counts = histogram.astype(np.float64)
+    centers = (np.arange(len(counts)) + 0.5) * bin_width
+
+    # suffix[k][i] = Σ_{j>=i} h_j · x_j^k，末尾补0对应不截断的候选
+    suffix = [np.append(np.cumsum((counts * centers ** k)[::-1])[::-1], 0.0) for k in range(3)]
+    candidates = np.arange(1, len(counts) + 1, stride)
+    if candidates[-1] != len(counts):
+        candidates = np.append(candidates, len(counts))
+    thresholds = candidates * bin_width
+
+    clip_error = suffix[2][candidates] - 2 * thresholds * suffix[1][candidates] + thresholds ** 2 * suffix[0][candidates]
+    inside = suffix[0][0] - suffix[0][candidates]
+    rounding_error = inside * (thresholds / qmax) ** 2 / 12.0
+    return float(thresholds[np.argmin(clip_error + rounding_error)])
+
+
+def _expand_quantized(histogram, num_levels):
+    """把前 i 个分箱合并为 num_levels 个量化级别，再按非零分箱均匀展开回 i 个分箱。"""
+    length = len(histogram)
+    starts = (np.arange(num_levels) * length) // num_levels
+    nonzero = histogram != 0
+    sums = np.add.reduceat(histogram, starts)
+    nonzero_counts = np.add.reduceat(nonzero.astype(np.int64), starts)
+    average = np.divide(sums, nonzero_counts, out=np.zeros(num_levels), where=nonzero_counts > 0)
+    return np.repeat(average, np.diff(np.append(starts, length))) * nonzero
+
+
+def kl_amax(histogram, bin_width, bits=8, stride=1):
+    """TensorRT 式熵校准: 选使 KL(P‖Q) 最小的截断分箱数 i。
+
+    P 为截断到 i 个分箱（超出部分累加到最后一个分箱）的原始分布，
+    Q 为把这 i 个分箱量化到 qmax + 1 个级别后再展开的分布。
+    """
+    _, qmax = QUANT_RANGES[bits]
+    num_levels = qmax + 1
+    counts = histogram.astype(np.float64)
+    if len(counts) <= num_levels:
+        return float(len(counts) * bin_width)
+
+    tail = np.append(np.cumsum(counts[::-1])[::-1], 0.0)
+    best_index, best_divergence = len(counts), np.inf
+    for i in range(num_levels, len(counts) + 1, stride):
+        reference = counts[:i].copy()
+        reference[-1] += tail[i]
+        expanded = _expand_quantized(counts[:i], num_levels)
+
+        total_p = reference.sum()
+        total_q = expanded.sum()
+        if total_p == 0 or total_q == 0:
+            continue
+        mask = reference > 0
+        p = reference[mask] / total_p
+        # 截断后最后一个分箱可能在 Q 中为0，用极小值平滑避免无穷大
+        q = np.maximum(expanded[mask] / total_q, 1e-12)
+        divergence = float(np.sum(p * np.log(p / q)))
+        if divergence < best_divergence:
+            best_index, best_divergence = i, divergence
+
+    return float(best_index * bin_width)
+
+
+# 示例3: 校准并与 absmax 对比量化误差
+def calibrate(data, method='mse', bits=8, num_bins=DEFAULT_NUM_BINS, percentile=99.99):
+    """收集单个张量的直方图并返回量化参数字典。"""
+    array = as_numpy(data)
+    calibrator = HistogramCalibrator(num_bins, bits).collect(array)
+    return calibrator.qparams(array.shape, method, percentile)
+
+
+def compare_methods(data, bits=8, methods=CALIBRATION_METHODS, num_bins=DEFAULT_NUM_BINS, percentile=99.99,
+                    calibrator=None):
+    """用各方法的 scale 量化 data，报告 MSE、SQNR 以及相对 absmax 的误差降低比例。
+
+    calibrator 可以是预先在其他批次上收集好的 HistogramCalibrator（例如校准集 vs 评估集）。
+    """
+    array = as_numpy(data)
+    if calibrator is None:
+        calibrator = HistogramCalibrator(num_bins, bits).collect(array)
+
+    # 整个张量共享一个 scale，一维数据按单行处理即可（int4 打包要求最后一维为偶数）
+    if array.ndim < 2:
+        array = array.reshape(1, -1)
+
+    results = {}
+    for method in methods:
+        amax = calibrator.compute_amax(method, percentile)
+        params = make_qparams(-amax, amax, array.shape, bits, 'tensor', symmetric=True)
+        q, _ = quantize(array, params)
+        summary = quantization_error(array, q, params)['summary']
+        results[method] = {
+            'amax': amax,
+            'scale': float(params['scale'][0]),
+            'mse': summary['mse'],
+            'sqnr_db': summary['mean_sqnr_db']
+        }
+
+    baseline = results.get('absmax', {}).get('mse')
+    for result in results.values():
+        result['mse_reduction'] = 1 - result['mse'] / baseline if baseline else None
+    return results
+
+
+def quantize_torch(tensor, params):
+    """用校准得到的参数调用 torch.quantize_per_tensor（仅 int8，torch 按需导入）。"""
+    import torch
+
+    if params['bits'] != 8:
+        raise ValueError("torch.quantize_per_tensor 只支持8位量化")
+    return torch.quantize_per_tensor(tensor.float(), scale=float(params['scale'][0]), zero_point=0,
+                                     dtype=torch.qint8)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='基于直方图的量化校准，对比 absmax / percentile / MSE / KL')
+
+    parser.add_argument('input', type=str, nargs='?', help='校准数据（.npy，可选，默认使用合成数据）')
+    parser.add_argument('--bits', type=int, choices=sorted(QUANT_RANGES), default=8, help='量化位宽')
+    parser.add_argument('--bins', type=int, default=DEFAULT_NUM_BINS, help='直方图分箱数')
+    parser.add_argument('--percentile', type=float, default=99.99, help='percentile 方法使用的百分位')
+
+    return parser.parse_args()
+
+
+# 演示代码
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.input:
+        data = np.load(args.input, mmap_mode='r')
+    else:
+        # 近似激活值的长尾分布，外加少量离群值
+        rng = np.random.default_rng(0)
+        data = rng.laplace(scale=1.0, size=4_000_000).astype(np.float32)
+        data[rng.integers(0, data.size, 20)] *= 40
+
+    results = compare_methods(data, args.bits, num_bins=args.bins, percentile=args.percentile)
+    for method, result in results.items():
+        reduction = result['mse_reduction']
+        print(f"{method:<10} amax {result['amax']:10.4f}  MSE {result['mse']:.4e}  "
+              f"SQNR {result['sqnr_db']:6.2f} dB  相对absmax误差降低 {reduction * 100 if reduction is not None else 0:6.2f}%")
+    sys.exit(0)
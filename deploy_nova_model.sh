@@ -44,7 +44,5 @@ aws bedrock get-provisioned-model-endpoint \
   --provisioned-model-name $PROVISIONED_MODEL_NAME \
   --region $REGION
 
-echo "部署完成！您现在可以使用以下命令测试您的模型:"
-echo "aws bedrock invoke-model --model-id $MODEL_ARN --body '{\"prompt\": \"测试提示\"}' --region $REGION output.json"
-echo "或者使用预置端点:"
-echo "aws bedrock invoke-provisioned-model --provisioned-model-name $PROVISIONED_MODEL_NAME --body '{\"prompt\": \"测试提示\"}' --region $REGION output.json"
+echo "部署完成！您现在可以使用以下命令测试您的模型（使用预置吞吐量ARN）:"
+echo "cd scripts && python3 nova_inference.py --model-id <PROVISIONED_MODEL_ARN> --images-dir ../data/images/test --region $REGION"
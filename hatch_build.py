@@ -0,0 +1,17 @@
+"""
+hatchling 构建钩子：只允许可编辑安装（pip install -e . / uv sync）
+
+scripts/ 下的脚本以顶层模块的方式互相导入，并按项目根目录解析 config.env、data/ 与 output/，
+所以项目只能以源码目录的形式运行。可编辑安装只把项目根目录写入 .pth（见 pyproject.toml 中的
+dev-mode-dirs）；普通 wheel 会把 main.py 和 scripts/ 当作顶层包装进 site-packages，
+而且找不到配置文件，因此直接拒绝构建。
+"""
+
+from hatchling.builders.hooks.plugin.interface import BuildHookInterface
+
+
+class EditableOnlyBuildHook(BuildHookInterface):
+    def initialize(self, version, build_data):
+        if version != 'editable':
+            raise RuntimeError(
+                "nova-fine-tunning 只支持可编辑安装: 请在项目根目录运行 pip install -e . 或 uv sync")
@@ -1,6 +1,85 @@
-def main():
-    print("Hello from nova-fine-tunning!")
+"""
+nova-ft: 各脚本的统一命令行入口
+
+    nova-ft <子命令> [参数...]
+    nova-ft prepare --train-only
+    nova-ft create-job --help
+
+子命令与 scripts/ 下的脚本一一对应，参数原样传给脚本的 main()。只有被调用的子命令对应的
+模块才会被导入，boto3、pandas、pydantic 等依赖由各脚本在需要时再导入，所以 --help、--dry-run
+等不访问AWS的调用可以很快返回。导入耗时预算由 scripts/check_import_time.py 检查。
+"""
+
+import os
+import sys
+import importlib
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+# 子命令 -> (模块名, 说明)
+COMMANDS = {
+    'labels': ('generate_labels_with_llm', '使用LLM生成标注CSV'),
+    'select': ('active_learning', '主动学习: 选出最值得标注的图像'),
+    'prepare': ('process_images_for_training', '上传图像并创建训练JSONL'),
+    'dataset': ('dataset_store', '管理列式主数据集并按条件渲染JSONL'),
+    'scan': ('image_scanner', '增量扫描图像目录（新增、修改、删除）'),
+    'ingest': ('ingest_daemon', '监视图像目录并持续追加训练数据'),
+    'validate': ('nova_ft_dataset_validator', '按Nova converse格式验证JSONL'),
+    'validate-dataset': ('validate_training_dataset', '验证训练数据集并生成报告'),
+    'upload': ('jsonl_to_s3', '上传JSONL到S3'),
+    'estimate': ('estimate_training_cost', '估算训练token数量、时长与费用'),
+    'create-job': ('create_nova_ft_job', '创建微调作业'),
+    'watch-job': ('training_watchdog', '实时检测训练异常并自动停止作业'),
+    'catalog': ('model_catalog', '查询基础模型目录与微调预检'),
+    'infer': ('nova_inference', '调用已部署模型进行推理'),
+    'evaluate': ('evaluate_model', '离线评估提取准确率'),
+    'serve': ('seller_extraction_service', '启动销售方提取HTTP微服务'),
+    'load-test': ('load_test_service', '微服务压测'),
+    'plot': ('visualize_training_metrics', '生成训练损失图表'),
+    'plot-detailed': ('visualize_detailed_metrics', '生成详细训练指标图表'),
+    'compare-runs': ('compare_training_runs', '多个微调作业的训练指标对比'),
+    'benchmark': ('benchmark_pipeline', '端到端流水线基准测试'),
+    'import-time': ('check_import_time', '检查各入口模块的导入耗时预算'),
+    'metrics': ('instrumentation', '打印运行指标文件中的热点'),
+    'settings': ('settings', '打印或校验配置'),
+}
+
+
+def print_usage(stream=sys.stdout):
+    print("用法: nova-ft <子命令> [参数...]\n\n子命令:", file=stream)
+    for name, (module_name, description) in COMMANDS.items():
+        print(f"  {name:<18} {description}（{module_name}.py）", file=stream)
+    print("\n查看子命令的参数: nova-ft <子命令> --help", file=stream)
+
+
+def exit_code(result):
+    """把脚本 main() 的返回值（None / bool / int）转换为进程退出码。"""
+    if result is None or result is True:
+        return 0
+    if result is False:
+        return 1
+    return result if isinstance(result, int) else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0
+
+    command, arguments = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"未知的子命令: {command}\n", file=sys.stderr)
+        print_usage(sys.stderr)
+        return 2
+
+    # 各脚本以顶层模块的方式互相导入
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    module = importlib.import_module(COMMANDS[command][0])
+    sys.argv = [f"nova-ft {command}"] + arguments
+    return exit_code(module.main())
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,367 @@
+"""
+向量化的权重量化库（在 test.py 的示例基础上扩展）
+
+- 量化粒度: 整个张量 (tensor)、按输出通道 (channel)、按分组/块 (group)
+- 对称量化，或带零点的非对称量化
+- int8，以及每字节打包两个值的 int4
+- out= 参数与原地 (fake_quantize_) 版本，按行分块处理，只使用固定大小的工作缓冲区，
+  可直接处理 np.memmap 上的多GB权重矩阵而不产生完整的浮点副本
+- 按分组报告量化误差 (MSE、最大绝对误差、SQNR)
+
+约定与 PyTorch 一致: q = clip(round(x / scale) + zero_point)，x ≈ (q - zero_point) * scale。
+注意 test.py 中的 simple_quantize_float32_to_int8 使用的是倒数形式的 scale (127 / absmax)。
+"""
+
+import numpy as np
+
+# 各位宽的有符号整数取值范围
+QUANT_RANGES = {8: (-128, 127), 4: (-8, 7)}
+
+# 每个分块的工作缓冲区大小上限（字节）
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+GRANULARITIES = ('tensor', 'channel', 'group')
+
+
+# 示例1: 把任意形状的数组看作二维的“分组视图”，每一行对应一组量化参数
+def group_view(data, granularity='channel', group_size=128):
+    """返回 (行数, 每行元素数) 的二维视图（不复制数据）。
+
+    - tensor: 按第一维展开为多行，所有行共享同一组参数
+    - channel: 每个输出通道（第一维）一行
+    - group: 沿最后一维每 group_size 个元素一行
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"不支持的量化粒度: {granularity}，可选 {GRANULARITIES}")
+    if not data.flags['C_CONTIGUOUS']:
+        raise ValueError("输入数组必须是C连续的（可使用 np.ascontiguousarray）")
+
+    if data.ndim == 0:
+        return data.reshape(1, 1)
+    if granularity == 'group':
+        if data.shape[-1] % group_size != 0:
+            raise ValueError(f"最后一维 {data.shape[-1]} 不能被分组大小 {group_size} 整除")
+        return data.reshape(-1, group_size)
+    return data.reshape(data.shape[0], -1)
+
+
+def chunk_rows_for(row_length, itemsize=4, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """根据工作缓冲区大小上限计算每块的行数。"""
+    return max(1, chunk_bytes // max(1, row_length * itemsize))
+
+
+def iter_chunks(num_rows, chunk_rows):
+    """按行分块迭代 (起始行, 结束行)。"""
+    for start in range(0, num_rows, chunk_rows):
+        yield start, min(start + chunk_rows, num_rows)
+
+
+# 示例2: 流式计算量化参数
+def row_min_max(rows, chunk_rows=None, on_chunk=None):
+    """分块计算每行的最小值和最大值（不创建 np.abs 之类的整块临时数组）。
+
+    on_chunk(已处理行数, 总行数) 在每个分块处理完后调用，可用于进度统计或释放内存映射页。
+    """
+    num_rows, row_length = rows.shape
+    chunk_rows = chunk_rows or chunk_rows_for(row_length, rows.itemsize)
+    row_min = np.empty(num_rows, dtype=np.float32)
+    row_max = np.empty(num_rows, dtype=np.float32)
+    for start, end in iter_chunks(num_rows, chunk_rows):
+        np.min(rows[start:end], axis=1, out=row_min[start:end])
+        np.max(rows[start:end], axis=1, out=row_max[start:end])
+        if on_chunk:
+            on_chunk(end, num_rows)
+    return row_min, row_max
+
+
+def row_percentiles(rows, lower, upper, chunk_rows=None, on_chunk=None):
+    """分块计算每行的上下百分位数（每块只产生与分块同样大小的临时数组）。"""
+    num_rows, row_length = rows.shape
+    chunk_rows = chunk_rows or chunk_rows_for(row_length, rows.itemsize)
+    row_lower = np.empty(num_rows, dtype=np.float32)
+    row_upper = np.empty(num_rows, dtype=np.float32)
+    for start, end in iter_chunks(num_rows, chunk_rows):
+        row_lower[start:end], row_upper[start:end] = np.percentile(rows[start:end], [lower, upper], axis=1)
+        if on_chunk:
+            on_chunk(end, num_rows)
+    return row_lower, row_upper
+
+
+def scale_zero_point_from_range(range_min, range_max, bits=8, symmetric=True):
+    """由取值范围计算 scale 和 zero_point（全0的组使用 scale=1）。"""
+    qmin, qmax = QUANT_RANGES[bits]
+    range_min = np.minimum(np.asarray(range_min, dtype=np.float32), 0)
+    range_max = np.maximum(np.asarray(range_max, dtype=np.float32), 0)
+
+    if symmetric:
+        scale = np.maximum(-range_min, range_max) / np.float32(qmax)
+    else:
+        scale = (range_max - range_min) / np.float32(qmax - qmin)
+    scale = np.where(scale > 0, scale, np.float32(1.0)).astype(np.float32)
+
+    zero_point = None
+    if not symmetric:
+        zero_point = np.clip(np.rint(qmin - range_min / scale), qmin, qmax).astype(np.int32)
+    return scale, zero_point
+
+
+def make_qparams(range_min, range_max, shape, bits=8, granularity='channel', group_size=128, symmetric=True):
+    """由每组（tensor粒度时为单个）的取值范围构造参数字典。
+
+    参数字典包含 scale / zero_point（每组一个值）以及恢复分组视图所需的元信息，
+    可以直接用 np.savez 保存为sidecar文件。
+    """
+    if bits not in QUANT_RANGES:
+        raise ValueError(f"不支持的位宽: {bits}，可选 {sorted(QUANT_RANGES)}")
+    scale, zero_point = scale_zero_point_from_range(np.atleast_1d(range_min), np.atleast_1d(range_max),
+                                                    bits, symmetric)
+    return {
+        'bits': bits,
+        'granularity': granularity,
+        'group_size': group_size if granularity == 'group' else None,
+        'symmetric': symmetric,
+        'shape': tuple(shape),
+        'scale': scale,
+        'zero_point': zero_point
+    }
+
+
+def compute_qparams(data, bits=8, granularity='channel', group_size=128, symmetric=True, chunk_rows=None,
+                    on_chunk=None):
+    """按最大最小值（absmax）计算量化参数，返回参数字典。"""
+    rows = group_view(data, granularity, group_size)
+    row_min, row_max = row_min_max(rows, chunk_rows, on_chunk)
+    if granularity == 'tensor':
+        row_min, row_max = row_min.min(keepdims=True), row_max.max(keepdims=True)
+    return make_qparams(row_min, row_max, data.shape, bits, granularity, group_size, symmetric)
+
+
+def row_params(params, start, end):
+    """取出 [start, end) 行对应的列向量形式的 scale 与 zero_point（tensor粒度时广播单个值）。"""
+    scale = params['scale']
+    zero_point = params['zero_point']
+    if len(scale) == 1:
+        return scale.reshape(1, 1), None if zero_point is None else zero_point.reshape(1, 1)
+    return scale[start:end, None], None if zero_point is None else zero_point[start:end, None]
+
+
+def packed_shape(shape, bits):
+    """量化结果的存储形状（int4 时最后一维减半）。"""
+    if bits == 4:
+        if not shape or shape[-1] % 2 != 0:
+            raise ValueError("int4打包要求最后一维为偶数")
+        return tuple(shape[:-1]) + (shape[-1] // 2,)
+    return tuple(shape)
+
+
+def storage_dtype(bits):
+    """量化结果的存储类型。"""
+    return np.uint8 if bits == 4 else np.int8
+
+
+# 示例3: int4 打包与解包
+def pack_int4(values, out=None):
+    """把取值在 [-8, 7] 的整数（任意数值类型）沿最后一维两两打包进一个字节。
+
+    偶数下标存低4位，奇数下标存高4位。
+    """
+    values = np.asarray(values)
+    if values.shape[-1] % 2 != 0:
+        raise ValueError("int4打包要求最后一维为偶数")
+    if out is None:
+        out = np.empty(values.shape[:-1] + (values.shape[-1] // 2,), dtype=np.uint8)
+    low = (values[..., 0::2] + 8).astype(np.uint8)
+    high = (values[..., 1::2] + 8).astype(np.uint8)
+    np.left_shift(high, 4, out=high)
+    np.bitwise_or(low, high, out=out)
+    return out
+
+
+def unpack_int4(packed, out=None, dtype=np.int8):
+    """把打包的 int4 解包为 [-8, 7] 范围的整数。"""
+    packed = np.asarray(packed, dtype=np.uint8)
+    if out is None:
+        out = np.empty(packed.shape[:-1] + (packed.shape[-1] * 2,), dtype=dtype)
+    np.bitwise_and(packed, 0x0F, out=out[..., 0::2], casting='unsafe')
+    np.right_shift(packed, 4, out=out[..., 1::2], casting='unsafe')
+    np.subtract(out, 8, out=out, casting='unsafe')
+    return out
+
+
+# 示例4: 分块量化核心
+def _quantize_rows_into(work, src, scale, zero_point, qmin, qmax):
+    """在工作缓冲区 work 中完成 round(x / scale) + zero_point 并截断（原地运算）。"""
+    np.divide(src, scale, out=work)
+    np.rint(work, out=work)
+    if zero_point is not None:
+        np.add(work, zero_point, out=work)
+    np.clip(work, qmin, qmax, out=work)
+    return work
+
+
+def _store_rows(work, out_rows, bits):
+    """把工作缓冲区中的整数值写入输出（int4 时就地打包）。"""
+    if bits == 4:
+        # 平移到 [0, 15]，高位乘16后与低位相加，全部在工作缓冲区的视图上完成
+        np.add(work, 8, out=work)
+        low, high = work[:, 0::2], work[:, 1::2]
+        np.multiply(high, 16, out=high)
+        np.add(low, high, out=low)
+        np.copyto(out_rows, low, casting='unsafe')
+    else:
+        np.copyto(out_rows, work, casting='unsafe')
+
+
+def _load_rows(q_rows, work, bits):
+    """把量化结果读入工作缓冲区（int4 时解包）。"""
+    if bits == 4:
+        np.bitwise_and(q_rows, 0x0F, out=work[:, 0::2], casting='unsafe')
+        np.right_shift(q_rows, 4, out=work[:, 1::2], casting='unsafe')
+        np.subtract(work, 8, out=work)
+    else:
+        np.copyto(work, q_rows, casting='unsafe')
+    return work
+
+
+def quantize(data, params=None, out=None, chunk_rows=None, bits=8, granularity='channel',
+             group_size=128, symmetric=True, on_chunk=None):
+    """量化浮点数组，返回 (量化结果, 参数字典)。
+
+    params 为空时先计算量化参数；out 可以是预先分配的数组或 np.memmap（形状为 packed_shape）。
+    每次只在一个 (chunk_rows, 行长度) 的 float32 工作缓冲区上运算。
+    """
+    if params is None:
+        params = compute_qparams(data, bits, granularity, group_size, symmetric, chunk_rows)
+    bits = params['bits']
+    qmin, qmax = QUANT_RANGES[bits]
+
+    if out is None:
+        out = np.empty(packed_shape(data.shape, bits), dtype=storage_dtype(bits))
+    rows = group_view(data, params['granularity'], params['group_size'] or group_size)
+    out_rows = out.reshape(rows.shape[0], -1)
+
+    num_rows, row_length = rows.shape
+    if bits == 4 and row_length % 2 != 0:
+        raise ValueError("int4打包要求每组的元素数为偶数")
+    chunk_rows = chunk_rows or chunk_rows_for(row_length)
+    work = np.empty((min(chunk_rows, num_rows), row_length), dtype=np.float32)
+
+    for start, end in iter_chunks(num_rows, chunk_rows):
+        scale, zero_point = row_params(params, start, end)
+        buffer = work[:end - start]
+        _quantize_rows_into(buffer, rows[start:end], scale, zero_point, qmin, qmax)
+        _store_rows(buffer, out_rows[start:end], bits)
+        if on_chunk:
+            on_chunk(end, num_rows)
+
+    return out, params
+
+
+def dequantize(q, params, out=None, chunk_rows=None, dtype=np.float32):
+    """反量化: (q - zero_point) * scale，可写入预先分配的 out。"""
+    bits = params['bits']
+    if out is None:
+        out = np.empty(params['shape'], dtype=dtype)
+    rows = group_view(out, params['granularity'], params['group_size'] or 1)
+    q_rows = q.reshape(rows.shape[0], -1)
+
+    num_rows, row_length = rows.shape
+    chunk_rows = chunk_rows or chunk_rows_for(row_length)
+    for start, end in iter_chunks(num_rows, chunk_rows):
+        scale, zero_point = row_params(params, start, end)
+        target = rows[start:end]
+        _load_rows(q_rows[start:end], target, bits)
+        if zero_point is not None:
+            np.subtract(target, zero_point, out=target, casting='unsafe')
+        np.multiply(target, scale, out=target, casting='unsafe')
+
+    return out
+
+
+def fake_quantize_(data, params=None, chunk_rows=None, **kwargs):
+    """原地量化再反量化（模拟量化误差），不分配与输入同样大小的数组。"""
+    if params is None:
+        params = compute_qparams(data, chunk_rows=chunk_rows, **kwargs)
+    qmin, qmax = QUANT_RANGES[params['bits']]
+    rows = group_view(data, params['granularity'], params['group_size'] or 1)
+
+    num_rows, row_length = rows.shape
+    chunk_rows = chunk_rows or chunk_rows_for(row_length, rows.itemsize)
+    for start, end in iter_chunks(num_rows, chunk_rows):
+        scale, zero_point = row_params(params, start, end)
+        target = rows[start:end]
+        _quantize_rows_into(target, target, scale, zero_point, qmin, qmax)
+        if zero_point is not None:
+            np.subtract(target, zero_point, out=target)
+        np.multiply(target, scale, out=target)
+
+    return data, params
+
+
+# 示例5: 按组统计量化误差
+def quantization_error(data, q, params, chunk_rows=None, on_chunk=None):
+    """按组计算量化误差，返回每组的 MSE、最大绝对误差、SQNR(dB) 以及整体汇总。"""
+    rows = group_view(data, params['granularity'], params['group_size'] or 1)
+    q_rows = q.reshape(rows.shape[0], -1)
+    num_rows, row_length = rows.shape
+    chunk_rows = chunk_rows or chunk_rows_for(row_length)
+
+    squared_error = np.empty(num_rows, dtype=np.float64)
+    signal_power = np.empty(num_rows, dtype=np.float64)
+    max_abs_error = np.empty(num_rows, dtype=np.float32)
+    work = np.empty((min(chunk_rows, num_rows), row_length), dtype=np.float32)
+
+    for start, end in iter_chunks(num_rows, chunk_rows):
+        scale, zero_point = row_params(params, start, end)
+        src = rows[start:end]
+        buffer = _load_rows(q_rows[start:end], work[:end - start], params['bits'])
+        if zero_point is not None:
+            np.subtract(buffer, zero_point, out=buffer)
+        np.multiply(buffer, scale, out=buffer)
+        np.subtract(src, buffer, out=buffer)
+        squared_error[start:end] = np.einsum('ij,ij->i', buffer, buffer, dtype=np.float64)
+        signal_power[start:end] = np.einsum('ij,ij->i', src, src, dtype=np.float64)
+        np.abs(buffer, out=buffer)
+        np.max(buffer, axis=1, out=max_abs_error[start:end])
+        if on_chunk:
+            on_chunk(end, num_rows)
+
+    if params['granularity'] == 'tensor':
+        squared_error = squared_error.sum(keepdims=True)
+        signal_power = signal_power.sum(keepdims=True)
+        max_abs_error = max_abs_error.max(keepdims=True)
+        row_length = rows.size
+
+    mse = squared_error / row_length
+    with np.errstate(divide='ignore'):
+        sqnr_db = 10 * np.log10(signal_power / np.maximum(squared_error, np.finfo(np.float64).tiny))
+
+    return {
+        'mse': mse,
+        'max_abs_error': max_abs_error,
+        'sqnr_db': sqnr_db,
+        'summary': {
+            'groups': int(len(mse)),
+            'mse': float(squared_error.sum() / rows.size),
+            'max_abs_error': float(max_abs_error.max()),
+            'mean_sqnr_db': float(np.mean(sqnr_db[np.isfinite(sqnr_db)])) if np.isfinite(sqnr_db).any() else float('inf'),
+            'worst_group': int(np.argmax(mse))
+        }
+    }
+
+
+# 演示代码
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    weights = rng.standard_normal((256, 1024)).astype(np.float32)
+    # 人为制造一个离群通道，展示逐通道/分组量化的优势
+    weights[3] *= 50
+
+    for bits, granularity, symmetric in [(8, 'tensor', True), (8, 'channel', True), (8, 'group', False),
+                                         (4, 'channel', True), (4, 'group', True)]:
+        q, params = quantize(weights, bits=bits, granularity=granularity, group_size=64, symmetric=symmetric)
+        error = quantization_error(weights, q, params)['summary']
+        recovered = dequantize(q, params)
+        print(f"int{bits} {granularity:<7} {'对称' if symmetric else '非对称'}: "
+              f"存储 {q.nbytes / weights.nbytes:.3f}x, MSE {error['mse']:.6f}, "
+              f"平均SQNR {error['mean_sqnr_db']:.1f} dB, 最大误差 {np.max(np.abs(weights - recovered)):.4f}")
@@ -0,0 +1,257 @@
+"""
+通过内存映射量化大型权重文件（.npy 或 safetensors 格式）
+
+两遍处理:
+  1. 流式计算每组的量化参数（absmax 或百分位截断）
+  2. 分块量化并写出 int8/int4 结果（.npy，可用 np.load(mmap_mode='r') 零拷贝加载）
+     以及量化参数sidecar（.qparams.npz）
+
+输入输出都通过 np.memmap 访问，每处理完一个分块就释放已映射的页面，
+因此无论文件多大，峰值常驻内存（RSS）都只与分块大小有关。
+
+用法:
+  python quantize_weights.py model.safetensors --output-dir quantized --bits 4 --granularity group
+  python quantize_weights.py weight.npy --output-dir quantized --method percentile --percentile 99.99
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import resource
+
+import numpy as np
+
+from quantization import (DEFAULT_CHUNK_BYTES, GRANULARITIES, QUANT_RANGES, chunk_rows_for, group_view,
+                          make_qparams, packed_shape, quantization_error, quantize, row_min_max,
+                          row_percentiles, storage_dtype)
+
+# safetensors 的 dtype 名称到 numpy 类型的映射（bfloat16 无法用 numpy 直接映射，不支持）
+SAFETENSORS_DTYPES = {'F64': np.float64, 'F32': np.float32, 'F16': np.float16}
+
+# 张量粒度下估计百分位数时的最大采样点数
+PERCENTILE_SAMPLE_SIZE = 10_000_000
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='通过内存映射量化大型权重文件')
+
+    parser.add_argument('input', type=str, help='输入权重文件（.npy 或 .safetensors）')
+    parser.add_argument('--output-dir', type=str, required=True, help='输出目录')
+    parser.add_argument('--bits', type=int, choices=sorted(QUANT_RANGES), default=8, help='量化位宽')
+    parser.add_argument('--granularity', type=str, choices=GRANULARITIES, default='channel', help='量化粒度')
+    parser.add_argument('--group-size', type=int, default=128, help='分组量化时每组的元素数')
+    parser.add_argument('--asymmetric', action='store_true', help='使用带零点的非对称量化')
+    parser.add_argument('--method', type=str, choices=['absmax', 'percentile'], default='absmax',
+                        help='量化范围的计算方法')
+    parser.add_argument('--percentile', type=float, default=99.99, help='百分位截断方法使用的百分位')
+    parser.add_argument('--chunk-mb', type=int, default=DEFAULT_CHUNK_BYTES // (1024 * 1024),
+                        help='每个分块的工作缓冲区大小（MB）')
+    parser.add_argument('--tensor', type=str, action='append', help='只量化名称匹配该正则的张量（可重复指定）')
+    parser.add_argument('--report-error', action='store_true', help='额外做一遍计算每组的量化误差')
+
+    return parser.parse_args()
+
+
+def load_tensors(path):
+    """以只读内存映射方式打开权重文件，返回 {名称: np.memmap}。"""
+    if path.endswith('.npy'):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return {name: np.load(path, mmap_mode='r')}
+
+    # safetensors: 8字节小端头长度 + JSON头 + 连续的张量数据
+    with open(path, 'rb') as f:
+        header_length = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_length))
+
+    tensors = {}
+    data_start = 8 + header_length
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        dtype = SAFETENSORS_DTYPES.get(info['dtype'])
+        if dtype is None:
+            print(f"跳过不支持的数据类型 {info['dtype']}: {name}")
+            continue
+        begin, end = info['data_offsets']
+        shape = tuple(info['shape'])
+        if end - begin != int(np.prod(shape)) * np.dtype(dtype).itemsize:
+            raise ValueError(f"张量 {name} 的数据长度与形状不符")
+        tensors[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + begin, shape=shape)
+    return tensors
+
+
+def release_pages(array):
+    """对内存映射数组调用 madvise(MADV_DONTNEED)，把已处理的页从进程常驻内存中释放。
+
+    对只读映射，页面仍留在系统页缓存中；对可写的共享映射，脏页在页缓存中不会丢失。
+    """
+    mapping = getattr(array, '_mmap', None)
+    if mapping is None or not hasattr(mapping, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    mapping.madvise(mmap.MADV_DONTNEED)
+
+
+def compute_range(rows, granularity, method, percentile, chunk_rows, on_chunk):
+    """第一遍: 流式计算每组（或整个张量）的取值范围。"""
+    if method == 'percentile':
+        lower = 100.0 - percentile
+        if granularity == 'tensor':
+            # 整个张量的百分位用等间隔采样估计，避免排序整个文件
+            flat = rows.reshape(-1)
+            step = max(1, flat.size // PERCENTILE_SAMPLE_SIZE)
+            sample = np.asarray(flat[::step], dtype=np.float32)
+            range_min, range_max = np.percentile(sample, [lower, percentile])
+            on_chunk(rows.shape[0], rows.shape[0])
+            return np.float32(range_min), np.float32(range_max)
+        return row_percentiles(rows, lower, percentile, chunk_rows, on_chunk)
+
+    range_min, range_max = row_min_max(rows, chunk_rows, on_chunk)
+    if granularity == 'tensor':
+        return range_min.min(), range_max.max()
+    return range_min, range_max
+
+
+def safe_file_name(name):
+    """将张量名称转换为文件名。"""
+    return re.sub(r'[^\w\-.]+', '_', name)
+
+
+def quantize_tensor(name, tensor, args, output_dir):
+    """对单个张量执行两遍量化，返回统计信息。"""
+    chunk_bytes = args.chunk_mb * 1024 * 1024
+    data = tensor if tensor.ndim > 1 else tensor.reshape(1, -1)
+    group_size = args.group_size
+    if args.granularity == 'group' and data.shape[-1] % group_size != 0:
+        raise ValueError(f"{name}: 最后一维 {data.shape[-1]} 不能被分组大小 {group_size} 整除")
+
+    rows = group_view(data, args.granularity, group_size)
+    chunk_rows = chunk_rows_for(rows.shape[1], 4, chunk_bytes)
+
+    def release_input(done, total):
+        release_pages(tensor)
+
+    # 第一遍: 计算量化参数
+    start = time.monotonic()
+    range_min, range_max = compute_range(rows, args.granularity, args.method, args.percentile,
+                                         chunk_rows, release_input)
+    params = make_qparams(range_min, range_max, data.shape, args.bits, args.granularity, group_size,
+                          not args.asymmetric)
+    scan_seconds = time.monotonic() - start
+
+    # 第二遍: 分块量化，直接写入可内存映射的 .npy 文件
+    base = os.path.join(output_dir, safe_file_name(name))
+    output_path = base + '.q.npy'
+    out = np.lib.format.open_memmap(output_path, mode='w+', dtype=storage_dtype(args.bits),
+                                    shape=packed_shape(data.shape, args.bits))
+
+    def release_both(done, total):
+        out.flush()
+        release_pages(out)
+        release_pages(tensor)
+
+    start = time.monotonic()
+    quantize(data, params, out=out, chunk_rows=chunk_rows, on_chunk=release_both)
+    out.flush()
+    quantize_seconds = time.monotonic() - start
+
+    # 保存量化参数sidecar
+    sidecar_path = base + '.qparams.npz'
+    np.savez(
+        sidecar_path,
+        scale=params['scale'],
+        zero_point=params['zero_point'] if params['zero_point'] is not None else np.zeros(0, np.int32),
+        meta=json.dumps({
+            'name': name,
+            'bits': params['bits'],
+            'granularity': params['granularity'],
+            'group_size': params['group_size'],
+            'symmetric': params['symmetric'],
+            'shape': list(params['shape']),
+            'original_shape': list(tensor.shape),
+            'original_dtype': str(tensor.dtype),
+            'method': args.method
+        })
+    )
+
+    stats = {
+        'name': name,
+        'shape': list(tensor.shape),
+        'input_bytes': int(tensor.nbytes),
+        'output_bytes': int(out.nbytes),
+        'scan_gbps': tensor.nbytes / scan_seconds / 1e9 if scan_seconds > 0 else None,
+        'quantize_gbps': tensor.nbytes / quantize_seconds / 1e9 if quantize_seconds > 0 else None,
+        'output': output_path,
+        'sidecar': sidecar_path
+    }
+
+    if args.report_error:
+        error = quantization_error(data, out, params, chunk_rows, on_chunk=release_both)
+        stats['error'] = error['summary']
+
+    return stats
+
+
+def load_quantized(base_path):
+    """零拷贝加载量化结果，返回 (量化数组的只读内存映射, 参数字典)。"""
+    q = np.load(base_path + '.q.npy', mmap_mode='r')
+    sidecar = np.load(base_path + '.qparams.npz')
+    meta = json.loads(str(sidecar['meta']))
+    params = {
+        'bits': meta['bits'],
+        'granularity': meta['granularity'],
+        'group_size': meta['group_size'],
+        'symmetric': meta['symmetric'],
+        'shape': tuple(meta['shape']),
+        'scale': sidecar['scale'],
+        'zero_point': sidecar['zero_point'] if sidecar['zero_point'].size else None
+    }
+    return q, params
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB）。"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    args = parse_arguments()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    tensors = load_tensors(args.input)
+    if args.tensor:
+        patterns = [re.compile(pattern) for pattern in args.tensor]
+        tensors = {name: t for name, t in tensors.items() if any(p.search(name) for p in patterns)}
+    if not tensors:
+        print("没有需要量化的张量")
+        return 1
+
+    start = time.monotonic()
+    manifest = []
+    total_bytes = 0
+    for name, tensor in tensors.items():
+        stats = quantize_tensor(name, tensor, args, args.output_dir)
+        manifest.append(stats)
+        total_bytes += stats['input_bytes']
+        message = (f"{name} {tuple(tensor.shape)}: {stats['input_bytes'] / 1e6:.1f} MB -> "
+                   f"{stats['output_bytes'] / 1e6:.1f} MB，扫描 {stats['scan_gbps'] or 0:.2f} GB/s，"
+                   f"量化 {stats['quantize_gbps'] or 0:.2f} GB/s")
+        if 'error' in stats:
+            message += f"，MSE {stats['error']['mse']:.3e}，平均SQNR {stats['error']['mean_sqnr_db']:.1f} dB"
+        print(message)
+    elapsed = time.monotonic() - start
+
+    with open(os.path.join(args.output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'input': args.input, 'tensors': manifest}, f, ensure_ascii=False, indent=2)
+
+    print(f"共 {len(manifest)} 个张量，{total_bytes / 1e9:.2f} GB，耗时 {elapsed:.1f} 秒，"
+          f"整体吞吐 {total_bytes / elapsed / 1e9 if elapsed > 0 else 0:.2f} GB/s，峰值RSS {peak_rss_mb():.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+CPU 上的 int8 矩阵乘法（GEMM / GEMV）
+
+test.py 只演示了量化本身，这里给出直接在量化数据上计算的几条路径，约定 y = x @ W.T，
+W 形状为 (输出通道, 输入维度)，与 quantization.py 的 channel/group 粒度一致:
+
+- int8_matmul: int8 × int8，int32 累加。按 (block_n, block_k) 分块，每个权重分块只在
+  固定大小、可驻留缓存的缓冲区中转换类型。backend='blas' 时在 float32 BLAS 上计算
+  每个 K 分块——int8 乘积之和在 |Σ| ≤ 1024·128·128 = 2^24 以内可被 float32 精确表示，
+  所以结果与纯整数累加逐位一致；backend='integer' 为纯 int32 的参考实现
+- quantized_linear: 激活按行（token）动态量化为 int8，调用 int8_matmul，再乘以两侧的 scale
+- dequant_matmul: 融合的“反量化 + 乘法”（仅权重量化），逐块把 int8/int4 权重反量化到
+  工作缓冲区后立即相乘，不生成完整的 float32 权重
+- torch_dynamic_linear: 使用 torch 的 CPU 量化算子（fbgemm/qnnpack），torch 按需导入
+"""
+
+import numpy as np
+
+from quantization import QUANT_RANGES, _load_rows, iter_chunks, quantize, row_params
+
+# float32 可以精确表示 int8 乘积之和的最大 K 分块
+EXACT_BLOCK_K = 1024
+
+# 权重分块的默认输出通道数（block_n × block_k 的 float32 分块约 1MB，可驻留 L2）
+DEFAULT_BLOCK_N = 256
+
+MATMUL_BACKENDS = ('blas', 'integer')
+
+
+# 示例1: 激活的动态量化
+def quantize_activations(x, bits=8):
+    """按行对称量化激活，返回 (int8 数组, 每行 scale)。"""
+    x = np.atleast_2d(np.asarray(x, dtype=np.float32))
+    _, qmax = QUANT_RANGES[bits]
+    scale = np.max(np.abs(x), axis=1) / np.float32(qmax)
+    scale = np.where(scale > 0, scale, np.float32(1.0)).astype(np.float32)
+    q = np.empty(x.shape, dtype=np.int8)
+    work = x / scale[:, None]
+    np.rint(work, out=work)
+    np.clip(work, -qmax - 1, qmax, out=work)
+    np.copyto(q, work, casting='unsafe')
+    return q, scale
+
+
+# 示例2: int8 GEMM / GEMV，int32 累加
+def int8_matmul(a, w, out=None, block_n=DEFAULT_BLOCK_N, block_k=EXACT_BLOCK_K, backend='blas'):
+    """计算 a @ w.T（a: (M, K) 或 (K,) 的 int8，w: (N, K) 的 int8），返回 int32 结果。
+
+    一维 a 时走 GEMV，返回 (N,)。
+    """
+    if backend not in MATMUL_BACKENDS:
+        raise ValueError(f"不支持的后端: {backend}，可选 {MATMUL_BACKENDS}")
+    if a.dtype != np.int8 or w.dtype != np.int8:
+        raise ValueError("int8_matmul 的输入必须是 int8")
+    vector = a.ndim == 1
+    a = np.atleast_2d(a)
+    (m, k), (n, k_w) = a.shape, w.shape
+    if k != k_w:
+        raise ValueError(f"维度不匹配: a 为 {a.shape}，w 为 {w.shape}")
+    if backend == 'blas' and block_k > EXACT_BLOCK_K:
+        raise ValueError(f"blas 后端的 block_k 不能超过 {EXACT_BLOCK_K}，否则 float32 累加不再精确")
+
+    if out is None:
+        out = np.zeros((m, n), dtype=np.int32)
+    else:
+        out[...] = 0
+
+    work_dtype = np.float32 if backend == 'blas' else np.int32
+    # 激活通常远小于权重，一次性转换；权重逐块转换到固定缓冲区
+    a_work = a.astype(work_dtype)
+    w_tile = np.empty((min(block_n, n), min(block_k, k)), dtype=work_dtype)
+    partial = np.empty((m, min(block_n, n)), dtype=work_dtype)
+
+    for n0, n1 in iter_chunks(n, block_n):
+        target = out[:, n0:n1]
+        for k0, k1 in iter_chunks(k, block_k):
+            tile = w_tile[:n1 - n0, :k1 - k0]
+            np.copyto(tile, w[n0:n1, k0:k1], casting='unsafe')
+            block = partial[:, :n1 - n0]
+            np.matmul(a_work[:, k0:k1], tile.T, out=block)
+            np.add(target, block, out=target, casting='unsafe')
+
+    return out[0] if vector else out
+
+
+def quantized_linear(x, w_q, w_params, block_n=DEFAULT_BLOCK_N, block_k=EXACT_BLOCK_K, backend='blas'):
+    """int8 线性层: 动态量化激活 → int8 GEMM(int32 累加) → 乘以激活与权重的 scale。
+
+    权重需为 quantization.quantize 生成的对称 int8 张量/逐通道量化结果。
+    """
+    if w_params['bits'] != 8 or not w_params['symmetric'] or w_params['granularity'] == 'group':
+        raise ValueError("整数路径只支持对称的 int8 张量/逐通道量化权重，其他情况请使用 dequant_matmul")
+    vector = np.ndim(x) == 1
+    x_q, x_scale = quantize_activations(x)
+    accumulator = int8_matmul(x_q, w_q, block_n=block_n, block_k=block_k, backend=backend)
+
+    out = accumulator.astype(np.float32)
+    np.multiply(out, x_scale[:, None], out=out)
+    np.multiply(out, w_params['scale'][None, :] if len(w_params['scale']) > 1 else w_params['scale'][0], out=out)
+    return out[0] if vector else out
+
+
+# 示例3: 融合的反量化 + 乘法（仅权重量化）
+def dequant_matmul(x, w_q, w_params, out=None, block_n=DEFAULT_BLOCK_N):
+    """计算 x @ dequantize(w_q).T，逐块反量化权重，支持 int8/int4、各量化粒度与零点。"""
+    vector = np.ndim(x) == 1
+    x = np.atleast_2d(np.asarray(x, dtype=np.float32))
+    n, k = w_params['shape']
+    if x.shape[1] != k:
+        raise ValueError(f"维度不匹配: x 为 {x.shape}，权重为 {(n, k)}")
+
+    granularity = w_params['granularity']
+    group_size = w_params['group_size'] or k
+    rows_per_channel = k // group_size if granularity == 'group' else 1
+    q_rows = w_q.reshape(n * rows_per_channel, -1)
+    row_length = group_size if granularity == 'group' else k
+
+    if out is None:
+        out = np.empty((x.shape[0], n), dtype=np.float32)
+    tile = np.empty((min(block_n, n) * rows_per_channel, row_length), dtype=np.float32)
+
+    for n0, n1 in iter_chunks(n, block_n):
+        start, end = n0 * rows_per_channel, n1 * rows_per_channel
+        buffer = _load_rows(q_rows[start:end], tile[:end - start], w_params['bits'])
+        scale, zero_point = row_params(w_params, start, end)
+        if zero_point is not None:
+            np.subtract(buffer, zero_point, out=buffer)
+        np.multiply(buffer, scale, out=buffer)
+        np.matmul(x, buffer.reshape(n1 - n0, k).T, out=out[:, n0:n1])
+
+    return out[0] if vector else out
+
+
+# 示例4: torch 的 CPU 量化算子
+def torch_dynamic_linear(weight, per_channel=True):
+    """用 torch.ops.quantized 预打包 int8 权重，返回 numpy 输入输出的动态量化线性层函数。
+
+    torch 按需导入；使用当前 torch.backends.quantized.engine（x86 上默认为 fbgemm）。
+    """
+    import torch
+
+    weight = np.ascontiguousarray(weight, dtype=np.float32)
+    w = torch.from_numpy(weight)
+    if per_channel:
+        scale = np.max(np.abs(weight), axis=1) / 127.0
+        scale = np.where(scale > 0, scale, 1.0)
+        w_q = torch.quantize_per_channel(w, torch.from_numpy(scale.astype(np.float64)),
+                                         torch.zeros(weight.shape[0], dtype=torch.int64), 0, torch.qint8)
+    else:
+        scale = float(np.max(np.abs(weight))) / 127.0 or 1.0
+        w_q = torch.quantize_per_tensor(w, scale, 0, torch.qint8)
+    packed = torch.ops.quantized.linear_prepack(w_q, None)
+
+    def linear(x):
+        with torch.no_grad():
+            return torch.ops.quantized.linear_dynamic(torch.from_numpy(np.atleast_2d(x)), packed).numpy()
+
+    return linear
+
+
+# 演示代码
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    weight = rng.standard_normal((512, 2048)).astype(np.float32)
+    x = rng.standard_normal((16, 2048)).astype(np.float32)
+    reference = x @ weight.T
+
+    w_q, w_params = quantize(weight, bits=8, granularity='channel')
+    x_q, _ = quantize_activations(x)
+    exact = x_q.astype(np.int64) @ w_q.astype(np.int64).T
+    for backend in MATMUL_BACKENDS:
+        assert np.array_equal(int8_matmul(x_q, w_q, backend=backend), exact), backend
+    print("int8 GEMM 与 int64 参考结果逐位一致")
+
+    for name, y in [('quantized_linear', quantized_linear(x, w_q, w_params)),
+                    ('dequant_matmul int8', dequant_matmul(x, w_q, w_params)),
+                    ('dequant_matmul int4 group',
+                     dequant_matmul(x, *quantize(weight, bits=4, granularity='group', group_size=64)))]:
+        error = np.linalg.norm(y - reference) / np.linalg.norm(reference)
+        print(f"{name:<26} 相对误差 {error:.4e}")
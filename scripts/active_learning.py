@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+主动学习: 把昂贵模型的标注预算花在信息量大的发票上
+- 感知哈希（dHash）聚类: 与已标注图像版式相近的发票信息量低，没有任何已标注成员的簇优先
+- 销售方频率: 廉价模型预测的销售方在已有标注CSV中出现得越少，样本越有价值
+- 廉价模型的不确定性: 多个廉价模型的预测不一致，或预测结果不像一个公司名称时视为低置信度
+按加权得分排序，每个簇最多选 --per-cluster 张，输出前K张的名称列表，
+交给 generate_labels_with_llm.py --select 标注；也可以用 --rounds 多轮地选择、标注、更新统计
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import logging
+import argparse
+from collections import Counter
+
+from instrumentation import count, setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from image_scanner import LABEL_IMAGE_EXTENSIONS, image_format_from_name, scan_directory
+from generate_labels_with_llm import DEFAULT_LABEL_MODEL, create_router, process_images
+from region_router import DEFAULT_REGION_CONCURRENCY
+
+PHASH_CACHE_FILE = 'perceptual_hashes.json'
+PREDICTIONS_CACHE_FILE = 'cheap_predictions.json'
+DEFAULT_CHEAP_MODELS = ['amazon.nova-lite-v1:0']
+CHEAP_CHUNK_SIZE = 256
+# 像一个公司名称的预测结果（不像时视为廉价模型的低置信度预测）
+SELLER_NAME_PATTERN = re.compile(r'^[一-鿿（）()·A-Za-z0-9&\-\s]{4,40}(公司|厂|店|中心|部|院|所|社|行|场|馆|站)$')
+FAILED_LABEL_MARKERS = ('提取失败', 'ThrottlingException')
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='按信息量为未标注的发票排序，只标注最有价值的部分')
+
+    parser.add_argument('--images-dir', type=str, help='发票图像目录（默认为训练集图像目录）')
+    parser.add_argument('--label-csv', type=str, action='append',
+                        help='已有的标注CSV（可重复指定，默认为训练集与测试集标注CSV）')
+    parser.add_argument('--top-k', type=int, default=100, help='每轮选出的图像数')
+    parser.add_argument('--per-cluster', type=int, default=1, help='每轮每个感知哈希簇最多选出的图像数')
+    parser.add_argument('--cluster-distance', type=int, default=10, help='同一簇内感知哈希的最大汉明距离（共64位）')
+    parser.add_argument('--cheap-models', type=str, nargs='*', default=DEFAULT_CHEAP_MODELS,
+                        help='用于估计不确定性的廉价模型（给出两个以上时比较预测是否一致；不带参数时不调用廉价模型）')
+    parser.add_argument('--cheap-concurrency', type=int, default=8, help='调用廉价模型的并发数')
+    parser.add_argument('--weights', type=float, nargs=3, default=[0.4, 0.2, 0.4], metavar=('NOVELTY', 'RARITY', 'UNCERTAINTY'),
+                        help='新颖度、销售方稀有度与不确定性的权重')
+    parser.add_argument('--output', type=str, help='选出的图像名称列表（默认为 LABEL_DATA_DIR/active_selection.txt）')
+    parser.add_argument('--scores-csv', type=str, help='把全部未标注图像的得分写入该CSV')
+    parser.add_argument('--rounds', type=int, default=0,
+                        help='选择后直接用昂贵模型标注（追加到训练集标注CSV）并重复的轮数；0 表示只输出选择结果')
+    parser.add_argument('--min-score', type=float, default=0.0, help='多轮标注时最高得分低于该值即停止')
+    parser.add_argument('--model', type=str, default=DEFAULT_LABEL_MODEL, help='多轮标注使用的昂贵模型')
+    parser.add_argument('--regions', type=str, nargs='+', help='多轮标注调用模型的区域，可写作 区域=并发数')
+    parser.add_argument('--region-concurrency', type=int, default=DEFAULT_REGION_CONCURRENCY, help='每个区域的默认并发请求数')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'images_dir': str(settings.train_images_dir),
+        'label_csvs': [str(settings.train_label_csv), str(settings.test_label_csv)],
+        'train_label_csv': str(settings.train_label_csv),
+        'output': str(settings.label_data_dir / 'active_selection.txt'),
+        'region': settings.aws_region,
+        'catalog_dir': str(settings.model_catalog_dir),
+        'cache_dir': str(settings.cache_dir),
+        'log_file': str(settings.log_path('active_learning.log'))
+    }
+
+    return config
+
+def normalize_seller(name):
+    """比较销售方名称前统一括号与空白。"""
+    return re.sub(r'\s+', '', (name or '').replace('（', '(').replace('）', ')'))
+
+def read_labels(csv_paths):
+    """读取已有标注，返回 {图片名称: 销售方}（跳过提取失败的条目）。"""
+    labels = {}
+    for csv_path in csv_paths:
+        if not os.path.exists(csv_path):
+            continue
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                seller = row.get('销售方', '')
+                if seller and not any(marker in seller for marker in FAILED_LABEL_MARKERS):
+                    labels[row['图片名称']] = seller
+    return labels
+
+def dhash(path, hash_size=8):
+    """64位差值哈希: 缩小为 9x8 灰度图，比较相邻像素；读取失败返回 None。"""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            # JPEG 直接按缩小的尺寸解码，速度快得多
+            image.draft('L', (hash_size * 4, hash_size * 4))
+            pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    except Exception as e:
+        logging.warning(f"无法计算感知哈希 {path}: {e}")
+        return None
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row * (hash_size + 1) + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return value
+
+class JsonCache:
+    """{键: 值} 形式的JSON缓存文件。"""
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.dirty = False
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                # 缓存损坏时重新计算
+                self.entries = {}
+
+    def save(self):
+        if not self.cache_path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+def perceptual_hashes(images_dir, files, cache):
+    """{图片名称: 感知哈希}；缓存按文件大小和修改时间失效。"""
+    hashes = {}
+    for name, (size, mtime_ns, _) in files.items():
+        cached = cache.entries.get(name)
+        if cached and cached[1] == size and cached[2] == mtime_ns:
+            hashes[name] = cached[0]
+            continue
+        value = dhash(os.path.join(images_dir, name))
+        if value is None:
+            continue
+        cache.entries[name] = [value, size, mtime_ns]
+        cache.dirty = True
+        count('active.phash_computed')
+        hashes[name] = value
+    return hashes
+
+def popcount(values):
+    """uint64数组逐元素的置位数；np.bitwise_count 只在 NumPy 2.0 及以上可用，旧版本按字节展开后求和。"""
+    import numpy as np
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+def cluster_hashes(names, hashes, max_distance):
+    """按顺序做领头者聚类: 与某个簇首的汉明距离不超过 max_distance 时加入该簇，返回 {名称: 簇编号}。"""
+    import numpy as np
+    leaders = np.empty(len(names), dtype=np.uint64)
+    leader_count = 0
+    clusters = {}
+    for name in names:
+        value = np.uint64(hashes[name])
+        if leader_count:
+            distances = popcount(leaders[:leader_count] ^ value)
+            nearest = int(distances.argmin())
+            if distances[nearest] <= max_distance:
+                clusters[name] = nearest
+                continue
+        leaders[leader_count] = value
+        clusters[name] = leader_count
+        leader_count += 1
+    return clusters
+
+def is_confident(prediction):
+    """预测是否像一个完整的公司名称。"""
+    return bool(prediction) and bool(SELLER_NAME_PATTERN.match(prediction.strip()))
+
+def cheap_predictions(images_dir, names, models, cache, region, concurrency):
+    """用廉价模型预测销售方，返回 {名称: [各模型的预测]}；结果缓存，跨轮次复用。"""
+    from nova_inference import NovaInferenceClient, build_seller_request
+
+    for model_id in models:
+        missing = [name for name in names if model_id not in cache.entries.get(name, {})]
+        if not missing:
+            continue
+        logging.info(f"用廉价模型 {model_id} 预测 {len(missing)} 张图像")
+        client = NovaInferenceClient(model_id, region, concurrency)
+
+        def request_for(name):
+            with open(os.path.join(images_dir, name), 'rb') as f:
+                return build_seller_request(f.read(), image_format_from_name(name), max_tokens=64)
+
+        # 分块提交，避免一次把全部图像读入内存
+        for start in range(0, len(missing), CHEAP_CHUNK_SIZE):
+            chunk = missing[start:start + CHEAP_CHUNK_SIZE]
+            results = client.extract_many([request_for(name) for name in chunk], concurrency=concurrency)
+            for name, (prediction, error) in zip(chunk, results):
+                if error is not None:
+                    count('active.cheap_errors')
+                    continue
+                cache.entries.setdefault(name, {})[model_id] = prediction
+                cache.dirty = True
+        count('active.cheap_calls', len(missing))
+    return {name: [cache.entries[name][model_id] for model_id in models if model_id in cache.entries.get(name, {})]
+            for name in names}
+
+def score_images(unlabeled, labels, clusters, predictions, weights):
+    """为未标注图像打分，返回按得分降序的 [(名称, 得分, 新颖度, 稀有度, 不确定性, 预测)]。"""
+    novelty_weight, rarity_weight, uncertainty_weight = weights
+    labeled_per_cluster = Counter(clusters[name] for name in labels if name in clusters)
+    seller_counts = Counter(normalize_seller(seller) for seller in labels.values())
+    scored = []
+    for name in unlabeled:
+        # 簇中已标注的图像越多，新颖度越低；没有感知哈希的图像按全新处理
+        novelty = 1.0 / (1 + labeled_per_cluster[clusters[name]]) if name in clusters else 1.0
+        guesses = [normalize_seller(guess) for guess in predictions.get(name, []) if guess]
+        if guesses:
+            top_guess, votes = Counter(guesses).most_common(1)[0]
+            # 在已有标注中没出现过的销售方稀有度最高；不像公司名称的预测不参与稀有度
+            rarity = 1.0 / (1 + seller_counts[top_guess]) if is_confident(top_guess) else 0.5
+            # 多个模型不一致，或多数预测不像公司名称时不确定性高
+            disagreement = 1.0 - votes / len(predictions[name])
+            uncertainty = max(disagreement, 0.0 if is_confident(top_guess) else 1.0)
+        elif predictions.get(name):
+            # 廉价模型只返回了空结果
+            rarity, uncertainty = 0.5, 1.0
+        else:
+            # 没有廉价模型预测: 稀有度与不确定性取中性值
+            rarity = uncertainty = 0.5
+        score = novelty_weight * novelty + rarity_weight * rarity + uncertainty_weight * uncertainty
+        scored.append((name, score, novelty, rarity, uncertainty, predictions.get(name, [])))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored
+
+def select_top(scored, clusters, top_k, per_cluster):
+    """按得分选出 top_k 张，每个簇最多 per_cluster 张；不足时再按得分补足。"""
+    selected = []
+    per_cluster_count = Counter()
+    skipped = []
+    for item in scored:
+        if len(selected) >= top_k:
+            break
+        cluster = clusters.get(item[0])
+        if cluster is not None and per_cluster_count[cluster] >= per_cluster:
+            skipped.append(item)
+            continue
+        per_cluster_count[cluster] += 1
+        selected.append(item)
+    selected.extend(skipped[:top_k - len(selected)])
+    return selected
+
+def write_scores(scores_csv, scored, clusters, selected_names):
+    with open(scores_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['图片名称', '得分', '新颖度', '稀有度', '不确定性', '簇', '廉价模型预测', '选中'])
+        for name, score, novelty, rarity, uncertainty, guesses in scored:
+            writer.writerow([name, f"{score:.4f}", f"{novelty:.4f}", f"{rarity:.4f}", f"{uncertainty:.4f}",
+                             clusters.get(name, ''), ' | '.join(guesses), int(name in selected_names)])
+
+def select_round(config, args, caches, attempted=()):
+    """执行一轮选择，返回 (选出的条目, 全部打分, 簇)。
+
+    attempted 为本次运行中已送去标注的图像；标注失败的图像不会出现在 read_labels 的结果中，
+    排除它们才不会在后续轮次被反复选中、重复计费并追加重复的失败行。
+    """
+    images_dir = config['images_dir']
+    with stage('scan'):
+        files = scan_directory(images_dir, LABEL_IMAGE_EXTENSIONS)
+    labels = read_labels(config['label_csvs'])
+    unlabeled = sorted(name for name in files if name not in labels and name not in attempted)
+    logging.info(f"{len(files)} 张图像，已标注 {len(labels)}，未标注 {len(unlabeled)}"
+                 + (f"（另有 {len(attempted)} 张本次运行已尝试标注）" if attempted else ''))
+    if not unlabeled:
+        return [], [], {}
+
+    with stage('perceptual_hash'):
+        hashes = perceptual_hashes(images_dir, files, caches['phash'])
+    # 已标注的图像先作为簇首，未标注的图像尽量归入已标注的簇
+    ordered = [name for name in sorted(files, key=lambda name: (name not in labels, name)) if name in hashes]
+    with stage('cluster'):
+        clusters = cluster_hashes(ordered, hashes, args.cluster_distance)
+    logging.info(f"感知哈希聚类: {len(set(clusters.values()))} 个簇")
+
+    predictions = {}
+    if args.cheap_models:
+        with stage('cheap_model'):
+            predictions = cheap_predictions(images_dir, unlabeled, args.cheap_models, caches['predictions'],
+                                            config['region'], args.cheap_concurrency)
+
+    scored = score_images(unlabeled, labels, clusters, predictions, args.weights)
+    return select_top(scored, clusters, args.top_k, args.per_cluster), scored, clusters
+
+def main():
+    """选择待标注图像的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'active_learning')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    if args.images_dir:
+        config['images_dir'] = args.images_dir
+    if args.label_csv:
+        config['label_csvs'] = args.label_csv
+        config['train_label_csv'] = args.label_csv[0]
+    if args.output:
+        config['output'] = args.output
+
+    # 配置日志
+    setup_logging(config['log_file'], 'active_learning')
+    logger = logging.getLogger(__name__)
+
+    caches = {'phash': JsonCache(os.path.join(config['cache_dir'], PHASH_CACHE_FILE)),
+              'predictions': JsonCache(os.path.join(config['cache_dir'], PREDICTIONS_CACHE_FILE))}
+    router = create_router(args.model, config, args.regions, args.region_concurrency) if args.rounds else None
+
+    labeled_calls = 0
+    attempted = set()
+    for round_number in range(1, max(1, args.rounds) + 1):
+        selected, scored, clusters = select_round(config, args, caches, attempted)
+        for cache in caches.values():
+            cache.save()
+        if not selected:
+            logger.info("没有需要标注的图像")
+            break
+
+        selected_names = [item[0] for item in selected]
+        os.makedirs(os.path.dirname(os.path.abspath(config['output'])), exist_ok=True)
+        with open(config['output'], 'w', encoding='utf-8') as f:
+            f.write('\n'.join(selected_names) + '\n')
+        if args.scores_csv:
+            write_scores(args.scores_csv, scored, clusters, set(selected_names))
+        logger.info(f"第 {round_number} 轮: 从 {len(scored)} 张未标注图像中选出 {len(selected)} 张"
+                    f"（得分 {selected[0][1]:.3f} ~ {selected[-1][1]:.3f}），已写入 {config['output']}")
+
+        if not args.rounds:
+            break
+        if selected[0][1] < args.min_score:
+            logger.info(f"最高得分 {selected[0][1]:.3f} 低于 {args.min_score}，停止")
+            break
+        with stage('label'):
+            process_images(config['images_dir'], config['train_label_csv'], args.model, args.top_k, logger, router,
+                           image_names=selected_names, append=True)
+        attempted.update(selected_names)
+        labeled_calls += len(selected_names)
+
+    if router is not None:
+        router.log_summary(logger)
+        total = len(scan_directory(config['images_dir'], LABEL_IMAGE_EXTENSIONS))
+        logger.info(f"昂贵模型共标注 {labeled_calls} 张图像（目录中共 {total} 张，{labeled_calls / max(1, total):.1%}）")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+按需创建并复用 boto3 客户端
+- boto3 在第一次需要客户端时才导入，--help、--dry-run 等不访问AWS的调用不再承担 boto3 的导入开销
+- 同一进程内相同 (服务, 区域, endpoint) 的客户端只创建一次（boto3 客户端本身是线程安全的，
+  创建过程不是，这里加锁），避免逐张图片上传时每次都重新创建客户端
+"""
+
+import threading
+
+_clients = {}
+_lock = threading.Lock()
+
+def get_client(service_name, region_name=None, endpoint_url=None, max_pool_connections=None, max_attempts=None,
+               retry_mode='standard', tcp_keepalive=False):
+    """返回缓存的 boto3 客户端，首次调用时创建。
+
+    max_pool_connections 指定时为客户端配置该大小的连接池（并发调用同一客户端的线程数超过默认的10时使用）；
+    max_attempts 指定时使用 retry_mode 重试模式并限制尝试次数（由调用方自行换区域重试时设为1）；
+    tcp_keepalive 为真时保持长连接（持续并发调用的推理客户端使用）。
+    """
+    key = (service_name, region_name, endpoint_url, max_pool_connections, max_attempts, retry_mode, tcp_keepalive)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                kwargs = {}
+                if max_pool_connections or max_attempts or tcp_keepalive:
+                    from botocore.config import Config
+                    options = {}
+                    if max_pool_connections:
+                        options['max_pool_connections'] = max_pool_connections
+                    if max_attempts:
+                        options['retries'] = {'max_attempts': max_attempts, 'mode': retry_mode}
+                    if tcp_keepalive:
+                        options['tcp_keepalive'] = True
+                    kwargs['config'] = Config(**options)
+                client = boto3.client(service_name, region_name=region_name, endpoint_url=endpoint_url, **kwargs)
+                _clients[key] = client
+    return client
+
+def reset_clients():
+    """丢弃已缓存的客户端（切换凭证或在基准测试中替换 boto3.client 时使用）。"""
+    with _lock:
+        _clients.clear()
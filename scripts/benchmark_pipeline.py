@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+数据流水线的端到端基准测试
+- 按指定规模合成类似发票的图像和标注CSV（按参数缓存，重复运行不重新生成）
+- 用本地的 S3 / Bedrock 替身代替 boto3 客户端，可注入延迟（对数正态抖动）和限流错误
+- 依次运行各阶段: 生成标注 → 处理图像并创建训练数据 → 验证数据集 → 上传JSONL → 离线评估
+- 记录每个阶段的吞吐、延迟分位数、每条目CPU时间、内存峰值以及阶段内的热点，写入结果文件
+- 与保存的基线对比，吞吐下降或延迟/CPU/内存上升超过容差时以非零状态退出
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import logging
+import platform
+import resource
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+from instrumentation import metrics, setup_logging
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import reset_clients
+
+PIPELINE_STAGES = ['generate_labels', 'process_images', 'validate_dataset', 'upload_jsonl', 'evaluate_model']
+
+# 各阶段用于计算延迟分位数的直方图
+LATENCY_HISTOGRAMS = {
+    'generate_labels': 'bedrock.invoke_seconds',
+    'process_images': 's3.upload_seconds',
+    'validate_dataset': 'validation.sample_seconds',
+    'upload_jsonl': 's3.upload_seconds',
+    'evaluate_model': 'bedrock.converse_seconds'
+}
+
+# 与基线对比的指标: (越大越好?, 忽略的绝对差值)
+REGRESSION_CHECKS = {
+    'throughput': (True, 0.0),
+    'p95_ms': (False, 1.0),
+    'cpu_ms_per_item': (False, 0.05),
+    'peak_mb': (False, 1.0)
+}
+
+# 基线中耗时低于此值的阶段只对比延迟和内存，吞吐与每条目CPU时间在这个量级上主要是噪声
+MIN_COMPARE_SECONDS = 0.5
+
+# 结果中必须与基线一致的参数，否则对比没有意义
+COMPARABLE_PARAMS = ['images', 'test_fraction', 'image_size', 'seed', 's3_latency_ms', 'bedrock_latency_ms',
+                     'jitter', 'throttle_rate', 'concurrency', 'tracemalloc', 'stages']
+
+BENCHMARK_BUCKET = 'benchmark-bucket'
+BENCHMARK_ACCOUNT_ID = '123456789012'
+BENCHMARK_MODEL_ID = 'benchmark.stand-in-model'
+
+SELLER_REGIONS = ['北京', '上海', '广州', '深圳', '杭州', '成都', '武汉', '南京', '苏州', '西安']
+SELLER_NAMES = ['华润', '恒信', '瑞丰', '明达', '宏图', '金桥', '新元', '中科', '天合', '博远']
+SELLER_INDUSTRIES = ['科技', '贸易', '物流', '电子', '建材', '食品', '医药', '能源']
+SELLER_SUFFIXES = ['有限公司', '股份有限公司', '有限责任公司']
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='数据流水线的端到端基准测试（本地S3/Bedrock替身）')
+
+    parser.add_argument('--images', type=int, default=200, help='合成的发票图像总数')
+    parser.add_argument('--test-fraction', type=float, default=0.2, help='测试集所占比例')
+    parser.add_argument('--image-size', type=str, default='1600x1000', help='合成图像尺寸（宽x高）')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='合成图像的进程数')
+    parser.add_argument('--regenerate', action='store_true', help='忽略缓存，重新合成数据')
+    parser.add_argument('--s3-latency-ms', type=float, default=10.0, help='S3替身每次调用的中位延迟（毫秒）')
+    parser.add_argument('--bedrock-latency-ms', type=float, default=50.0, help='Bedrock替身每次调用的中位延迟（毫秒）')
+    parser.add_argument('--jitter', type=float, default=0.5, help='延迟的对数正态抖动（sigma，0为固定延迟）')
+    parser.add_argument('--throttle-rate', type=float, default=0.02, help='替身返回限流错误的概率')
+    parser.add_argument('--concurrency', type=int, default=8, help='离线评估阶段的并发数')
+    parser.add_argument('--stages', type=str, nargs='+', choices=PIPELINE_STAGES, default=PIPELINE_STAGES,
+                        help='要运行的阶段（按流水线顺序执行）')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='不用tracemalloc统计各阶段内存峰值（开销更小）')
+    parser.add_argument('--work-dir', type=str, help='合成数据和中间结果目录（默认为配置中的 BENCHMARK_DIR）')
+    parser.add_argument('--output', type=str, help='结果JSON文件路径')
+    parser.add_argument('--baseline', type=str, help='基线结果文件（默认为配置中的 BENCHMARK_BASELINE）')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--no-compare', action='store_true', help='不与基线对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对退化比例')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'work_dir': str(settings.benchmark_dir),
+        'baseline': str(settings.benchmark_baseline),
+        's3_prefix_images': settings.s3_prefix_images,
+        's3_prefix_training': settings.s3_prefix_training,
+        'region': settings.aws_region,
+        'log_file': str(settings.log_path('benchmark_pipeline.log'))
+    }
+
+    return config
+
+def parse_size(text):
+    """解析 宽x高 形式的图像尺寸。"""
+    try:
+        width, height = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"无效的图像尺寸: {text}，应为 宽x高") from None
+    return width, height
+
+def seller_name(rng):
+    """随机生成一个销售方名称。"""
+    return (rng.choice(SELLER_REGIONS) + rng.choice(SELLER_NAMES) + rng.choice(SELLER_INDUSTRIES)
+            + rng.choice(SELLER_SUFFIXES))
+
+def render_invoice(task):
+    """绘制一张类似发票的图像（浅色噪声背景、表头、表格线和若干文字行），返回 (文件名, sha1)。"""
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    path, width, height, seed = task
+    rng = np.random.default_rng(seed)
+    # 噪声背景使JPEG体积接近扫描件
+    pixels = rng.integers(224, 256, size=(height, width, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+
+    margin = width // 20
+    draw.rectangle([margin, margin, width - margin, height - margin], outline=(150, 60, 40), width=3)
+    draw.text((width // 3, margin + 20), f"VAT INVOICE No. {rng.integers(10**7, 10**8)}", fill=(150, 60, 40))
+    rows = int(rng.integers(6, 12))
+    row_height = (height - 4 * margin) // rows
+    for row in range(rows + 1):
+        y = 2 * margin + row * row_height
+        draw.line([margin, y, width - margin, y], fill=(150, 60, 40), width=2)
+        if row < rows:
+            text = f"ITEM-{rng.integers(1000, 9999)}  QTY {rng.integers(1, 500)}  AMOUNT {rng.uniform(1, 10**5):.2f}"
+            draw.text((margin + 30, y + row_height // 3), text, fill=(30, 30, 30))
+    for x in np.linspace(margin, width - margin, 5)[1:-1]:
+        draw.line([x, 2 * margin, x, 2 * margin + rows * row_height], fill=(150, 60, 40), width=2)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    data = buffer.getvalue()
+    with open(path, 'wb') as f:
+        f.write(data)
+    return os.path.basename(path), hashlib.sha1(data).hexdigest()
+
+def generate_dataset(work_dir, num_images, test_fraction, image_size, seed, workers=None, regenerate=False):
+    """在 work_dir/data 下合成图像和标注CSV，返回清单（参数、每张图片的答案和哈希）。
+
+    清单中的参数与本次一致时直接复用已生成的数据。
+    """
+    data_dir = os.path.join(work_dir, 'data')
+    manifest_path = os.path.join(data_dir, 'manifest.json')
+    params = {'images': num_images, 'test_fraction': test_fraction, 'image_size': image_size, 'seed': seed}
+    if not regenerate and os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['params'] == params:
+            logging.info(f"复用已合成的数据: {data_dir}")
+            return manifest
+
+    width, height = parse_size(image_size)
+    rng = random.Random(seed)
+    num_test = int(round(num_images * test_fraction))
+    tasks, labels = [], {'train': [], 'test': []}
+    for index in range(num_images):
+        split = 'test' if index < num_test else 'train'
+        # 与 rename_to_jpeg.sh 处理后的真实数据一致，统一使用 .jpeg 扩展名
+        name = f"inv_{index:06d}.jpeg"
+        split_dir = os.path.join(data_dir, 'images', split)
+        os.makedirs(split_dir, exist_ok=True)
+        tasks.append((os.path.join(split_dir, name), width, height, seed * 1_000_003 + index))
+        labels[split].append((name, seller_name(rng)))
+
+    logging.info(f"合成 {num_images} 张 {width}x{height} 的发票图像到 {data_dir} ...")
+    start = time.monotonic()
+    with Pool(processes=max(1, workers or 1)) as pool:
+        hashes = dict(pool.imap_unordered(render_invoice, tasks, chunksize=8))
+    logging.info(f"合成完成，耗时 {time.monotonic() - start:.1f} 秒")
+
+    os.makedirs(os.path.join(data_dir, 'label_data'), exist_ok=True)
+    for split, rows in labels.items():
+        with open(os.path.join(data_dir, 'label_data', f'{split}_label.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['图片名称', '销售方'])
+            writer.writerows(rows)
+
+    answers = {name: seller for rows in labels.values() for name, seller in rows}
+    manifest = {'params': params, 'answers': answers, 'hashes': {digest: name for name, digest in hashes.items()}}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return manifest
+
+class FaultInjector:
+    """为替身的每次调用注入延迟（对数正态分布）和限流错误，线程安全。"""
+
+    def __init__(self, latency_ms, jitter=0.5, throttle_rate=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    def call(self, operation, error_code):
+        with self.lock:
+            self.calls += 1
+            delay = self.latency * (self.rng.lognormvariate(0.0, self.jitter) if self.jitter else 1.0)
+            throttled = self.rng.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            from botocore.exceptions import ClientError
+            raise ClientError({'Error': {'Code': error_code, 'Message': 'Rate exceeded (injected)'}}, operation)
+
+class StandInS3:
+    """S3 替身: upload_file 读取整个文件（保留本地I/O开销），只记录对象大小。"""
+
+    def __init__(self, injector):
+        self.injector = injector
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, 'rb') as f:
+            size = len(f.read())
+        self.injector.call('PutObject', 'SlowDown')
+        with self.lock:
+            self.objects[(Bucket, Key)] = size
+
+class StandInBedrockRuntime:
+    """bedrock-runtime 替身: 按图像哈希或S3对象名返回合成数据中的销售方名称。"""
+
+    def __init__(self, injector, manifest):
+        self.injector = injector
+        self.answers = manifest['answers']
+        self.hashes = manifest['hashes']
+
+    def answer_for_bytes(self, image_bytes):
+        return self.answers.get(self.hashes.get(hashlib.sha1(image_bytes).hexdigest()), '')
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        answer = ''
+        for item in request['messages'][0]['content']:
+            if item.get('type') == 'image':
+                answer = self.answer_for_bytes(base64.b64decode(item['source']['data']))
+        self.injector.call('InvokeModel', 'ThrottlingException')
+        payload = {'content': [{'type': 'text', 'text': answer}], 'stop_reason': 'end_turn'}
+        return {'body': io.BytesIO(json.dumps(payload, ensure_ascii=False).encode('utf-8'))}
+
+    def converse(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        answer = ''
+        for message in messages:
+            for item in message['content']:
+                source = item.get('image', {}).get('source', {})
+                if 'bytes' in source:
+                    answer = self.answer_for_bytes(source['bytes'])
+                elif 's3Location' in source:
+                    answer = self.answers.get(source['s3Location']['uri'].rsplit('/', 1)[-1], '')
+        self.injector.call('Converse', 'ThrottlingException')
+        return {'output': {'message': {'role': 'assistant', 'content': [{'text': answer}]}},
+                'stopReason': 'end_turn'}
+
+@contextmanager
+def stand_in_clients(s3, bedrock_runtime):
+    """在代码块内让 boto3.client 返回替身，被测脚本无需改动（进出时清空 aws_clients 的客户端缓存）。"""
+    import boto3
+
+    original = boto3.client
+
+    def client(service_name, *args, **kwargs):
+        if service_name == 's3':
+            return s3
+        if service_name == 'bedrock-runtime':
+            return bedrock_runtime
+        raise ValueError(f"基准测试没有 {service_name} 的替身")
+
+    boto3.client = client
+    reset_clients()
+    try:
+        yield
+    finally:
+        boto3.client = original
+        reset_clients()
+
+def count_rows(path):
+    """统计CSV数据行数或JSONL非空行数。"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = sum(1 for line in f if line.strip())
+    return rows - 1 if path.endswith('.csv') else rows
+
+def run_stage(name, fn, use_tracemalloc=True):
+    """运行一个阶段，fn 返回 (条目数, 错误数, 附加信息)；返回该阶段的测量结果。"""
+    metrics.reset()
+    if use_tracemalloc:
+        tracemalloc.reset_peak()
+        baseline_memory = tracemalloc.get_traced_memory()[0]
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    items, errors, extra = fn()
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+
+    summary = metrics.summary(name)
+    latency = summary['histograms'].get(LATENCY_HISTOGRAMS[name], {'count': 0})
+    result = {
+        'items': items,
+        'errors': errors,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'throughput': items / wall if wall else 0.0,
+        'cpu_ms_per_item': cpu / items * 1000 if items else 0.0,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+    if latency['count']:
+        result.update({f"{key}_ms": latency[key] * 1000 for key in ('p50', 'p95', 'p99', 'max')})
+    if use_tracemalloc:
+        result['peak_mb'] = (tracemalloc.get_traced_memory()[1] - baseline_memory) / 1e6
+    result.update(extra)
+    result['substages'] = summary['stages']
+    result['counters'] = summary['counters']
+
+    logging.info(f"阶段 {name}: {items} 条，{wall:.2f} 秒，{result['throughput']:.1f} 条/秒，错误 {errors}，"
+                 f"p95 {result.get('p95_ms', 0):.1f} ms，内存峰值 {result.get('peak_mb', 0):.1f} MB")
+    return result
+
+def run_pipeline(args, config, manifest, work_dir):
+    """依次运行所选阶段，返回 {阶段名: 测量结果}。"""
+    import jsonl_to_s3
+    import evaluate_model
+    import generate_labels_with_llm
+    import nova_ft_dataset_validator
+    import process_images_for_training
+    # 验证器按需导入 pydantic 模型；提前导入，各阶段只测量稳态的处理开销
+    import nova_ft_schema  # noqa: F401
+
+    data_dir = os.path.join(work_dir, 'data')
+    labels_dir = os.path.join(work_dir, 'labels')
+    jsonl_dir = os.path.join(work_dir, 'bedrock-ft')
+    os.makedirs(labels_dir, exist_ok=True)
+    os.makedirs(jsonl_dir, exist_ok=True)
+    splits = ['train', 'test']
+    pipeline_config = {
+        's3_bucket': BENCHMARK_BUCKET,
+        's3_prefix': config['s3_prefix_images'],
+        'account_id': BENCHMARK_ACCOUNT_ID
+    }
+
+    def label_csv(split):
+        # 运行过生成标注阶段时使用替身生成的标注（含限流失败的条目），否则使用合成的标注
+        generated = os.path.join(labels_dir, f'{split}_label.csv')
+        if 'generate_labels' in args.stages:
+            return generated
+        return os.path.join(data_dir, 'label_data', f'{split}_label.csv')
+
+    def generate_labels():
+        logger = logging.getLogger('generate_labels_with_llm')
+        for split in splits:
+            generate_labels_with_llm.process_images(os.path.join(data_dir, 'images', split),
+                                                    os.path.join(labels_dir, f'{split}_label.csv'),
+                                                    BENCHMARK_MODEL_ID, 10, logger)
+        labeled = metrics.counter('images.labeled').value
+        failed = metrics.counter('images.failed').value
+        return labeled + failed, failed, {}
+
+    def process_images():
+        for split, dataset_type in zip(splits, ['训练', '测试']):
+            process_images_for_training.process_dataset(label_csv(split), os.path.join(data_dir, 'images', split),
+                                                        os.path.join(jsonl_dir, f'{split}_data.jsonl'),
+                                                        pipeline_config, dataset_type)
+        counters = {name: metrics.counter(f'items.{name}').value for name in ('success', 'failed', 'skipped')}
+        return sum(counters.values()), counters['failed'], {'skipped': counters['skipped']}
+
+    def validate_dataset():
+        path = os.path.join(jsonl_dir, 'train_data.jsonl')
+        try:
+            nova_ft_dataset_validator.validate_converse_dataset(argparse.Namespace(input_file=path, model_name='lite'))
+            errors = 0
+        except nova_ft_dataset_validator.NovaClientError as e:
+            logging.error(f"验证失败: {str(e)[:500]}")
+            errors = 1
+        return count_rows(path), errors, {}
+
+    def upload_jsonl():
+        failed = 0
+        total_bytes = 0
+        for split in splits:
+            path = os.path.join(jsonl_dir, f'{split}_data.jsonl')
+            total_bytes += os.path.getsize(path) if os.path.exists(path) else 0
+            if not jsonl_to_s3.upload_file_to_s3(path, BENCHMARK_BUCKET, f"{config['s3_prefix_training']}/{split}.jsonl",
+                                                 config['region']):
+                failed += 1
+        return len(splits), failed, {'bytes': total_bytes}
+
+    def evaluate():
+        samples = list(evaluate_model.iter_eval_samples(os.path.join(jsonl_dir, 'test_data.jsonl')))
+        cache_file = os.path.join(work_dir, 'eval_responses.sqlite')
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        backend = evaluate_model.BedrockBackend(config['region'], max_pool_connections=args.concurrency)
+        cache = evaluate_model.ResponseCache(cache_file)
+        try:
+            results = evaluate_model.evaluate_model(BENCHMARK_MODEL_ID, samples, backend, cache,
+                                                    evaluate_model.RateLimiter(0), args.concurrency)
+        finally:
+            cache.close()
+        summary = evaluate_model.summarize_results(results)
+        return len(results), summary.get('errors', 0), {'exact_match_accuracy': summary.get('exact_match_accuracy', 0.0)}
+
+    runners = {
+        'generate_labels': generate_labels,
+        'process_images': process_images,
+        'validate_dataset': validate_dataset,
+        'upload_jsonl': upload_jsonl,
+        'evaluate_model': evaluate
+    }
+
+    s3_injector = FaultInjector(args.s3_latency_ms, args.jitter, args.throttle_rate, args.seed)
+    bedrock_injector = FaultInjector(args.bedrock_latency_ms, args.jitter, args.throttle_rate, args.seed + 1)
+    s3 = StandInS3(s3_injector)
+    bedrock_runtime = StandInBedrockRuntime(bedrock_injector, manifest)
+
+    results = {}
+    with stand_in_clients(s3, bedrock_runtime):
+        for name in PIPELINE_STAGES:
+            if name in args.stages:
+                results[name] = run_stage(name, runners[name], not args.no_tracemalloc)
+    logging.info(f"替身调用: S3 {s3_injector.calls} 次（限流 {s3_injector.throttled}），"
+                 f"Bedrock {bedrock_injector.calls} 次（限流 {bedrock_injector.throttled}）")
+    return results
+
+def compare_with_baseline(results, baseline, tolerance):
+    """与基线逐阶段对比，返回退化列表 [(阶段, 指标, 基线值, 当前值, 相对变化)]。"""
+    regressions = []
+    for name, current in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if not reference:
+            continue
+        for metric, (higher_is_better, slack) in REGRESSION_CHECKS.items():
+            if metric not in current or metric not in reference or not reference[metric]:
+                continue
+            if metric in ('throughput', 'cpu_ms_per_item') and reference['wall_seconds'] < MIN_COMPARE_SECONDS:
+                continue
+            base_value, value = reference[metric], current[metric]
+            change = (value - base_value) / base_value
+            worse = -change if higher_is_better else change
+            if worse > tolerance and abs(value - base_value) > slack:
+                regressions.append((name, metric, base_value, value, change))
+    return regressions
+
+def print_results(results):
+    """打印各阶段结果表。"""
+    print(f"\n{'阶段':<18}{'条目':>8}{'错误':>6}{'秒':>9}{'条/秒':>10}{'p50 ms':>9}{'p95 ms':>9}{'CPU ms/条':>11}{'峰值 MB':>9}")
+    for name, stage_result in results['stages'].items():
+        print(f"{name:<18}{stage_result['items']:>8}{stage_result['errors']:>6}{stage_result['wall_seconds']:>9.2f}"
+              f"{stage_result['throughput']:>10.1f}{stage_result.get('p50_ms', 0):>9.1f}{stage_result.get('p95_ms', 0):>9.1f}"
+              f"{stage_result['cpu_ms_per_item']:>11.2f}{stage_result.get('peak_mb', 0):>9.1f}")
+
+def main():
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'benchmark_pipeline')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    work_dir = args.work_dir if args.work_dir else config['work_dir']
+    baseline_path = args.baseline if args.baseline else config['baseline']
+
+    # 配置日志（各阶段的指标由本脚本按阶段汇总，不单独写运行指标文件）
+    setup_logging(config['log_file'], 'benchmark_pipeline', write_metrics=False)
+
+    manifest = generate_dataset(work_dir, args.images, args.test_fraction, args.image_size, args.seed,
+                                args.workers, args.regenerate)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    started_at = datetime.now()
+    stages = run_pipeline(args, config, manifest, work_dir)
+    if not args.no_tracemalloc:
+        tracemalloc.stop()
+
+    results = {
+        'created_at': started_at.isoformat(timespec='seconds'),
+        'params': {
+            'images': args.images,
+            'test_fraction': args.test_fraction,
+            'image_size': args.image_size,
+            'seed': args.seed,
+            's3_latency_ms': args.s3_latency_ms,
+            'bedrock_latency_ms': args.bedrock_latency_ms,
+            'jitter': args.jitter,
+            'throttle_rate': args.throttle_rate,
+            'concurrency': args.concurrency,
+            'tracemalloc': not args.no_tracemalloc,
+            'stages': [name for name in PIPELINE_STAGES if name in args.stages]
+        },
+        'host': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'stages': stages
+    }
+    print_results(results)
+
+    output_path = args.output or os.path.join(work_dir, 'results', f"pipeline-{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    logging.info(f"基准测试结果已保存到: {output_path}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path) or '.', exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        logging.info(f"已保存为基线: {baseline_path}")
+        return 0
+
+    if args.no_compare:
+        return 0
+    if not os.path.exists(baseline_path):
+        logging.warning(f"基线文件不存在: {baseline_path}，跳过对比（使用 --save-baseline 创建）")
+        return 0
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    mismatched = [key for key in COMPARABLE_PARAMS if baseline['params'].get(key) != results['params'].get(key)]
+    if mismatched:
+        logging.error(f"基线参数与本次运行不一致，无法对比: {', '.join(mismatched)}。"
+                      f"请使用相同参数运行，或用 --save-baseline 重新生成基线")
+        return 2
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{'!' * 72}\n性能回退: {len(regressions)} 项指标超过容差 {args.tolerance:.0%}（基线 {baseline_path}）")
+        for name, metric, base_value, value, change in regressions:
+            print(f"  {name:<18} {metric:<16} 基线 {base_value:10.3f} → 当前 {value:10.3f} ({change:+.1%})")
+        print('!' * 72)
+        logging.error(f"性能回退: {len(regressions)} 项指标超过容差")
+        return 1
+
+    logging.info(f"与基线对比通过（容差 {args.tolerance:.0%}）")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
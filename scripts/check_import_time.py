@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+入口脚本的导入耗时预算检查
+- 对每个入口模块在独立进程中运行 python -X importtime -c "import <模块>"，取多次中的最小值
+- 模块导入的累计耗时超过预算，或在导入阶段就导入了重量级依赖（boto3、pandas、pydantic 等，
+  应在真正使用时才导入）时检查失败
+- 同时测量 nova-ft <子命令> --help 的完整启动时间（含解释器启动）
+任一项超出预算时以非零状态退出，可在提交前或CI中运行。
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPTS_DIR)
+
+
+# 导入入口模块时不应出现的重量级依赖
+HEAVY_MODULES = ['boto3', 'botocore', 'pandas', 'numpy', 'matplotlib', 'pydantic', 'PIL', 'pyarrow',
+                 'scipy', 'seaborn', 'torch']
+
+def entry_commands():
+    """nova-ft 的子命令表 main.COMMANDS（{子命令: (模块名, 说明)}），新增子命令自动纳入检查。"""
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from main import COMMANDS
+    return COMMANDS
+
+def entry_modules():
+    """入口模块（各子命令对应的模块，按 COMMANDS 的顺序去重）。"""
+    return list(dict.fromkeys(module for module, _ in entry_commands().values()))
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='检查各入口模块的导入耗时预算与重量级依赖')
+
+    parser.add_argument('--modules', type=str, nargs='+', help='要检查的模块（默认为 nova-ft 全部子命令对应的模块）')
+    parser.add_argument('--budget-ms', type=float, default=200.0,
+                        help='单个模块导入的累计耗时预算（毫秒，-X importtime 本身会使耗时偏高）')
+    parser.add_argument('--help-budget-ms', type=float, default=500.0,
+                        help='nova-ft <子命令> --help 的完整启动时间预算（毫秒，含解释器启动）')
+    parser.add_argument('--repeats', type=int, default=3, help='每项测量的次数（取最小值）')
+    parser.add_argument('--skip-help', action='store_true', help='不测量 --help 的启动时间')
+
+    return parser.parse_args()
+
+def import_profile(module):
+    """运行一次 -X importtime，返回 (模块累计导入耗时微秒, 导入的全部模块名集合)。"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=SCRIPTS_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+    cumulative = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_text, name = line.split('|', 2)
+        if not cumulative_text.strip().isdigit():
+            continue
+        imported.add(name.strip())
+        if name.strip() == module and not name.startswith('  '):
+            cumulative = int(cumulative_text)
+    return cumulative or 0, imported
+
+def help_startup_seconds(command):
+    """测量 python main.py <子命令> --help 的墙钟时间。"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'main.py'), command, '--help'],
+                   cwd=REPO_ROOT, capture_output=True)
+    return time.perf_counter() - start
+
+def main():
+    args = parse_arguments()
+    if not args.modules:
+        args.modules = entry_modules()
+    failures = []
+
+    print(f"{'模块':<32}{'导入耗时 ms':>12}  重量级依赖")
+    for module in args.modules:
+        samples = [import_profile(module) for _ in range(max(1, args.repeats))]
+        elapsed_ms = min(cumulative for cumulative, _ in samples) / 1000
+        heavy = sorted(name for name in HEAVY_MODULES if name in samples[0][1])
+        flag = ''
+        if elapsed_ms > args.budget_ms:
+            failures.append(f"{module}: 导入耗时 {elapsed_ms:.1f} ms 超过预算 {args.budget_ms:.0f} ms")
+            flag = '  ← 超出预算'
+        if heavy:
+            failures.append(f"{module}: 导入时加载了 {', '.join(heavy)}，应改为在使用时导入")
+        print(f"{module:<32}{elapsed_ms:>12.1f}  {', '.join(heavy) or '-'}{flag}")
+
+    if not args.skip_help:
+        print(f"\n{'nova-ft 子命令 --help':<32}{'启动耗时 ms':>12}")
+        for command, (module, _) in entry_commands().items():
+            if module not in args.modules:
+                continue
+            elapsed_ms = min(help_startup_seconds(command) for _ in range(max(1, args.repeats))) * 1000
+            flag = ''
+            if elapsed_ms > args.help_budget_ms:
+                failures.append(f"nova-ft {command} --help: {elapsed_ms:.0f} ms 超过预算 {args.help_budget_ms:.0f} ms")
+                flag = '  ← 超出预算'
+            print(f"{command:<32}{elapsed_ms:>12.0f}{flag}")
+
+    if failures:
+        print(f"\n导入耗时检查失败（{len(failures)} 项）:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\n导入耗时检查通过")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+多个微调作业的训练指标对比报告
+从本地作业输出目录或S3（含兼容S3的替代服务）中流式读取 step_wise_training_metrics.csv，
+增量写入列式缓存（Parquet），并生成叠加损失曲线、收敛步数表和静态HTML报告
+"""
+
+import os
+import re
+import json
+import html
+import hashlib
+import argparse
+import logging
+from datetime import datetime
+
+from instrumentation import setup_logging
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import get_client
+from plot_backend import METRICS_FILE_NAME, decimate, find_metrics_files, get_pyplot, save_figure
+
+# 列式缓存中每个作业一个Parquet文件，manifest记录已摄取文件的指纹
+MANIFEST_FILE = 'manifest.json'
+RUNS_SUBDIR = 'runs'
+METRIC_COLUMNS = ['step_number', 'epoch_number', 'training_loss']
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='对比多个微调作业的训练指标')
+
+    parser.add_argument('--runs-dir', type=str, action='append', help='包含作业输出目录的本地目录（可重复指定）')
+    parser.add_argument('--s3-uri', type=str, action='append', help='包含作业输出的S3前缀，如 s3://bucket/nova-ft/output/（可重复指定）')
+    parser.add_argument('--s3-endpoint-url', type=str, help='兼容S3的替代服务地址（如本地MinIO）')
+    parser.add_argument('--region', type=str, help='AWS区域')
+    parser.add_argument('--cache-dir', type=str, help='列式缓存目录')
+    parser.add_argument('--output-dir', type=str, help='报告输出目录')
+    parser.add_argument('--max-points', type=int, default=2000, help='每条曲线绘图时的最大点数')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='判定收敛的相对容差（相对于最终损失）')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'runs_dir': str(settings.models_dir),
+        'cache_dir': str(settings.reports_dir / 'metrics_cache'),
+        'output_dir': str(settings.reports_dir),
+        'region': settings.aws_region,
+        'log_file': str(settings.log_path('compare_training_runs.log'))
+    }
+
+    return config
+
+def make_run_id(source_label, source):
+    """将作业来源路径转换为可用作文件名的作业ID。
+
+    可读部分来自来源标签，后缀是来源绝对路径（或S3 URI）的短哈希，不同目录下同名的作业不会共用一个ID。
+    """
+    run_id = re.sub(r'[^\w\-.]+', '_', source_label.strip('/')) or 'run'
+    return f"{run_id}-{hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]}"
+
+def discover_local_runs(runs_dir):
+    """列出本地目录下的所有指标文件，返回 (作业ID, 来源, 指纹) 列表。"""
+    runs = []
+    for metrics_file in find_metrics_files(runs_dir):
+        stat = os.stat(metrics_file)
+        source = os.path.abspath(metrics_file)
+        relative_dir = os.path.relpath(os.path.dirname(metrics_file), runs_dir)
+        label = os.path.basename(os.path.abspath(runs_dir))
+        if relative_dir != '.':
+            label = os.path.join(label, relative_dir)
+        runs.append({
+            'run_id': make_run_id(label, source),
+            'source': source,
+            'fingerprint': f"{stat.st_size}-{stat.st_mtime_ns}"
+        })
+    return runs
+
+def parse_s3_uri(s3_uri):
+    """将S3 URI拆分为存储桶和前缀。"""
+    if not s3_uri.startswith('s3://'):
+        raise ValueError(f"无效的S3 URI格式: {s3_uri}")
+    parts = s3_uri[5:].split('/', 1)
+    return parts[0], (parts[1] if len(parts) > 1 else '')
+
+def discover_s3_runs(s3_client, s3_uri):
+    """分页列出S3前缀下的所有指标文件，使用ETag作为指纹。"""
+    bucket, prefix = parse_s3_uri(s3_uri)
+    runs = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if not key.endswith('/' + METRICS_FILE_NAME) and key != METRICS_FILE_NAME:
+                continue
+            label = os.path.dirname(key)[len(prefix):] or os.path.dirname(key) or bucket
+            source = f"s3://{bucket}/{key}"
+            runs.append({
+                'run_id': make_run_id(label, source),
+                'source': source,
+                'fingerprint': obj.get('ETag', '').strip('"') or str(obj.get('Size'))
+            })
+    return runs
+
+def load_manifest(cache_dir):
+    """读取缓存清单。"""
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(cache_dir, manifest):
+    """原子地写入缓存清单。"""
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def read_metrics_frame(source, s3_client=None):
+    """流式读取单个作业的指标CSV为DataFrame。"""
+    import pandas as pd
+
+    if source.startswith('s3://'):
+        bucket, key = parse_s3_uri(source)
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+        df = pd.read_csv(body, usecols=METRIC_COLUMNS)
+    else:
+        df = pd.read_csv(source, usecols=METRIC_COLUMNS)
+
+    return df.astype({'step_number': 'int64', 'epoch_number': 'int64', 'training_loss': 'float64'})
+
+def prune_manifest(manifest, runs, cache_dir, s3_uris=()):
+    """删除来源已经不存在的缓存作业: 本地文件已被删除，或位于本次扫描的S3前缀下但没有被发现；
+    来源相同但作业ID不同（旧版本缓存）的条目也一并删除。返回删除的作业数。"""
+    discovered_ids = {run['run_id'] for run in runs}
+    discovered_sources = {run['source'] for run in runs}
+    s3_prefixes = tuple(s3_uri.rstrip('/') for s3_uri in s3_uris)
+    pruned = 0
+    for run_id, entry in list(manifest.items()):
+        if run_id in discovered_ids:
+            continue
+        source = entry.get('source', '')
+        if source.startswith('s3://'):
+            # 按路径分段匹配: 扫描 s3://bucket/out 时不能误删 s3://bucket/output-old/ 下的作业
+            gone = any(source == prefix or source.startswith(prefix + '/') for prefix in s3_prefixes)
+        else:
+            gone = not os.path.exists(source)
+        if gone or source in discovered_sources:
+            del manifest[run_id]
+            parquet_path = os.path.join(cache_dir, RUNS_SUBDIR, f"{run_id}.parquet")
+            if os.path.exists(parquet_path):
+                os.remove(parquet_path)
+            pruned += 1
+    return pruned
+
+def ingest_runs(runs, cache_dir, s3_client=None, s3_uris=()):
+    """增量摄取：只解析新增或指纹变化的作业，结果写入 runs/<run_id>.parquet；同时清理来源已不存在的作业。"""
+    os.makedirs(os.path.join(cache_dir, RUNS_SUBDIR), exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    pruned = prune_manifest(manifest, runs, cache_dir, s3_uris)
+    ingested = 0
+    skipped = 0
+
+    for run in runs:
+        entry = manifest.get(run['run_id'])
+        parquet_path = os.path.join(cache_dir, RUNS_SUBDIR, f"{run['run_id']}.parquet")
+        if entry and entry['fingerprint'] == run['fingerprint'] and os.path.exists(parquet_path):
+            skipped += 1
+            continue
+
+        try:
+            df = read_metrics_frame(run['source'], s3_client)
+            df.to_parquet(parquet_path, index=False)
+            manifest[run['run_id']] = {
+                'source': run['source'],
+                'fingerprint': run['fingerprint'],
+                'rows': len(df),
+                'ingested_at': datetime.now().isoformat(timespec='seconds')
+            }
+            ingested += 1
+            logging.info(f"已摄取作业指标: {run['run_id']} ({len(df)} 行)")
+        except Exception as e:
+            logging.error(f"摄取作业指标失败 {run['source']}: {e}")
+
+    save_manifest(cache_dir, manifest)
+    logging.info(f"摄取完成: 新增/更新 {ingested} 个作业，跳过未变化的 {skipped} 个作业，清理 {pruned} 个已不存在的作业")
+    return manifest
+
+def load_cached_runs(cache_dir, run_ids=None):
+    """从列式缓存中读取作业指标，返回 {run_id: DataFrame}。"""
+    import pandas as pd
+
+    runs_dir = os.path.join(cache_dir, RUNS_SUBDIR)
+    frames = {}
+    for file_name in sorted(os.listdir(runs_dir)):
+        if not file_name.endswith('.parquet'):
+            continue
+        run_id = file_name[:-len('.parquet')]
+        if run_ids is not None and run_id not in run_ids:
+            continue
+        frames[run_id] = pd.read_parquet(os.path.join(runs_dir, file_name))
+    return frames
+
+def summarize_run(df, tolerance=0.05):
+    """计算单个作业的收敛统计。
+
+    最终损失取最后5%步数的平均值；损失用同样宽度的居中滑动窗口平滑（不滞后），
+    收敛步数为平滑曲线首次进入平滑后最终值 (1 + tolerance) 范围内的步数。
+    """
+    import numpy as np
+
+    steps = df['step_number'].to_numpy()
+    losses = df['training_loss'].to_numpy()
+    tail = max(1, len(losses) // 20)
+    final_loss = float(np.nanmean(losses[-tail:]))
+    smoothed = df['training_loss'].rolling(tail, center=True, min_periods=1).mean().to_numpy()
+    final_smoothed = float(np.nanmean(smoothed[-tail:]))
+    converged = np.nonzero(smoothed <= final_smoothed + tolerance * abs(final_smoothed))[0]
+
+    return {
+        'steps': int(len(steps)),
+        'epochs': int(df['epoch_number'].nunique()),
+        'initial_loss': float(losses[0]),
+        'min_loss': float(np.nanmin(losses)),
+        'min_loss_step': int(steps[int(np.nanargmin(losses))]),
+        'final_loss': final_loss,
+        'convergence_step': int(steps[converged[0]]) if len(converged) else None
+    }
+
+def plot_overlaid_losses(frames, output_path, max_points=2000):
+    """将所有作业的损失曲线叠加绘制在一张图上。"""
+    plt = get_pyplot()
+    fig, ax = plt.subplots(figsize=(14, 7))
+    for run_id, df in frames.items():
+        steps, losses = decimate(df['step_number'].to_numpy(), df['training_loss'].to_numpy(), max_points)
+        ax.plot(steps, losses, linewidth=1, label=run_id)
+    ax.set_title('Training Loss Comparison')
+    ax.set_xlabel('Step Number')
+    ax.set_ylabel('Training Loss')
+    ax.grid(True, alpha=0.3)
+    if len(frames) <= 20:
+        ax.legend(fontsize='small')
+    return save_figure(fig, output_path, fast=True)
+
+def write_summary_csv(summaries, output_path):
+    """将各作业的收敛统计写入CSV。"""
+    import pandas as pd
+    df = pd.DataFrame.from_dict(summaries, orient='index')
+    df['convergence_step'] = df['convergence_step'].astype('Int64')
+    df.index.name = 'run_id'
+    df.sort_values('final_loss').to_csv(output_path)
+    return output_path
+
+def write_html_report(summaries, manifest, plot_file, output_path):
+    """生成静态HTML报告。"""
+    columns = ['steps', 'epochs', 'initial_loss', 'min_loss', 'min_loss_step', 'final_loss', 'convergence_step']
+    rows = []
+    for run_id, summary in sorted(summaries.items(), key=lambda item: item[1]['final_loss']):
+        cells = [f"<td>{html.escape(run_id)}</td>"]
+        for column in columns:
+            value = summary[column]
+            cells.append(f"<td>{value:.4f}</td>" if isinstance(value, float) else f"<td>{'' if value is None else value}</td>")
+        source = manifest.get(run_id, {}).get('source', '')
+        cells.append(f"<td>{html.escape(source)}</td>")
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+
+    header = ''.join(f"<th>{column}</th>" for column in ['run_id'] + columns + ['source'])
+    content = f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Training Runs Comparison</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; font-size: 0.9em; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+th {{ background: #f0f0f0; }}
+td:first-child, td:last-child {{ text-align: left; }}
+</style>
+</head>
+<body>
+<h1>Training Runs Comparison</h1>
+<p>Generated at {datetime.now().isoformat(timespec='seconds')} from {len(summaries)} runs.</p>
+<img src="{html.escape(os.path.basename(plot_file))}" style="max-width: 100%;">
+<h2>Convergence</h2>
+<table>
+<tr>{header}</tr>
+{chr(10).join(rows)}
+</table>
+</body>
+</html>
+"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return output_path
+
+def build_report(cache_dir, output_dir, manifest, run_ids, max_points=2000, tolerance=0.05):
+    """从列式缓存为本次发现的作业（run_ids）生成对比图、收敛统计表和HTML报告。"""
+    frames = load_cached_runs(cache_dir, set(run_ids) & set(manifest))
+    if not frames:
+        logging.error("缓存中没有任何作业指标，无法生成报告")
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    summaries = {run_id: summarize_run(df, tolerance) for run_id, df in frames.items()}
+    plot_file = plot_overlaid_losses(frames, os.path.join(output_dir, 'training_loss_comparison.png'), max_points)
+    summary_file = write_summary_csv(summaries, os.path.join(output_dir, 'training_runs_summary.csv'))
+    report_file = write_html_report(summaries, manifest, plot_file, os.path.join(output_dir, 'training_runs_report.html'))
+
+    logging.info(f"对比图: {plot_file}")
+    logging.info(f"收敛统计: {summary_file}")
+    logging.info(f"HTML报告: {report_file}")
+    return report_file
+
+def main():
+    """生成多作业对比报告的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'compare_training_runs')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    cache_dir = args.cache_dir if args.cache_dir else config['cache_dir']
+    output_dir = args.output_dir if args.output_dir else config['output_dir']
+    region = args.region if args.region else config['region']
+    runs_dirs = args.runs_dir or ([] if args.s3_uri else [config['runs_dir']])
+
+    # 配置日志
+    setup_logging(config['log_file'], 'compare_training_runs')
+
+    # 发现所有作业
+    runs = []
+    for runs_dir in runs_dirs:
+        runs.extend(discover_local_runs(runs_dir))
+    s3_client = None
+    if args.s3_uri:
+        s3_client = get_client('s3', region_name=region, endpoint_url=args.s3_endpoint_url)
+        for s3_uri in args.s3_uri:
+            runs.extend(discover_s3_runs(s3_client, s3_uri))
+    logging.info(f"发现 {len(runs)} 个作业的指标文件")
+
+    # 增量摄取并生成报告
+    manifest = ingest_runs(runs, cache_dir, s3_client, args.s3_uri or ())
+    build_report(cache_dir, output_dir, manifest, [run['run_id'] for run in runs], args.max_points, args.tolerance)
+
+if __name__ == "__main__":
+    main()
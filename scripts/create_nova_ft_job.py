@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
-import boto3
 import argparse
 import logging
 import time
 import json
 import os
-import dotenv
 from datetime import datetime
 from pathlib import Path
 
+from instrumentation import observe, setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import get_client
+from model_catalog import load_catalog, validate_base_model
+from estimate_training_cost import estimate_dataset, format_estimate
+
 # 解析命令行参数
 def parse_arguments():
     """解析命令行参数。"""
@@ -53,36 +58,51 @@ def parse_arguments():
     parser.add_argument('--skip-s3-check', action='store_true',
                         help='跳过检查S3中的训练数据')
     
+    parser.add_argument('--skip-model-check', action='store_true',
+                        help='跳过基于模型目录的基础模型预检')
+    
+    parser.add_argument('--skip-cost-estimate', action='store_true',
+                        help='跳过训练token与费用的预估')
+    
+    parser.add_argument('--training-data-file', type=str,
+                        help='用于预估token与费用的本地训练JSONL（默认为TRAIN_JSONL）')
+    
+    parser.add_argument('--max-cost', type=float,
+                        help='预估费用（美元）超过该值时不创建作业')
+    
     parser.add_argument('--config', type=str, default='../config.env',
                         help='配置文件路径')
     
+    add_profile_arguments(parser)
+    
     return parser.parse_args()
 
 # 加载环境变量
 def load_config(config_path):
     """加载环境变量配置。"""
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
-    
-    dotenv.load_dotenv(config_path)
+    settings = load_settings(config_path)
     
     # 获取当前时间戳
     timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
     
-    # 获取必要的环境变量
+    # 获取必要的配置
     config = {
-        'base_model_id': os.getenv('BASE_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0'),
-        'job_name': os.getenv('JOB_NAME', f"invoice-seller-extraction-{timestamp}"),
-        'custom_model_name': os.getenv('CUSTOM_MODEL_NAME', f"invoice-seller-extraction-{timestamp}"),
-        'training_data_s3_uri': f"s3://{os.getenv('S3_BUCKET')}/{os.getenv('S3_PREFIX_TRAINING')}/train_data.jsonl",
-        'test_data_s3_uri': f"s3://{os.getenv('S3_BUCKET')}/{os.getenv('S3_PREFIX_TRAINING')}/test_data.jsonl",
-        'output_s3_uri': f"s3://{os.getenv('S3_BUCKET')}/{os.getenv('S3_PREFIX_OUTPUT')}/",
-        'role_arn': os.getenv('ROLE_ARN', f"arn:aws:iam::{os.getenv('AWS_ACCOUNT_ID')}:role/service-role/AmazonBedrockExecutionRoleForNova"),
-        'region': os.getenv('AWS_REGION', 'us-east-1'),
-        'epoch_count': int(os.getenv('EPOCH_COUNT', '1')),
-        'batch_size': int(os.getenv('BATCH_SIZE', '1')),
-        'learning_rate': float(os.getenv('LEARNING_RATE', '0.0001')),
-        'log_file': os.path.join('..', os.getenv('LOGS_DIR', 'output/logs'), 'nova_finetuning_job.log')
+        'base_model_id': settings.base_model_id,
+        'job_name': settings.job_name or f"invoice-seller-extraction-{timestamp}",
+        'custom_model_name': settings.custom_model_name or f"invoice-seller-extraction-{timestamp}",
+        'training_data_s3_uri': f"s3://{settings.s3_bucket}/{settings.s3_prefix_training}/train_data.jsonl",
+        'test_data_s3_uri': f"s3://{settings.s3_bucket}/{settings.s3_prefix_training}/test_data.jsonl",
+        'output_s3_uri': f"s3://{settings.s3_bucket}/{settings.s3_prefix_output}/",
+        'role_arn': settings.training_role_arn(),
+        'region': settings.aws_region,
+        'epoch_count': settings.epoch_count,
+        'batch_size': settings.batch_size,
+        'learning_rate': settings.learning_rate,
+        'catalog_dir': str(settings.model_catalog_dir),
+        'cache_dir': str(settings.cache_dir),
+        'training_data_file': str(settings.train_jsonl),
+        'images_dir': str(settings.images_dir),
+        'log_file': str(settings.finetuning_job_log)
     }
     
     return config
@@ -104,11 +124,12 @@ def check_s3_file(s3_uri, region, required=True):
             key = parts[1]
         
         # 创建S3客户端
-        s3_client = boto3.client('s3', region_name=region)
+        s3_client = get_client('s3', region_name=region)
         
         try:
             # 检查文件是否存在
-            s3_client.head_object(Bucket=bucket, Key=key)
+            with stage('s3_head_object'):
+                s3_client.head_object(Bucket=bucket, Key=key)
             logging.info(f"文件存在: {s3_uri}")
             return True
         except Exception as e:
@@ -124,9 +145,62 @@ def check_s3_file(s3_uri, region, required=True):
         logging.error(f"检查S3文件时出错: {e}")
         return False if required else True
 
+def check_base_model(config):
+    """使用本地模型目录检查基础模型是否支持在目标区域微调。"""
+    try:
+        with stage('load_model_catalog'):
+            catalog = load_catalog(config['catalog_dir'], config['cache_dir'])
+    except FileNotFoundError as e:
+        logging.warning(f"未找到模型目录，跳过基础模型预检: {e}")
+        return True
+    
+    ok, problems, alternatives = validate_base_model(catalog, config['base_model_id'], config['region'])
+    if ok:
+        logging.info(f"基础模型预检通过: {config['base_model_id']}")
+        return True
+    
+    for problem in problems:
+        logging.error(f"基础模型预检失败: {problem}")
+    if alternatives:
+        logging.error("该区域可用于微调的模型:")
+        for arn in alternatives:
+            logging.error(f"  {arn}")
+    logging.error("如果目录已过期，可运行 python model_catalog.py --refresh 刷新，或使用--skip-model-check跳过此检查。")
+    return False
+
+def check_training_cost(config):
+    """预估训练数据的token数量、训练时长与费用。"""
+    if not os.path.exists(config['training_data_file']):
+        logging.warning(f"本地训练数据不存在，跳过费用预估: {config['training_data_file']}")
+        return True
+    
+    with stage('estimate_training_cost'):
+        estimate = estimate_dataset(config['training_data_file'], config['images_dir'], config['cache_dir'],
+                                    config['base_model_id'], config['epoch_count'])
+    logging.info(f"训练数据预估（{config['training_data_file']}）:")
+    for line in format_estimate(estimate).splitlines():
+        logging.info(f"  {line}")
+    
+    if estimate['oversized_count']:
+        logging.error(f"{estimate['oversized_count']} 个样本超过 {estimate['max_sample_tokens']} token，训练作业会失败。")
+        return False
+    if config['max_cost'] is not None and estimate['estimated_cost_usd'] > config['max_cost']:
+        logging.error(f"预估费用 ${estimate['estimated_cost_usd']:.2f} 超过上限 ${config['max_cost']:.2f}。"
+                      f"可调整--max-cost，或使用--skip-cost-estimate跳过此检查。")
+        return False
+    return True
+
 def create_fine_tuning_job(config):
     """使用boto3创建微调作业。"""
     try:
+        # 检查基础模型是否支持微调
+        if not config['skip_model_check'] and not check_base_model(config):
+            return None
+        
+        # 预估训练token与费用
+        if not config['skip_cost_estimate'] and not check_training_cost(config):
+            return None
+        
         # 检查训练数据是否存在于S3中
         if not config['skip_s3_check']:
             logging.info(f"检查训练数据: {config['training_data_s3_uri']}...")
@@ -142,7 +216,7 @@ def create_fine_tuning_job(config):
                 check_s3_file(config['test_data_s3_uri'], config['region'], required=False)
         
         # 创建Bedrock客户端
-        bedrock_client = boto3.client('bedrock', region_name=config['region'])
+        bedrock_client = get_client('bedrock', region_name=config['region'])
         
         # 准备超参数
         hyperparameters = {
@@ -186,7 +260,9 @@ def create_fine_tuning_job(config):
             return None
         
         # 创建微调作业
+        start = time.monotonic()
         response = bedrock_client.create_model_customization_job(**job_config)
+        observe('bedrock.create_job_seconds', time.monotonic() - start)
         
         # 记录响应
         job_id = response.get('jobArn', '').split('/')[-1]
@@ -202,7 +278,7 @@ def create_fine_tuning_job(config):
 def check_job_status(job_arn, region):
     """检查微调作业的状态。"""
     try:
-        bedrock_client = boto3.client('bedrock', region_name=region)
+        bedrock_client = get_client('bedrock', region_name=region)
         response = bedrock_client.get_model_customization_job(jobIdentifier=job_arn)
         status = response.get('status', 'UNKNOWN')
         logging.info(f"作业状态: {status}")
@@ -215,6 +291,7 @@ def main():
     """创建微调作业的主函数。"""
     # 解析命令行参数
     args = parse_arguments()
+    start_profiling(args, 'create_nova_ft_job')
     
     # 加载配置
     config = load_config(args.config)
@@ -242,20 +319,17 @@ def main():
         config['batch_size'] = args.batch_size
     if args.learning_rate:
         config['learning_rate'] = args.learning_rate
+    if args.training_data_file:
+        config['training_data_file'] = args.training_data_file
     
     config['dry_run'] = args.dry_run
     config['skip_s3_check'] = args.skip_s3_check
+    config['skip_model_check'] = args.skip_model_check
+    config['skip_cost_estimate'] = args.skip_cost_estimate
+    config['max_cost'] = args.max_cost
     
     # 配置日志
-    os.makedirs(os.path.dirname(config['log_file']), exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(config['log_file']),
-            logging.StreamHandler()
-        ]
-    )
+    setup_logging(config['log_file'], 'create_nova_ft_job')
     
     # 记录配置
     logging.info(f"使用配置:")
@@ -273,6 +347,8 @@ def main():
     logging.info(f"- 学习率: {config['learning_rate']}")
     logging.info(f"- 模拟运行: {config['dry_run']}")
     logging.info(f"- 跳过S3检查: {config['skip_s3_check']}")
+    logging.info(f"- 跳过模型预检: {config['skip_model_check']}")
+    logging.info(f"- 跳过费用预估: {config['skip_cost_estimate']}")
     
     # 创建微调作业
     response = create_fine_tuning_job(config)
@@ -290,6 +366,7 @@ def main():
         logging.info("\n要监控作业状态:")
         logging.info(f"  1. 使用AWS CLI: aws bedrock get-model-customization-job --job-identifier {job_arn} --region {config['region']}")
         logging.info(f"  2. 使用AWS控制台: https://{config['region']}.console.aws.amazon.com/bedrock/home?region={config['region']}#/modelcustomization")
+        logging.info(f"  3. 实时检测训练异常并自动停止: python3 training_watchdog.py --job-arn {job_arn}")
 
 if __name__ == "__main__":
     main()
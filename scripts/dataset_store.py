@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+列式主数据集（Parquet）
+- 每张发票一行: 图像哈希、图片名称、S3 URI、宽高、销售方标注、标注来源、数据集划分、入库时间
+- 从标注CSV（配合本地图像目录）或已有的Nova JSONL导入，在同一划分内按图像哈希去重（没有本地图像时
+  按S3 URI或图片名称匹配已有的行），新导入的行覆盖旧行；不同划分各自保留一行，
+  同一图像同时出现在训练集与测试集时给出警告；
+  图像哈希由 image_scanner 增量计算，只有新增或修改的图像需要重新读取
+- 查询时把过滤条件下推到Parquet读取（按行组统计跳过、只读需要的列），
+  查询结果可以流式渲染为Nova对话格式的JSONL，生成新的训练/测试集变体无需重跑整个流水线
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+from instrumentation import count, setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from estimate_training_cost import DIMENSIONS_CACHE_FILE, ImageDimensionCache
+from image_scanner import ImageScanner
+from process_images_for_training import create_training_data, read_csv_data
+
+SPLITS = ('train', 'test')
+# 没有图像哈希的行按这些字段（在同一划分内）匹配已有的行
+ALIAS_FIELDS = ('s3_uri', 'image_name')
+# Parquet 行组大小（行数），过滤条件按行组统计跳过
+ROW_GROUP_SIZE = 8192
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='管理列式主数据集，按条件查询并渲染为Nova JSONL')
+
+    parser.add_argument('--store', type=str, help='Parquet数据集文件路径')
+    parser.add_argument('--import-csv', type=str, action='append', help='导入标注CSV（可重复指定，需配合 --split）')
+    parser.add_argument('--import-jsonl', type=str, action='append', help='导入已有的Nova JSONL（可重复指定，需配合 --split）')
+    parser.add_argument('--images-dir', type=str, help='导入时图像所在目录（默认为该划分的图像目录）')
+    parser.add_argument('--label-source', type=str, help='导入条目的标注来源（默认为 <导入文件名>）')
+    parser.add_argument('--split', type=str, choices=SPLITS, help='导入时为数据集划分；查询时按划分过滤')
+    parser.add_argument('--seller', type=str, help='按销售方名称过滤（包含该文本）')
+    parser.add_argument('--source', type=str, action='append', help='按标注来源过滤（可重复指定）')
+    parser.add_argument('--min-width', type=int, help='只保留宽度不小于该值的图像')
+    parser.add_argument('--min-height', type=int, help='只保留高度不小于该值的图像')
+    parser.add_argument('--sample', type=int, help='从查询结果中随机抽取的条目数')
+    parser.add_argument('--seed', type=int, default=0, help='随机抽样的种子')
+    parser.add_argument('--render', type=str, metavar='OUTPUT_JSONL', help='把查询结果渲染为Nova JSONL')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出查询结果')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'store': str(settings.dataset_store),
+        'images_dirs': {'train': str(settings.train_images_dir), 'test': str(settings.test_images_dir)},
+        's3_bucket': settings.s3_bucket,
+        's3_prefix': settings.s3_prefix_images,
+        'account_id': settings.aws_account_id,
+        'cache_dir': str(settings.cache_dir),
+        'log_file': str(settings.log_path('dataset_store.log'))
+    }
+
+    return config
+
+def store_schema():
+    """数据集的Arrow表结构。"""
+    import pyarrow as pa
+    return pa.schema([
+        ('image_hash', pa.string()),
+        ('image_name', pa.string()),
+        ('s3_uri', pa.string()),
+        ('width', pa.int32()),
+        ('height', pa.int32()),
+        ('seller', pa.string()),
+        ('label_source', pa.string()),
+        ('split', pa.string()),
+        ('added_at', pa.timestamp('s'))
+    ])
+
+def row_key(row):
+    """去重键: (图像哈希, 划分)，没有图像哈希时用S3 URI代替哈希。
+
+    划分是键的一部分，把训练图像再导入测试集会新增一行而不是把它移到测试集，泄漏由 leaked_hashes 报告。
+    """
+    return row['image_hash'] or row['s3_uri'], row['split']
+
+def find_existing(row, merged, aliases):
+    """查找与新行对应的已有行的键: 先按去重键，再在同一划分内按S3 URI或图片名称匹配。"""
+    key = row_key(row)
+    if key in merged:
+        return key
+    for field in ALIAS_FIELDS:
+        alias = aliases.get((field, row[field], row['split']))
+        if alias in merged:
+            return alias
+    return None
+
+def make_row(image_name, seller, s3_uri, split, label_source, scanner, dims_cache, added_at):
+    """为一张发票创建数据集行；图像在扫描到的目录中时填入哈希与尺寸。"""
+    image_hash = width = height = None
+    if image_name in scanner:
+        image_hash = scanner.hash_of(image_name)
+        size = dims_cache.lookup(os.path.join(scanner.root, image_name))
+        if size:
+            width, height = size
+    else:
+        count('dataset.missing_image')
+    return {'image_hash': image_hash, 'image_name': image_name, 's3_uri': s3_uri, 'width': width, 'height': height,
+            'seller': seller, 'label_source': label_source, 'split': split, 'added_at': added_at}
+
+def rows_from_csv(csv_path, scanner, split, label_source, config, dims_cache):
+    """从标注CSV导入，S3 URI 与 process_images_for_training 上传的位置一致。"""
+    added_at = int(time.time())
+    rows = []
+    for entry in read_csv_data(csv_path):
+        image_name = entry['图片名称']
+        seller = (entry.get('销售方') or '').strip()
+        if not seller:
+            count('dataset.skipped')
+            continue
+        s3_uri = f"s3://{config['s3_bucket']}/{config['s3_prefix']}/{image_name}"
+        rows.append(make_row(image_name, seller, s3_uri, split, label_source, scanner, dims_cache, added_at))
+    return rows
+
+def rows_from_jsonl(jsonl_path, scanner, split, label_source, dims_cache):
+    """从已有的Nova JSONL导入，每个样本的每一轮（图像 + 助手回复）为一行。"""
+    added_at = int(time.time())
+    rows = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                messages = json.loads(line)['messages']
+            except (ValueError, KeyError) as e:
+                logging.warning(f"{jsonl_path} 第 {line_number} 行无法解析，已跳过: {e}")
+                count('dataset.skipped')
+                continue
+            for user, assistant in zip(messages[::2], messages[1::2]):
+                images = [item['image'] for item in user.get('content', []) if 'image' in item]
+                texts = [item['text'] for item in assistant.get('content', []) if 'text' in item]
+                if len(images) != 1 or not texts:
+                    count('dataset.skipped')
+                    continue
+                s3_uri = images[0]['source']['s3Location']['uri']
+                rows.append(make_row(s3_uri.rsplit('/', 1)[-1], texts[0].strip(), s3_uri, split, label_source,
+                                     scanner, dims_cache, added_at))
+    return rows
+
+class DatasetStore:
+    """Parquet文件上的主数据集。"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self, columns=None, filters=None):
+        """读取数据集（可只读部分列、下推过滤条件），文件不存在时返回空表。"""
+        import pyarrow.parquet as pq
+        if not self.exists():
+            schema = store_schema()
+            return schema.empty_table().select(columns) if columns else schema.empty_table()
+        return pq.read_table(self.path, columns=columns, filters=filters, schema=store_schema())
+
+    def upsert(self, rows):
+        """按去重键合并新行（新行覆盖旧行），原子地重写Parquet文件；返回 (新增数, 更新数)。"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        merged = {}
+        aliases = {}
+
+        def remember(row):
+            merged[row_key(row)] = row
+            for field in ALIAS_FIELDS:
+                if row[field]:
+                    aliases[(field, row[field], row['split'])] = row_key(row)
+
+        for row in self.read().to_pylist():
+            remember(row)
+        before = len(merged)
+        updated = 0
+        for row in rows:
+            existing = find_existing(row, merged, aliases)
+            if existing is not None:
+                updated += 1
+                old = merged.pop(existing)
+                if not row['image_hash'] and old['image_hash']:
+                    # 本次导入时没有本地图像（例如只导入JSONL），保留之前扫描得到的哈希与尺寸
+                    row = {**row, 'image_hash': old['image_hash'], 'width': old['width'], 'height': old['height']}
+            remember(row)
+        # 按划分和销售方排序，使行组统计对常用过滤条件有效
+        ordered = sorted(merged.values(), key=lambda row: (row['split'], row['seller'], row['image_name']))
+        table = pa.Table.from_pylist(ordered, schema=store_schema())
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, compression='zstd')
+        os.replace(tmp_path, self.path)
+        return len(merged) - before, updated
+
+    def query(self, split=None, seller=None, sources=None, min_width=None, min_height=None, columns=None):
+        """按条件查询，返回Arrow表；等值与范围条件下推到Parquet读取，销售方包含匹配在读取后过滤。"""
+        import pyarrow.compute as pc
+        filters = []
+        if split:
+            filters.append(('split', '=', split))
+        if sources:
+            filters.append(('label_source', 'in', list(sources)))
+        if min_width:
+            filters.append(('width', '>=', min_width))
+        if min_height:
+            filters.append(('height', '>=', min_height))
+        table = self.read(columns=columns, filters=filters or None)
+        if seller:
+            table = table.filter(pc.match_substring(table['seller'], seller))
+        return table
+
+    def leaked_hashes(self):
+        """同时出现在训练集与测试集中的图像哈希（没有哈希的行按S3 URI比较）。"""
+        table = self.read(columns=['image_hash', 's3_uri', 'split'])
+        splits = {}
+        for row in table.to_pylist():
+            identity = row['image_hash'] or row['s3_uri']
+            if identity:
+                splits.setdefault(identity, set()).add(row['split'])
+        return sorted(image_hash for image_hash, seen in splits.items() if len(seen) > 1)
+
+    def summary(self):
+        """按划分和标注来源统计条目数。"""
+        table = self.read(columns=['split', 'label_source'])
+        grouped = table.group_by(['split', 'label_source']).aggregate([([], 'count_all')])
+        return sorted((row['split'], row['label_source'], row['count_all']) for row in grouped.to_pylist())
+
+def sample_rows(table, sample, seed=0):
+    """从表中随机抽取 sample 行（保持原有顺序）。"""
+    if not sample or sample >= table.num_rows:
+        return table
+    indices = sorted(random.Random(seed).sample(range(table.num_rows), sample))
+    return table.take(indices)
+
+def render_jsonl(table, output_jsonl, config):
+    """把查询结果按批流式写为Nova JSONL，返回 (写入数, 失败数)。"""
+    written = failed = 0
+    tmp_path = output_jsonl + '.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(output_jsonl)), exist_ok=True)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for batch in table.select(['image_name', 'seller', 's3_uri']).to_batches():
+            for row in batch.to_pylist():
+                training_data = create_training_data(row['image_name'], row['seller'], row['s3_uri'], config)
+                if training_data is None:
+                    failed += 1
+                    continue
+                f.write(json.dumps(training_data, ensure_ascii=False) + '\n')
+                written += 1
+    os.replace(tmp_path, output_jsonl)
+    count('dataset.rendered', written)
+    return written, failed
+
+def import_files(store, args, config):
+    """导入命令行指定的CSV与JSONL文件。"""
+    if not args.split:
+        raise SystemExit("导入时必须用 --split 指定数据集划分")
+    images_dir = args.images_dir or config['images_dirs'][args.split]
+    dims_cache = ImageDimensionCache(os.path.join(config['cache_dir'], DIMENSIONS_CACHE_FILE))
+    # 增量扫描图像目录，只为新增或修改的图像计算哈希
+    scanner = ImageScanner(images_dir, config['cache_dir'])
+    with stage('scan_images'):
+        scanner.scan()
+        scanner.hash_pending()
+    scanner.save()
+    rows = []
+    with stage('import'):
+        for csv_path in args.import_csv or []:
+            label_source = args.label_source or os.path.basename(csv_path)
+            rows.extend(rows_from_csv(csv_path, scanner, args.split, label_source, config, dims_cache))
+        for jsonl_path in args.import_jsonl or []:
+            label_source = args.label_source or os.path.basename(jsonl_path)
+            rows.extend(rows_from_jsonl(jsonl_path, scanner, args.split, label_source, dims_cache))
+    dims_cache.save()
+    with stage('write_store'):
+        added, updated = store.upsert(rows)
+    logging.info(f"导入 {len(rows)} 个条目到 {store.path}: 新增 {added}，更新 {updated}")
+    leaked = store.leaked_hashes()
+    if leaked:
+        logging.warning(f"{len(leaked)} 张图像同时出现在训练集与测试集中，例如 {leaked[0]}")
+
+def main():
+    """管理主数据集的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'dataset_store')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    if args.store:
+        config['store'] = args.store
+
+    # 配置日志
+    setup_logging(config['log_file'], 'dataset_store')
+
+    store = DatasetStore(config['store'])
+    if args.import_csv or args.import_jsonl:
+        import_files(store, args, config)
+        for split, label_source, rows in store.summary():
+            print(f"{split:<6} {label_source:<32} {rows:>8}")
+        return 0
+
+    if not store.exists():
+        logging.error(f"数据集不存在: {store.path}，请先用 --import-csv 或 --import-jsonl 导入")
+        return 1
+
+    # 单独计时 pyarrow 的加载，查询耗时只含读取与过滤
+    start = time.perf_counter()
+    import pyarrow.dataset  # noqa: F401
+    import pyarrow.compute  # noqa: F401
+    load_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with stage('query'):
+        table = store.query(split=args.split, seller=args.seller, sources=args.source,
+                            min_width=args.min_width, min_height=args.min_height)
+        table = sample_rows(table, args.sample, args.seed)
+    query_ms = (time.perf_counter() - start) * 1000
+
+    if args.render:
+        start = time.perf_counter()
+        with stage('render'):
+            written, failed = render_jsonl(table, args.render, config)
+        logging.info(f"已写出 {written} 个样本到 {args.render}（加载 {load_ms:.0f} ms，查询 {query_ms:.1f} ms，写出 "
+                     f"{(time.perf_counter() - start) * 1000:.1f} ms，失败 {failed}）")
+        return 0 if written else 1
+
+    if args.json:
+        print(json.dumps(table.to_pylist(), ensure_ascii=False, indent=2, default=str))
+    else:
+        for row in table.select(['split', 'image_name', 'seller', 'width', 'height', 'label_source']).to_pylist():
+            print(f"{row['split']:<6} {row['image_name']:<24} {row['seller']:<24} "
+                  f"{row['width'] or '-'}x{row['height'] or '-'}  {row['label_source']}")
+        print(f"共 {table.num_rows} 个条目（加载 {load_ms:.0f} ms，查询 {query_ms:.1f} ms）")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+微调数据集的token与费用估算
+- 流式读取训练JSONL，文本token用本地近似分词估算（非ASCII字符约1个token，ASCII约4个字符1个token）
+- 图像token由图像尺寸估算；尺寸从本地图像文件头读取并缓存在 CACHE_DIR/image_dims.json，
+  按 (大小, 修改时间) 判断是否需要重新读取，S3 URI 按文件名对应到本地图像
+- 各样本的token数存入数组后用NumPy一次性汇总：总量、分位数、分布直方图、超长样本
+- 按训练轮数推算计费token、预计训练时长与费用（单价与吞吐为可覆盖的近似值）
+create_nova_ft_job.py 在提交作业前调用 estimate_dataset 做预检。
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import logging
+from array import array
+
+from instrumentation import setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from image_scanner import IMAGE_EXTENSIONS
+
+DIMENSIONS_CACHE_FILE = 'image_dims.json'
+
+# 近似分词: ASCII文本平均每个token的字符数；非ASCII字符（中文、全角标点）每个字符计1个token
+ASCII_CHARS_PER_TOKEN = 4.0
+NON_ASCII_TOKENS_PER_CHAR = 1.0
+# 每条消息的角色与分隔符开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 图像token的近似: 超过像素上限时先等比缩小，再按每token像素数折算，另加固定开销
+IMAGE_MAX_PIXELS = 1568 * 1568
+PIXELS_PER_TOKEN = 750
+IMAGE_OVERHEAD_TOKENS = 85
+# 本地找不到图像、缓存中也没有尺寸时使用的默认尺寸
+DEFAULT_IMAGE_SIZE = (1500, 1000)
+
+# 各模型的微调单价（美元/1000个训练token）与训练吞吐（token/秒）的近似值，请以当前官方价格为准
+MODEL_PRICING = {
+    'nova-micro': {'price_per_1k': 0.001, 'tokens_per_second': 6000},
+    'nova-lite': {'price_per_1k': 0.002, 'tokens_per_second': 4000},
+    'nova-pro': {'price_per_1k': 0.008, 'tokens_per_second': 1500}
+}
+DEFAULT_MODEL_FAMILY = 'nova-lite'
+# 作业排队、实例准备与模型导出的固定耗时（秒）
+JOB_OVERHEAD_SECONDS = 20 * 60
+# 单个样本的上下文上限（token），超过时训练会失败
+DEFAULT_MAX_SAMPLE_TOKENS = 32000
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='估算微调数据集的token数量、训练时长与费用')
+
+    parser.add_argument('--input-file', '-i', type=str, help='训练JSONL文件（默认为 TRAIN_JSONL）')
+    parser.add_argument('--images-dir', type=str, help='本地图像目录（递归查找，默认为 IMAGES_DIR）')
+    parser.add_argument('--base-model-id', type=str, help='基础模型ID（用于选择单价与吞吐）')
+    parser.add_argument('--epoch-count', type=int, help='训练轮数')
+    parser.add_argument('--price-per-1k', type=float, help='覆盖每1000个训练token的单价（美元）')
+    parser.add_argument('--tokens-per-second', type=float, help='覆盖训练吞吐（token/秒）')
+    parser.add_argument('--max-sample-tokens', type=int, default=DEFAULT_MAX_SAMPLE_TOKENS,
+                        help='单个样本的token上限，超过的样本会被列出')
+    parser.add_argument('--no-cache', action='store_true', help='不读写图像尺寸缓存')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出估算结果')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'input_file': str(settings.train_jsonl),
+        'images_dir': str(settings.images_dir),
+        'cache_dir': str(settings.cache_dir),
+        'base_model_id': settings.base_model_id,
+        'epoch_count': settings.epoch_count,
+        'log_file': str(settings.log_path('estimate_training_cost.log'))
+    }
+
+    return config
+
+def estimate_text_tokens(text):
+    """近似的文本token数。"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    non_ascii_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + non_ascii_chars * NON_ASCII_TOKENS_PER_CHAR)
+
+def estimate_image_tokens(width, height):
+    """由图像尺寸估算图像token数。"""
+    pixels = width * height
+    if pixels > IMAGE_MAX_PIXELS:
+        pixels = IMAGE_MAX_PIXELS
+    return math.ceil(pixels / PIXELS_PER_TOKEN) + IMAGE_OVERHEAD_TOKENS
+
+def model_family(base_model_id):
+    """从模型ID或ARN中识别模型系列（nova-micro / nova-lite / nova-pro）。"""
+    for family in MODEL_PRICING:
+        if family in (base_model_id or ''):
+            return family
+    return DEFAULT_MODEL_FAMILY
+
+class ImageDimensionCache:
+    """本地图像尺寸缓存: 文件名 -> (宽, 高)，按文件大小和修改时间失效。"""
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.dirty = False
+        self.reads = 0
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                # 缓存损坏时重新读取
+                self.entries = {}
+
+    def scan(self, images_dir):
+        """递归扫描图像目录，只为新增或变化的文件读取图像头。"""
+        if not images_dir or not os.path.isdir(images_dir):
+            return 0
+        reads_before = self.reads
+        pending = [images_dir]
+        while pending:
+            with os.scandir(pending.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                        continue
+                    if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    self.lookup(entry.path, entry.stat())
+        return self.reads - reads_before
+
+    def lookup(self, path, stat=None):
+        """返回本地图像的 (宽, 高)；缓存中没有或文件已变化时读取图像头，读取失败返回 None。"""
+        name = os.path.basename(path)
+        stat = stat or os.stat(path)
+        cached = self.entries.get(name)
+        if cached and cached[2] == stat.st_size and cached[3] == stat.st_mtime_ns:
+            return cached[0], cached[1]
+        size = read_image_size(path)
+        if size:
+            self.entries[name] = [size[0], size[1], stat.st_size, stat.st_mtime_ns]
+            self.dirty = True
+            self.reads += 1
+        return size
+
+    def get(self, name):
+        entry = self.entries.get(name)
+        return (entry[0], entry[1]) if entry else None
+
+    def default_size(self):
+        """缓存中图像尺寸的中位数，缓存为空时为 DEFAULT_IMAGE_SIZE。"""
+        if not self.entries:
+            return DEFAULT_IMAGE_SIZE
+        import numpy as np
+        dims = np.array([entry[:2] for entry in self.entries.values()])
+        return tuple(int(value) for value in np.median(dims, axis=0))
+
+    def save(self):
+        if not self.cache_path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+def read_image_size(path):
+    """只读取图像文件头获得 (宽, 高)，读取失败返回 None。"""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except Exception as e:
+        logging.warning(f"无法读取图像尺寸 {path}: {e}")
+        return None
+
+def image_name(image):
+    """图像内容块对应的文件名（S3 URI 或本地路径的最后一段）。"""
+    source = image.get('source', {})
+    location = source.get('s3Location', {}).get('uri') or source.get('path') or ''
+    return location.rsplit('/', 1)[-1]
+
+def scan_samples(input_file, dimensions):
+    """流式读取JSONL，返回逐样本的token数组与读取统计。"""
+    fallback = dimensions.default_size()
+    fallback_tokens = estimate_image_tokens(*fallback)
+    input_tokens = array('q')
+    output_tokens = array('q')
+    image_tokens = array('q')
+    image_counts = array('q')
+    unknown_images = 0
+    bad_lines = []
+    # 系统提示词和指令在各样本间通常相同，按文本缓存token数
+    text_cache = {}
+    image_cache = {}
+
+    def text_tokens(text):
+        tokens = text_cache.get(text)
+        if tokens is None:
+            tokens = text_cache[text] = estimate_text_tokens(text)
+        return tokens
+
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                sample = json.loads(line)
+            except ValueError as e:
+                bad_lines.append(line_number)
+                logging.warning(f"第 {line_number} 行不是有效的JSON: {e}")
+                continue
+            sample_input = sum(text_tokens(item.get('text', '')) for item in sample.get('system', []))
+            sample_output = 0
+            sample_images = 0
+            sample_image_tokens = 0
+            messages = sample.get('messages', [])
+            for message in messages:
+                message_tokens = MESSAGE_OVERHEAD_TOKENS
+                for item in message.get('content', []):
+                    if 'text' in item:
+                        message_tokens += text_tokens(item['text'])
+                    elif 'image' in item:
+                        name = image_name(item['image'])
+                        tokens = image_cache.get(name)
+                        if tokens is None:
+                            size = dimensions.get(name)
+                            if size is None:
+                                unknown_images += 1
+                                tokens = fallback_tokens
+                            else:
+                                tokens = image_cache[name] = estimate_image_tokens(*size)
+                        sample_images += 1
+                        sample_image_tokens += tokens
+                if message.get('role') == 'assistant':
+                    sample_output += message_tokens
+                else:
+                    sample_input += message_tokens
+            input_tokens.append(sample_input)
+            output_tokens.append(sample_output)
+            image_tokens.append(sample_image_tokens)
+            image_counts.append(sample_images)
+
+    return {
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'image_tokens': image_tokens,
+        'image_counts': image_counts,
+        'unknown_images': unknown_images,
+        'bad_lines': bad_lines,
+        'fallback_size': fallback
+    }
+
+def distribution(values):
+    """一组token数的分位数摘要。"""
+    import numpy as np
+    if not len(values):
+        return {'mean': 0, 'min': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'mean': float(values.mean()), 'min': int(values.min()), 'p50': float(p50),
+            'p90': float(p90), 'p99': float(p99), 'max': int(values.max())}
+
+def summarize(scan, epoch_count, family, price_per_1k=None, tokens_per_second=None,
+              max_sample_tokens=DEFAULT_MAX_SAMPLE_TOKENS):
+    """用NumPy汇总逐样本数组，推算计费token、训练时长与费用。"""
+    import numpy as np
+    text_input, output, images, image_counts = (np.frombuffer(scan[name], dtype=np.int64) for name in
+                                                ('input_tokens', 'output_tokens', 'image_tokens', 'image_counts'))
+    total = text_input + output + images
+
+    pricing = MODEL_PRICING[family]
+    price_per_1k = price_per_1k or pricing['price_per_1k']
+    tokens_per_second = tokens_per_second or pricing['tokens_per_second']
+    tokens_per_epoch = int(total.sum())
+    billed_tokens = tokens_per_epoch * epoch_count
+    training_seconds = billed_tokens / tokens_per_second
+
+    edges = np.array([0, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, np.iinfo(np.int64).max])
+    histogram, _ = np.histogram(total, bins=edges)
+    oversized = np.flatnonzero(total > max_sample_tokens)
+
+    return {
+        'samples': int(total.size),
+        'model_family': family,
+        'epoch_count': epoch_count,
+        'images': int(image_counts.sum()),
+        'images_without_dimensions': scan['unknown_images'],
+        'fallback_image_size': list(scan['fallback_size']),
+        'invalid_lines': scan['bad_lines'],
+        'tokens_per_epoch': tokens_per_epoch,
+        'text_input_tokens': int(text_input.sum()),
+        'output_tokens': int(output.sum()),
+        'image_tokens': int(images.sum()),
+        'billed_tokens': billed_tokens,
+        'per_sample': distribution(total),
+        'histogram': {(f"{int(low)}-{int(high)}" if high != edges[-1] else f"{int(low)}+"): int(n)
+                      for low, high, n in zip(edges[:-1], edges[1:], histogram) if n},
+        'oversized_samples': [int(index) + 1 for index in oversized[:20]],
+        'oversized_count': int(oversized.size),
+        'max_sample_tokens': max_sample_tokens,
+        'price_per_1k_tokens': price_per_1k,
+        'tokens_per_second': tokens_per_second,
+        'estimated_cost_usd': billed_tokens / 1000 * price_per_1k,
+        'estimated_training_hours': training_seconds / 3600,
+        'estimated_job_hours': (training_seconds + JOB_OVERHEAD_SECONDS) / 3600
+    }
+
+def estimate_dataset(input_file, images_dir=None, cache_dir=None, base_model_id=None, epoch_count=1,
+                     price_per_1k=None, tokens_per_second=None, max_sample_tokens=DEFAULT_MAX_SAMPLE_TOKENS):
+    """估算一个训练JSONL的token数、训练时长与费用，返回估算结果字典。"""
+    cache_path = os.path.join(cache_dir, DIMENSIONS_CACHE_FILE) if cache_dir else None
+    dimensions = ImageDimensionCache(cache_path)
+    with stage('scan_image_dimensions'):
+        read = dimensions.scan(images_dir)
+    if read:
+        logging.info(f"读取了 {read} 张图像的尺寸")
+    dimensions.save()
+
+    with stage('scan_samples'):
+        scan = scan_samples(input_file, dimensions)
+    with stage('summarize'):
+        return summarize(scan, epoch_count, model_family(base_model_id), price_per_1k, tokens_per_second,
+                         max_sample_tokens)
+
+def format_estimate(estimate):
+    """把估算结果格式化为多行文本。"""
+    per_sample = estimate['per_sample']
+    lines = [
+        f"样本数: {estimate['samples']}，图像: {estimate['images']}"
+        f"（无尺寸信息 {estimate['images_without_dimensions']} 张，按 "
+        f"{estimate['fallback_image_size'][0]}x{estimate['fallback_image_size'][1]} 估算）",
+        f"每轮token: {estimate['tokens_per_epoch']:,}（文本输入 {estimate['text_input_tokens']:,}，"
+        f"输出 {estimate['output_tokens']:,}，图像 {estimate['image_tokens']:,}）",
+        f"每样本token: 平均 {per_sample['mean']:.0f}，p50 {per_sample['p50']:.0f}，p90 {per_sample['p90']:.0f}，"
+        f"p99 {per_sample['p99']:.0f}，最大 {per_sample['max']}",
+        "分布: " + '，'.join(f"{bucket}: {n}" for bucket, n in estimate['histogram'].items()),
+        f"计费token（{estimate['epoch_count']} 轮）: {estimate['billed_tokens']:,}",
+        f"预计费用: ${estimate['estimated_cost_usd']:.2f}"
+        f"（{estimate['model_family']}，${estimate['price_per_1k_tokens']}/1000 token）",
+        f"预计训练时长: {estimate['estimated_training_hours']:.2f} 小时"
+        f"（含排队与准备约 {estimate['estimated_job_hours']:.2f} 小时，按 {estimate['tokens_per_second']:.0f} token/秒）"
+    ]
+    if estimate['oversized_count']:
+        lines.append(f"超过 {estimate['max_sample_tokens']} token 的样本: {estimate['oversized_count']} 个，"
+                     f"行号 {estimate['oversized_samples']}")
+    if estimate['invalid_lines']:
+        lines.append(f"无效的JSON行: {estimate['invalid_lines'][:20]}")
+    return '\n'.join(lines)
+
+def main():
+    """估算数据集token与费用的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'estimate_training_cost')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    if args.input_file:
+        config['input_file'] = args.input_file
+    if args.images_dir:
+        config['images_dir'] = args.images_dir
+    if args.base_model_id:
+        config['base_model_id'] = args.base_model_id
+    if args.epoch_count:
+        config['epoch_count'] = args.epoch_count
+    if args.no_cache:
+        config['cache_dir'] = None
+
+    # 配置日志
+    setup_logging(config['log_file'], 'estimate_training_cost')
+
+    if not os.path.exists(config['input_file']):
+        logging.error(f"输入文件不存在: {config['input_file']}")
+        return 1
+
+    start = time.perf_counter()
+    estimate = estimate_dataset(config['input_file'], config['images_dir'], config['cache_dir'],
+                                config['base_model_id'], config['epoch_count'], args.price_per_1k,
+                                args.tokens_per_second, args.max_sample_tokens)
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(estimate, ensure_ascii=False, indent=2))
+    else:
+        print(format_estimate(estimate))
+        print(f"（估算耗时 {elapsed:.2f} 秒）")
+    return 1 if estimate['oversized_count'] or estimate['invalid_lines'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+离线评估微调模型的销售方提取准确率
+读取测试集JSONL，并发调用模型（Bedrock Converse API 或本地桩）并限速，
+按 (模型, 样本哈希) 缓存响应，计算精确匹配、归一化匹配和模糊匹配准确率，并输出逐样本差异
+"""
+
+import os
+import io
+import re
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import logging
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import observe, setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+
+# 归一化时去除的模型回答前缀，例如“根据发票上的信息,销售方名称是……”
+ANSWER_PREFIX_PATTERN = re.compile(r'^.*?销售方(?:名称)?(?:是|为|：|:)\s*')
+PUNCTUATION_PATTERN = re.compile(r'[\s"\'“”‘’。，,.:：;；!！?？、]+')
+# 请求格式或提示词变化时递增，旧的缓存回答随之失效
+RESPONSE_CACHE_VERSION = 1
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='离线评估模型在测试集上的销售方提取准确率')
+
+    parser.add_argument('--test-jsonl', type=str, help='测试集JSONL文件路径')
+    parser.add_argument('--model-id', type=str, action='append', help='要评估的模型ID或ARN（可重复指定，用于对比）')
+    parser.add_argument('--backend', type=str, choices=['bedrock', 'stub'], default='bedrock', help='模型后端')
+    parser.add_argument('--stub-predictions', type=str, help='本地桩使用的预测CSV（列: 图片名称, 销售方）')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+    parser.add_argument('--rps', type=float, default=5.0, help='每秒最大请求数')
+    parser.add_argument('--fuzzy-threshold', type=float, default=0.9, help='模糊匹配的相似度阈值')
+    parser.add_argument('--limit', type=int, help='只评估前N个样本')
+    parser.add_argument('--no-cache', action='store_true', help='不读取响应缓存（仍会写入）')
+    parser.add_argument('--region', type=str, help='AWS区域')
+    parser.add_argument('--output-dir', type=str, help='评估结果输出目录')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'test_jsonl': str(settings.test_jsonl),
+        'output_dir': str(settings.reports_dir / 'evaluation'),
+        'cache_file': str(settings.cache_dir / 'eval_responses.sqlite'),
+        'region': settings.aws_region,
+        'log_file': str(settings.log_path('evaluate_model.log'))
+    }
+
+    return config
+
+def iter_eval_samples(jsonl_path, limit=None):
+    """流式读取测试集JSONL，逐条返回评估样本（请求部分与期望答案）。"""
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            if limit is not None and index >= limit:
+                break
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            messages = record['messages']
+            expected = ''.join(item.get('text', '') for item in messages[-1]['content'])
+            image_uri = ''
+            for message in messages:
+                for item in message['content']:
+                    if 'image' in item:
+                        image_uri = item['image']['source']['s3Location']['uri']
+            yield {
+                'index': index,
+                'image': image_uri.rsplit('/', 1)[-1],
+                'system': record.get('system', []),
+                'messages': messages[:-1],
+                'expected': expected
+            }
+
+def sample_hash(sample):
+    """计算样本请求部分的稳定哈希，作为缓存键的一部分。"""
+    payload = json.dumps({'system': sample['system'], 'messages': sample['messages']},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def build_converse_request(model_id, sample, max_tokens=256):
+    """将样本转换为Converse API请求；温度为0以保证结果可复现。"""
+    return {
+        'modelId': model_id,
+        'system': sample['system'],
+        'messages': sample['messages'],
+        'inferenceConfig': {'maxTokens': max_tokens, 'temperature': 0.0}
+    }
+
+class RateLimiter:
+    """线程安全的令牌桶限速器。"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到获得一个令牌。"""
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ResponseCache:
+    """基于SQLite的响应缓存，键为 (后端命名空间, 模型ID, 样本哈希)。
+
+    命名空间由缓存版本和后端（及其影响回答的参数）组成，桩后端的回答不会被当作真实模型的回答。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            # 旧表的键不含后端，无法区分桩后端与真实模型的回答，直接丢弃
+            self.conn.execute('DROP TABLE IF EXISTS responses')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses_v2 ('
+                'namespace TEXT, model_id TEXT, sample_hash TEXT, response TEXT, created_at REAL, '
+                'PRIMARY KEY (namespace, model_id, sample_hash))'
+            )
+            self.conn.commit()
+
+    def get(self, namespace, model_id, key):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT response FROM responses_v2 WHERE namespace = ? AND model_id = ? AND sample_hash = ?',
+                (namespace, model_id, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, namespace, model_id, key, response):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses_v2 VALUES (?, ?, ?, ?, ?)',
+                (namespace, model_id, key, response, time.time())
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class BedrockBackend:
+    """通过Bedrock Converse API调用模型。"""
+
+    def __init__(self, region, max_pool_connections=16, max_tokens=256):
+        from nova_inference import create_runtime_client
+        self.client = create_runtime_client(region, max_pool_connections)
+        self.max_tokens = max_tokens
+        self.cache_namespace = f"bedrock:max_tokens={max_tokens}"
+
+    def predict(self, model_id, sample):
+        start = time.monotonic()
+        response = self.client.converse(**build_converse_request(model_id, sample, self.max_tokens))
+        observe('bedrock.converse_seconds', time.monotonic() - start)
+        content = response['output']['message']['content']
+        return ''.join(item.get('text', '') for item in content).strip()
+
+class StubBackend:
+    """本地桩后端：从预测CSV中按图片名称返回答案，用于离线调试评估流程。"""
+
+    def __init__(self, predictions_csv=None, latency=0.0):
+        self.predictions = {}
+        self.latency = latency
+        self.cache_namespace = 'stub'
+        if predictions_csv:
+            with open(predictions_csv, 'rb') as f:
+                content = f.read()
+            # 不同的预测文件各自缓存
+            self.cache_namespace = f"stub:{hashlib.sha256(content).hexdigest()[:16]}"
+            for row in csv.DictReader(io.StringIO(content.decode('utf-8'))):
+                self.predictions[row['图片名称']] = row['销售方']
+
+    def predict(self, model_id, sample):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.predictions.get(sample['image'], '')
+
+def normalize_seller_name(text):
+    """归一化销售方名称：全半角统一、去除回答前缀、空白和标点。"""
+    text = unicodedata.normalize('NFKC', text or '').strip()
+    text = ANSWER_PREFIX_PATTERN.sub('', text)
+    return PUNCTUATION_PATTERN.sub('', text).lower()
+
+def score_prediction(expected, predicted, fuzzy_threshold=0.9):
+    """计算单个样本的匹配结果。"""
+    normalized_expected = normalize_seller_name(expected)
+    normalized_predicted = normalize_seller_name(predicted)
+    similarity = SequenceMatcher(None, normalized_expected, normalized_predicted).ratio()
+    return {
+        'exact_match': expected.strip() == predicted.strip(),
+        'normalized_match': normalized_expected == normalized_predicted,
+        'fuzzy_match': similarity >= fuzzy_threshold,
+        'similarity': round(similarity, 4)
+    }
+
+def evaluate_model(model_id, samples, backend, cache, limiter, concurrency=8,
+                   fuzzy_threshold=0.9, use_cache=True):
+    """并发评估单个模型，返回逐样本结果列表（按样本顺序）。"""
+    stats = {'cache_hits': 0, 'errors': 0}
+    stats_lock = threading.Lock()
+    namespace = f"v{RESPONSE_CACHE_VERSION}:{backend.cache_namespace}"
+
+    def run(sample):
+        key = sample_hash(sample)
+        predicted = cache.get(namespace, model_id, key) if use_cache else None
+        error = ''
+        if predicted is not None:
+            with stats_lock:
+                stats['cache_hits'] += 1
+        else:
+            limiter.acquire()
+            try:
+                predicted = backend.predict(model_id, sample)
+                cache.put(namespace, model_id, key, predicted)
+            except Exception as e:
+                predicted = ''
+                error = str(e)
+                with stats_lock:
+                    stats['errors'] += 1
+                logging.error(f"样本 {sample['index']} ({sample['image']}) 调用失败: {e}")
+
+        result = {
+            'index': sample['index'],
+            'image': sample['image'],
+            'expected': sample['expected'],
+            'predicted': predicted,
+            'error': error
+        }
+        result.update(score_prediction(sample['expected'], predicted, fuzzy_threshold))
+        return result
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run, samples))
+    elapsed = time.monotonic() - start
+
+    logging.info(f"模型 {model_id}: 评估 {len(results)} 个样本，耗时 {elapsed:.1f} 秒，"
+                 f"缓存命中 {stats['cache_hits']}，失败 {stats['errors']}")
+    return results
+
+def summarize_results(results):
+    """汇总准确率。"""
+    total = len(results)
+    if total == 0:
+        return {'samples': 0}
+    return {
+        'samples': total,
+        'errors': sum(1 for r in results if r['error']),
+        'exact_match_accuracy': sum(r['exact_match'] for r in results) / total,
+        'normalized_match_accuracy': sum(r['normalized_match'] for r in results) / total,
+        'fuzzy_match_accuracy': sum(r['fuzzy_match'] for r in results) / total,
+        'mean_similarity': sum(r['similarity'] for r in results) / total
+    }
+
+def model_file_prefix(model_id):
+    """将模型ID或ARN转换为文件名前缀。"""
+    return re.sub(r'[^\w\-.]+', '_', model_id.rsplit('/', 1)[-1])
+
+def write_sample_diffs(results, output_path):
+    """写出逐样本的预测与期望差异。"""
+    fieldnames = ['index', 'image', 'expected', 'predicted', 'exact_match', 'normalized_match',
+                  'fuzzy_match', 'similarity', 'error']
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
+    return output_path
+
+def main():
+    """离线评估的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'evaluate_model')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    test_jsonl = args.test_jsonl if args.test_jsonl else config['test_jsonl']
+    output_dir = args.output_dir if args.output_dir else config['output_dir']
+    region = args.region if args.region else config['region']
+
+    # 配置日志
+    setup_logging(config['log_file'], 'evaluate_model')
+
+    if not args.model_id:
+        logging.error("请通过 --model-id 指定至少一个要评估的模型")
+        return False
+
+    samples = list(iter_eval_samples(test_jsonl, args.limit))
+    logging.info(f"从 {test_jsonl} 读取 {len(samples)} 个测试样本")
+
+    # 创建后端、缓存和限速器
+    if args.backend == 'stub':
+        backend = StubBackend(args.stub_predictions)
+    else:
+        backend = BedrockBackend(region, max_pool_connections=args.concurrency)
+    cache = ResponseCache(config['cache_file'])
+    limiter = RateLimiter(args.rps)
+
+    # 逐个模型评估
+    os.makedirs(output_dir, exist_ok=True)
+    summaries = {}
+    try:
+        for model_id in args.model_id:
+            with stage('evaluate_model'):
+                results = evaluate_model(model_id, samples, backend, cache, limiter, args.concurrency,
+                                         args.fuzzy_threshold, not args.no_cache)
+            summaries[model_id] = summarize_results(results)
+            diff_file = write_sample_diffs(
+                results, os.path.join(output_dir, f"{model_file_prefix(model_id)}_samples.csv"))
+            logging.info(f"逐样本结果已保存到: {diff_file}")
+    finally:
+        cache.close()
+
+    summary_file = os.path.join(output_dir, 'evaluation_summary.json')
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, ensure_ascii=False, indent=2)
+
+    # 打印对比结果
+    for model_id, summary in summaries.items():
+        logging.info(f"模型: {model_id}")
+        logging.info(f"- 精确匹配准确率: {summary.get('exact_match_accuracy', 0):.2%}")
+        logging.info(f"- 归一化匹配准确率: {summary.get('normalized_match_accuracy', 0):.2%}")
+        logging.info(f"- 模糊匹配准确率: {summary.get('fuzzy_match_accuracy', 0):.2%}")
+    logging.info(f"评估汇总已保存到: {summary_file}")
+    return True
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,26 @@
 """
 
 import os
-import boto3
 import json
 import csv
 import argparse
-import dotenv
 from pathlib import Path
 import logging
-from io import BytesIO
-from PIL import Image
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import ItemLogSampler, count, setup_logging, stage, timed
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from region_router import DEFAULT_REGION_CONCURRENCY, RegionRouter, discover_regions, parse_region_specs
+from image_scanner import LABEL_IMAGE_EXTENSIONS, list_images
+
+# 逐张图片的INFO日志按比例采样输出
+image_log_sampler = ItemLogSampler('label_image')
+
+# 模型目录不可用时使用的区域（支持Claude的区域）
+DEFAULT_LABELING_REGION = 'us-east-1'
+DEFAULT_LABEL_MODEL = 'anthropic.claude-3-sonnet-20240229-v1:0'
 
 def parse_arguments():
     """解析命令行参数。"""
@@ -24,35 +34,71 @@ def parse_arguments():
     parser.add_argument('--train-dir', type=str, help='包含训练集发票图像的目录')
     parser.add_argument('--test-dir', type=str, help='包含测试集发票图像的目录')
     parser.add_argument('--output-dir', type=str, help='输出CSV文件的目录')
-    parser.add_argument('--model', type=str, default='anthropic.claude-3-sonnet-20240229-v1:0', help='要使用的LLM模型')
+    parser.add_argument('--model', type=str, default=DEFAULT_LABEL_MODEL, help='要使用的LLM模型')
     parser.add_argument('--batch-size', type=int, default=10, help='每批处理的图像数量')
+    parser.add_argument('--regions', type=str, nargs='+',
+                        help='调用模型的区域，可写作 区域=并发数（默认从模型目录中查找可按需调用该模型的区域）')
+    parser.add_argument('--region-concurrency', type=int, default=DEFAULT_REGION_CONCURRENCY,
+                        help='每个区域的默认并发请求数（近似该区域的配额）')
+    parser.add_argument('--select', type=str,
+                        help='只标注该文件中列出的训练集图像（每行一个名称，如 active_learning.py 的输出），结果追加到已有的CSV')
     parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
     
+    add_profile_arguments(parser)
+    
     return parser.parse_args()
 
 def load_config(config_path):
     """加载环境变量配置。"""
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
-    
-    dotenv.load_dotenv(config_path)
+    settings = load_settings(config_path)
     
-    # 获取必要的环境变量
+    # 获取必要的配置
     config = {
-        'train_dir': os.path.join('..', os.getenv('IMAGES_DIR', 'data/images'), 'train'),
-        'test_dir': os.path.join('..', os.getenv('IMAGES_DIR', 'data/images'), 'test'),
-        'output_dir': os.path.join('..', os.getenv('LABEL_DATA_DIR', 'data/label_data')),
-        'log_file': os.path.join('..', os.getenv('LOGS_DIR', 'output/logs'), 'generate_labels.log')
+        'train_dir': str(settings.train_images_dir),
+        'test_dir': str(settings.test_images_dir),
+        'output_dir': str(settings.label_data_dir),
+        'catalog_dir': str(settings.model_catalog_dir),
+        'cache_dir': str(settings.cache_dir),
+        'log_file': str(settings.generate_labels_log)
     }
     
     return config
 
-def process_images(image_dir, output_file, model_id, batch_size, logger):
-    """处理指定目录中的图像并生成标注CSV文件。"""
+def create_router(model_id, config, region_specs=None, region_concurrency=DEFAULT_REGION_CONCURRENCY):
+    """创建标注请求的多区域路由；未指定区域时从模型目录中查找。"""
+    if region_specs:
+        regions = parse_region_specs(region_specs, region_concurrency)
+    else:
+        regions = {region: region_concurrency for region in
+                   discover_regions(model_id, config['catalog_dir'], config['cache_dir'], DEFAULT_LABELING_REGION)}
+    return RegionRouter(regions)
+
+def label_image(router, model_id, image_path):
+    """读取并标注单张图像，返回 (销售方名称, 异常)。"""
+    try:
+        # 读取图像
+        with stage('read_image'):
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        
+        # 调用Claude模型（由路由选择区域，限流时换区域重试）
+        with stage('invoke_model'):
+            response = router.call(lambda client: invoke_claude_with_image(client, model_id, image_bytes))
+        
+        # 解析响应
+        return parse_claude_response(response), None
+    except Exception as e:
+        return None, e
+
+def process_images(image_dir, output_file, model_id, batch_size, logger, router=None, image_names=None, append=False):
+    """处理指定目录中的图像并生成标注CSV文件；请求通过 router 并发分散到多个区域。
+
+    提供 image_names 时只标注这些图像；append 为真时追加到已有的CSV。
+    """
     # 获取图像文件列表
-    image_files = []
-    for ext in ['*.jpg', '*.jpeg', '*.png']:
-        image_files.extend(Path(image_dir).glob(ext))
+    if image_names is None:
+        image_names = list_images(image_dir, LABEL_IMAGE_EXTENSIONS)
+    image_files = [Path(image_dir) / name for name in image_names]
     
     if not image_files:
         logger.warning(f"目录 {image_dir} 中未找到图像文件")
@@ -60,32 +106,29 @@ def process_images(image_dir, output_file, model_id, batch_size, logger):
     
     logger.info(f"在 {image_dir} 中找到 {len(image_files)} 个图像文件")
     
-    # 创建Bedrock客户端
-    bedrock_runtime = boto3.client(
-        service_name='bedrock-runtime',
-        region_name='us-east-1'  # 使用支持Claude的区域
-    )
+    # 创建Bedrock客户端路由
+    if router is None:
+        router = RegionRouter({DEFAULT_LABELING_REGION: DEFAULT_REGION_CONCURRENCY})
     
     # 准备CSV文件
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+    write_header = not append or not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+    with open(output_file, 'a' if append else 'w', newline='', encoding='utf-8') as csvfile, \
+            ThreadPoolExecutor(max_workers=router.capacity) as executor:
         fieldnames = ['图片名称', '销售方']
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
+        if write_header:
+            writer.writeheader()
         
-        # 处理每个图像
-        for i, image_path in enumerate(image_files):
+        # 并发标注，按图像顺序写入结果
+        results = executor.map(lambda path: label_image(router, model_id, path), image_files)
+        for i, (image_path, (seller_name, error)) in enumerate(zip(image_files, results)):
             try:
-                logger.info(f"处理图像 {i+1}/{len(image_files)}: {image_path.name}")
-                
-                # 读取图像
-                with open(image_path, 'rb') as f:
-                    image_bytes = f.read()
+                if error is not None:
+                    raise error
                 
-                # 调用Claude模型
-                response = invoke_claude_with_image(bedrock_runtime, model_id, image_bytes)
-                
-                # 解析响应
-                seller_name = parse_claude_response(response)
+                log_this_image = image_log_sampler.hit()
+                if log_this_image:
+                    logger.info(f"处理图像 {i+1}/{len(image_files)}: {image_path.name}")
                 
                 # 写入CSV
                 writer.writerow({
@@ -93,7 +136,9 @@ def process_images(image_dir, output_file, model_id, batch_size, logger):
                     '销售方': seller_name
                 })
                 
-                logger.info(f"提取的销售方: {seller_name}")
+                count('images.labeled')
+                if log_this_image:
+                    logger.info(f"提取的销售方: {seller_name}")
                 
                 # 每批次后保存
                 if (i + 1) % batch_size == 0:
@@ -101,6 +146,7 @@ def process_images(image_dir, output_file, model_id, batch_size, logger):
                     logger.info(f"已处理 {i+1}/{len(image_files)} 个图像")
                 
             except Exception as e:
+                count('images.failed')
                 logger.error(f"处理图像 {image_path.name} 时出错: {e}")
                 # 记录错误但继续处理
                 writer.writerow({
@@ -143,10 +189,14 @@ def invoke_claude_with_image(client, model_id, image_bytes):
     }
     
     # 调用模型
-    response = client.invoke_model(
-        modelId=model_id,
-        body=json.dumps(request)
-    )
+    body = json.dumps(request)
+    count('bedrock.requests')
+    count('bedrock.request_bytes', len(body))
+    with timed('bedrock.invoke_seconds'):
+        response = client.invoke_model(
+            modelId=model_id,
+            body=body
+        )
     
     # 解析响应
     response_body = json.loads(response['body'].read().decode('utf-8'))
@@ -166,6 +216,7 @@ def parse_claude_response(response):
 def main():
     # 解析命令行参数
     args = parse_arguments()
+    start_profiling(args, 'generate_labels')
     
     # 加载配置
     config = load_config(args.config)
@@ -179,15 +230,7 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
     
     # 配置日志
-    os.makedirs(os.path.dirname(config['log_file']), exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(config['log_file']),
-            logging.StreamHandler()
-        ]
-    )
+    setup_logging(config['log_file'], 'generate_labels')
     logger = logging.getLogger(__name__)
     
     logger.info(f"使用配置:")
@@ -197,6 +240,10 @@ def main():
     logger.info(f"- 模型: {args.model}")
     logger.info(f"- 批处理大小: {args.batch_size}")
     
+    # 创建多区域路由
+    router = create_router(args.model, config, args.regions, args.region_concurrency)
+    logger.info(f"- 区域: {', '.join(f'{state.region}（并发 {state.max_in_flight}）' for state in router.states)}")
+    
     # 处理训练集图像
     train_output_file = os.path.join(output_dir, 'train_label.csv')
     logger.info(f"开始处理训练集图像...")
@@ -206,7 +253,19 @@ def main():
         logger.error(f"训练集目录不存在: {train_dir}")
         sys.exit(1)
     
-    train_success = process_images(train_dir, train_output_file, args.model, args.batch_size, logger)
+    # 只标注选出的图像（主动学习）
+    if args.select:
+        with open(args.select, 'r', encoding='utf-8') as f:
+            selected = [line.strip() for line in f if line.strip()]
+        logger.info(f"只标注 {args.select} 中选出的 {len(selected)} 张图像，追加到 {train_output_file}")
+        if not process_images(train_dir, train_output_file, args.model, args.batch_size, logger, router,
+                              image_names=selected, append=True):
+            sys.exit(1)
+        router.log_summary(logger)
+        logger.info("所有处理完成")
+        return
+    
+    train_success = process_images(train_dir, train_output_file, args.model, args.batch_size, logger, router)
     if not train_success:
         logger.error("训练集处理失败，训练数据必须存在")
         sys.exit(1)
@@ -215,12 +274,13 @@ def main():
     if os.path.exists(test_dir):
         test_output_file = os.path.join(output_dir, 'test_label.csv')
         logger.info(f"开始处理测试集图像...")
-        test_success = process_images(test_dir, test_output_file, args.model, args.batch_size, logger)
+        test_success = process_images(test_dir, test_output_file, args.model, args.batch_size, logger, router)
         if not test_success:
             logger.warning("测试集处理未生成标注数据")
     else:
         logger.info(f"测试集目录不存在: {test_dir}，跳过测试集处理")
     
+    router.log_summary(logger)
     logger.info("所有处理完成")
 
 if __name__ == "__main__":
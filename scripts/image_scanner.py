@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+图像目录的增量扫描
+- 用 os.scandir 遍历目录（扩展名不区分大小写），每个文件只做一次 stat
+- 把每个文件的 (大小, mtime_ns, inode, 内容哈希) 以pickle形式缓存在磁盘上，
+  再次扫描时只报告新增、修改和删除的文件
+- 只为新增或修改的文件计算SHA-256，多线程并行，用 mmap 读取文件（哈希计算时释放GIL）
+"""
+
+import os
+import sys
+import mmap
+import time
+import pickle
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import count, observe
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+
+# 支持的图像扩展名（小写）到Converse API图像格式的映射（Nova不接受 "jpg"），各脚本共用这一份定义
+IMAGE_FORMATS_BY_EXTENSION = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.gif': 'gif', '.webp': 'webp'}
+IMAGE_EXTENSIONS = tuple(IMAGE_FORMATS_BY_EXTENSION)
+# 需要LLM标注的图像扩展名（只处理JPEG与PNG）
+LABEL_IMAGE_EXTENSIONS = tuple(extension for extension, image_format in IMAGE_FORMATS_BY_EXTENSION.items()
+                               if image_format in ('jpeg', 'png'))
+CACHE_PREFIX = 'image_scan-'
+# 缓存格式变化时递增，旧缓存会被自动丢弃
+CACHE_VERSION = 1
+DEFAULT_HASH_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='增量扫描图像目录，报告新增、修改和删除的文件')
+
+    parser.add_argument('--images-dir', type=str, action='append', help='要扫描的图像目录（可重复指定，默认为训练集与测试集图像目录）')
+    parser.add_argument('--cache-dir', type=str, help='扫描缓存目录')
+    parser.add_argument('--recursive', action='store_true', help='递归扫描子目录')
+    parser.add_argument('--no-hash', action='store_true', help='不计算变化文件的内容哈希')
+    parser.add_argument('--workers', type=int, default=DEFAULT_HASH_WORKERS, help='计算哈希的线程数')
+    parser.add_argument('--list-changes', action='store_true', help='列出每个变化的文件')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'images_dirs': [str(settings.train_images_dir), str(settings.test_images_dir)],
+        'cache_dir': str(settings.cache_dir)
+    }
+
+    return config
+
+def image_format_from_name(image_name):
+    """根据文件扩展名返回Converse API的图像格式。"""
+    return IMAGE_FORMATS_BY_EXTENSION.get(os.path.splitext(image_name)[1].lower(), 'jpeg')
+
+def iter_images(root, extensions=IMAGE_EXTENSIONS, recursive=False):
+    """遍历目录，逐个返回图像文件的 (相对路径, os.DirEntry)；目录不存在时不返回任何条目。"""
+    if not os.path.isdir(root):
+        return
+    pending = ['']
+    while pending:
+        relative_dir = pending.pop()
+        prefix = relative_dir + os.sep if relative_dir else ''
+        with os.scandir(os.path.join(root, relative_dir)) as it:
+            for entry in it:
+                # 先按扩展名过滤，大多数条目不需要再判断类型
+                if entry.name.lower().endswith(extensions):
+                    if not entry.is_dir(follow_symlinks=False):
+                        yield prefix + entry.name, entry
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    pending.append(prefix + entry.name)
+
+def scan_directory(root, extensions=IMAGE_EXTENSIONS, recursive=False):
+    """返回 {相对路径: (大小, mtime_ns, inode)}。"""
+    files = {}
+    for relative_path, entry in iter_images(root, extensions, recursive):
+        stat = entry.stat()
+        files[relative_path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    return files
+
+def list_images(root, extensions=IMAGE_EXTENSIONS, recursive=False):
+    """目录中的图像文件相对路径（按名称排序），不做 stat。"""
+    return sorted(relative_path for relative_path, _ in iter_images(root, extensions, recursive))
+
+def hash_file(path):
+    """文件内容的SHA-256，用 mmap 读取。"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+class ScanResult:
+    """一次扫描的结果: 当前文件与相对上次扫描的变化。"""
+
+    def __init__(self, files, added, modified, removed):
+        self.files = files
+        self.added = added
+        self.modified = modified
+        self.removed = removed
+
+    @property
+    def changed(self):
+        return self.added + self.modified
+
+    def __repr__(self):
+        return (f"ScanResult(files={len(self.files)}, added={len(self.added)}, "
+                f"modified={len(self.modified)}, removed={len(self.removed)})")
+
+class ImageScanner:
+    """一个图像目录的增量扫描器，缓存文件名由目录的绝对路径决定。"""
+
+    def __init__(self, root, cache_dir=None, extensions=IMAGE_EXTENSIONS, recursive=False):
+        self.root = root
+        self.extensions = extensions
+        self.recursive = recursive
+        self.cache_path = None
+        if cache_dir:
+            key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:12]
+            self.cache_path = os.path.join(cache_dir, f"{CACHE_PREFIX}{key}.pkl")
+        # {相对路径: (大小, mtime_ns, inode)} 与 {相对路径: 哈希}
+        self.stats, self.hashes = self.load_cache()
+        self.dirty = False
+
+    def load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}, {}
+        try:
+            with open(self.cache_path, 'rb') as f:
+                version, root, stats, hashes = pickle.load(f)
+            if version == CACHE_VERSION and root == os.path.abspath(self.root):
+                return stats, hashes
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError) as e:
+            # 缓存损坏（或格式无法解包）时重新扫描
+            logging.warning(f"无法读取扫描缓存 {self.cache_path}，重新扫描: {e}")
+        return {}, {}
+
+    def scan(self):
+        """扫描目录并与缓存比较；修改过的文件（大小、mtime或inode变化）的旧哈希作废。"""
+        start = time.perf_counter()
+        files = scan_directory(self.root, self.extensions, self.recursive)
+        observe('scan.seconds', time.perf_counter() - start)
+        if files == self.stats:
+            # 没有任何变化（dict 比较在C中完成）
+            added, modified, removed = [], [], []
+        else:
+            added = sorted(files.keys() - self.stats.keys())
+            removed = sorted(self.stats.keys() - files.keys())
+            stats = self.stats
+            modified = sorted(path for path, stat in files.items() if path in stats and stats[path] != stat)
+            for path in removed + modified:
+                self.hashes.pop(path, None)
+            self.stats = files
+            self.dirty = True
+        count('scan.files', len(files))
+        count('scan.changed', len(added) + len(modified) + len(removed))
+        return ScanResult(files, added, modified, removed)
+
+    def hash_pending(self, workers=DEFAULT_HASH_WORKERS):
+        """并行计算所有还没有哈希的文件（新增或修改的文件）的内容哈希，返回计算的文件数。"""
+        pending = [path for path in self.stats if path not in self.hashes]
+        if not pending:
+            return 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            hashes = executor.map(self.try_hash, pending)
+            for path, digest in zip(pending, hashes):
+                if digest is not None:
+                    self.hashes[path] = digest
+        observe('scan.hash_seconds', time.perf_counter() - start)
+        count('scan.hashed', len(pending))
+        self.dirty = True
+        return len(pending)
+
+    def try_hash(self, path):
+        try:
+            return hash_file(os.path.join(self.root, path))
+        except OSError as e:
+            # 扫描后被删除或无法读取的文件，下次扫描时再处理
+            logging.warning(f"无法读取 {os.path.join(self.root, path)}: {e}")
+            return None
+
+    def hash_of(self, path):
+        """文件的内容哈希，文件不存在或尚未计算时返回 None。"""
+        return self.hashes.get(path)
+
+    def __contains__(self, path):
+        return path in self.stats
+
+    def save(self):
+        if not self.cache_path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((CACHE_VERSION, os.path.abspath(self.root), self.stats, self.hashes), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+def main():
+    """扫描图像目录的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'image_scanner')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    if args.images_dir:
+        config['images_dirs'] = args.images_dir
+    if args.cache_dir:
+        config['cache_dir'] = args.cache_dir
+
+    for images_dir in config['images_dirs']:
+        scanner = ImageScanner(images_dir, config['cache_dir'], recursive=args.recursive)
+        start = time.perf_counter()
+        result = scanner.scan()
+        scan_ms = (time.perf_counter() - start) * 1000
+        hashed = 0
+        start = time.perf_counter()
+        if not args.no_hash:
+            hashed = scanner.hash_pending(args.workers)
+        hash_ms = (time.perf_counter() - start) * 1000
+        scanner.save()
+
+        print(f"{images_dir}: {len(result.files)} 个图像，新增 {len(result.added)}，修改 {len(result.modified)}，"
+              f"删除 {len(result.removed)}（扫描 {scan_ms:.1f} ms，哈希 {hashed} 个文件 {hash_ms:.1f} ms）")
+        if args.list_changes:
+            for label, paths in (('+', result.added), ('~', result.modified), ('-', result.removed)):
+                for path in paths:
+                    print(f"  {label} {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+新到发票的持续接入（守护进程模式）
+- 监视训练集图像目录: Linux 上用 inotify（写入完成或移入目录时通知，空闲时阻塞不占CPU），
+  不可用时退化为定期增量扫描（文件在两次扫描之间不再变化后才处理）
+- 新文件按微批处理: 攒满 --batch-size 张或等待 --batch-window 秒后，依次经过
+  标注（多区域路由并发调用LLM）→ 上传S3 → 创建并验证训练样本 → 追加到JSONL，各阶段之间用有界队列衔接，
+  下游变慢时上游自然阻塞
+- 输出JSONL由 run_journal 的预写日志保护，与 process_images_for_training.py --journal 格式相同；
+  重启后先补处理目录中尚未写出的图像，已上传的不再重复上传
+- 每个批次落盘后更新 <输出JSONL>.status.json（样本数、失败数、最近一批的接入延迟、是否满足微调的最少样本数）
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import queue
+import select
+import signal
+import struct
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import count, observe, setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from run_journal import RunJournal
+from image_scanner import LABEL_IMAGE_EXTENSIONS, ImageScanner, list_images
+from generate_labels_with_llm import DEFAULT_LABEL_MODEL, create_router, label_image
+from region_router import DEFAULT_REGION_CONCURRENCY
+from process_images_for_training import create_training_data, read_csv_data, upload_image_to_s3
+from nova_ft_common import MODEL_TO_NUM_SAMPLES_MAP
+
+STATUS_SUFFIX = '.status.json'
+# inotify 事件: 写入后关闭、移入目录；事件头为 struct inotify_event 的固定部分
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+# 等待新文件时最多阻塞多久检查一次停止信号（秒）
+STOP_CHECK_INTERVAL = 1.0
+# 微调作业要求的最少样本数
+MIN_TRAINING_SAMPLES = min(low for low, _ in MODEL_TO_NUM_SAMPLES_MAP.values())
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='监视图像目录，持续标注、上传新发票并追加到训练JSONL')
+
+    parser.add_argument('--images-dir', type=str, help='要监视的图像目录（默认为训练集图像目录）')
+    parser.add_argument('--output-jsonl', type=str, help='持续追加的训练JSONL（默认为 TRAIN_JSONL）')
+    parser.add_argument('--label-csv', type=str, help='追加标注结果的CSV（默认为 TRAIN_LABEL_CSV）')
+    parser.add_argument('--s3-bucket', type=str, help='S3存储桶名称')
+    parser.add_argument('--model', type=str, default=DEFAULT_LABEL_MODEL, help='标注使用的LLM模型')
+    parser.add_argument('--regions', type=str, nargs='+',
+                        help='调用模型的区域，可写作 区域=并发数（默认从模型目录中查找可按需调用该模型的区域）')
+    parser.add_argument('--region-concurrency', type=int, default=DEFAULT_REGION_CONCURRENCY,
+                        help='每个区域的默认并发请求数')
+    parser.add_argument('--batch-size', type=int, default=16, help='每个微批的最多图像数')
+    parser.add_argument('--batch-window', type=float, default=30.0, help='微批的最长等待时间（秒）')
+    parser.add_argument('--queue-size', type=int, default=4, help='各阶段之间队列的最多批次数')
+    parser.add_argument('--upload-workers', type=int, default=4, help='上传S3的并发数')
+    parser.add_argument('--watch', type=str, choices=['auto', 'inotify', 'poll'], default='auto',
+                        help='监视方式: auto 优先使用 inotify，不可用时定期扫描')
+    parser.add_argument('--poll-interval', type=float, default=10.0, help='定期扫描的间隔（秒）')
+    parser.add_argument('--retry-failed', action='store_true', help='启动时重新处理之前失败的图像')
+    parser.add_argument('--once', action='store_true', help='只处理目录中尚未处理的图像，然后退出')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'images_dir': str(settings.train_images_dir),
+        'output_jsonl': str(settings.train_jsonl),
+        'label_csv': str(settings.train_label_csv),
+        's3_bucket': settings.s3_bucket,
+        's3_prefix': settings.s3_prefix_images,
+        'account_id': settings.aws_account_id,
+        'catalog_dir': str(settings.model_catalog_dir),
+        'cache_dir': str(settings.cache_dir),
+        'log_file': str(settings.log_path('ingest_daemon.log'))
+    }
+
+    return config
+
+def is_label_image(name):
+    return name.lower().endswith(LABEL_IMAGE_EXTENSIONS)
+
+class InotifyWatcher:
+    """用 inotify 监视目录中写入完成或移入的文件。"""
+
+    def __init__(self, directory):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'无法监视目录 {directory}')
+
+    def wait(self, timeout):
+        """等待最多 timeout 秒，返回期间写入完成的文件名。"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name and not mask & IN_ISDIR:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """定期增量扫描目录；新增或修改的文件在下一次扫描时仍未变化才返回（避免读到写了一半的文件）。"""
+
+    def __init__(self, directory, interval):
+        self.scanner = ImageScanner(directory, extensions=LABEL_IMAGE_EXTENSIONS)
+        self.scanner.scan()
+        self.interval = interval
+        self.next_scan = time.monotonic() + interval
+        self.unsettled = set()
+
+    def wait(self, timeout):
+        now = time.monotonic()
+        if now < self.next_scan:
+            time.sleep(min(timeout, self.next_scan - now))
+            if time.monotonic() < self.next_scan:
+                return []
+        self.next_scan = time.monotonic() + self.interval
+        result = self.scanner.scan()
+        changed = set(result.changed)
+        settled = sorted(self.unsettled - changed - set(result.removed))
+        self.unsettled = changed
+        return settled
+
+    def close(self):
+        pass
+
+def create_watcher(directory, mode='auto', poll_interval=10.0):
+    """按 mode 创建监视器；auto 模式下 inotify 不可用时退化为定期扫描。"""
+    if mode in ('auto', 'inotify'):
+        try:
+            watcher = InotifyWatcher(directory)
+            logging.info(f"使用 inotify 监视 {directory}")
+            return watcher
+        except (OSError, AttributeError) as e:
+            if mode == 'inotify':
+                raise
+            logging.warning(f"inotify 不可用（{e}），改为每 {poll_interval:g} 秒扫描一次")
+    else:
+        logging.info(f"每 {poll_interval:g} 秒扫描一次 {directory}")
+    return PollingWatcher(directory, poll_interval)
+
+def read_label_csv(csv_path):
+    """读取标注CSV中已有的有效标注，返回 {图片名称: 销售方}；文件不存在时返回空字典。"""
+    if not os.path.exists(csv_path):
+        return {}
+    return {row['图片名称']: row['销售方'] for row in read_csv_data(csv_path) if row.get('销售方')}
+
+def append_labels(csv_path, rows):
+    """把标注结果追加到标注CSV，文件不存在或为空时先写表头。"""
+    if not rows:
+        return
+    write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+    with open(csv_path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['图片名称', '销售方'])
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+class IngestDaemon:
+    """收集 → 标注 → 上传与写出 三个阶段，由有界队列衔接。"""
+
+    def __init__(self, images_dir, config, router, model_id, watcher, batch_size=16, batch_window=30.0,
+                 queue_size=4, upload_workers=4, retry_failed=False):
+        self.images_dir = images_dir
+        self.config = config
+        self.router = router
+        self.model_id = model_id
+        self.watcher = watcher
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.upload_workers = upload_workers
+        self.retry_failed = retry_failed
+        self.journal = RunJournal(config['output_jsonl'])
+        self.journal.open_output()
+        # 标注CSV中已有的标注: 写出这些图像时不再追加重复的行
+        self.csv_labels = read_label_csv(config['label_csv'])
+        self.status_path = config['output_jsonl'] + STATUS_SUFFIX
+        self.label_queue = queue.Queue(maxsize=queue_size)
+        self.upload_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        # 本次运行中已进入流水线的图像及其到达时间
+        self.arrived = {}
+        self.last_latency = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def backlog(self):
+        """目录中还需要处理的图像: 返回 (需要标注的名称, 已标注并上传、只差写出的 (名称, 销售方))。
+
+        与 process_images_for_training --journal 共用同一个JSONL与日志；日志中没有销售方的 uploaded 记录
+        从标注CSV中取销售方，CSV中也没有时重新标注（上传时复用日志中的S3 URI）。
+        """
+        to_label, to_write = [], []
+        relabel = 0
+        for name in list_images(self.images_dir, LABEL_IMAGE_EXTENSIONS):
+            record = self.journal.state(name)
+            if record is None or (record['state'] == 'failed' and self.retry_failed):
+                to_label.append(name)
+            elif record['state'] == 'uploaded':
+                seller = record.get('seller') or self.csv_labels.get(name)
+                if seller:
+                    to_write.append((name, seller, None))
+                else:
+                    to_label.append(name)
+                    relabel += 1
+        if relabel:
+            logging.info(f"{relabel} 张已上传的图像在日志和标注CSV中都没有销售方，重新标注")
+        return to_label, to_write
+
+    def admit(self, name):
+        """新文件是否需要进入流水线（本次运行中未处理过，且日志中没有记录）。"""
+        if name in self.arrived or not is_label_image(name):
+            return False
+        if self.journal.state(name) is not None:
+            return False
+        self.arrived[name] = time.monotonic()
+        return True
+
+    def collect(self, once=False):
+        """在主线程中收集新文件并按微批放入标注队列。"""
+        to_label, to_write = self.backlog()
+        if to_label or to_write:
+            logging.info(f"补处理目录中尚未写出的图像: 待标注 {len(to_label)}，待写出 {len(to_write)}")
+        now = time.monotonic()
+        for name, _, _ in to_write:
+            self.arrived[name] = now
+        if to_write:
+            self.upload_queue.put(to_write)
+        for name in to_label:
+            self.arrived[name] = now
+        for start in range(0, len(to_label), self.batch_size):
+            self.label_queue.put(to_label[start:start + self.batch_size])
+        if once:
+            return
+
+        batch = []
+        deadline = None
+        while not self.stop_event.is_set():
+            timeout = STOP_CHECK_INTERVAL
+            if deadline is not None:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            for name in self.watcher.wait(timeout):
+                if self.admit(name):
+                    batch.append(name)
+                    deadline = deadline or time.monotonic() + self.batch_window
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                # 队列已满时在这里阻塞，形成背压
+                self.label_queue.put(batch)
+                count('ingest.batches')
+                batch, deadline = [], None
+        if batch:
+            self.label_queue.put(batch)
+
+    def label_worker(self):
+        """标注阶段: 一个批次内的图像通过区域路由并发标注。"""
+        with ThreadPoolExecutor(max_workers=self.router.capacity) as executor:
+            while True:
+                batch = self.label_queue.get()
+                if batch is None:
+                    self.upload_queue.put(None)
+                    return
+                with stage('label_batch'):
+                    results = executor.map(
+                        lambda name: label_image(self.router, self.model_id, os.path.join(self.images_dir, name)), batch)
+                    labeled = [(name, seller, error) for name, (seller, error) in zip(batch, results)]
+                self.upload_queue.put(labeled)
+
+    def upload_worker(self):
+        """上传与写出阶段: 日志与JSONL只在这个线程中写入。"""
+        with ThreadPoolExecutor(max_workers=max(1, self.upload_workers)) as executor:
+            while True:
+                labeled = self.upload_queue.get()
+                if labeled is None:
+                    return
+                try:
+                    self.write_batch(labeled, executor)
+                except Exception as e:
+                    logging.error(f"写出批次时出错: {e}")
+                    count('ingest.batch_errors')
+
+    def upload(self, name, seller, error):
+        """上传单张图像（日志中已有上传记录时复用），返回 (S3 URI, 失败原因)。"""
+        if error is not None:
+            return None, f"标注失败: {error}"
+        if not seller or '提取失败' in seller:
+            return None, f"标注失败: {seller}"
+        record = self.journal.state(name)
+        if record is not None and record['state'] == 'uploaded' and record.get('s3_uri'):
+            return record['s3_uri'], None
+        s3_uri = upload_image_to_s3(os.path.join(self.images_dir, name), name, self.config)
+        return (s3_uri, None) if s3_uri else (None, '上传到S3失败')
+
+    def write_batch(self, labeled, executor):
+        with stage('upload_batch'):
+            uploads = list(executor.map(lambda item: self.upload(*item), labeled))
+        labels = []
+        with stage('write_batch'):
+            for (name, seller, _), (s3_uri, reason) in zip(labeled, uploads):
+                if reason is None:
+                    self.journal.record(name, 'uploaded', s3_uri=s3_uri, seller=seller)
+                    training_data = create_training_data(name, seller, s3_uri, self.config)
+                    if training_data is None:
+                        reason = '训练数据验证失败'
+                if reason is not None:
+                    self.journal.record(name, 'failed', seller=seller, reason=reason)
+                    count('ingest.failed')
+                    continue
+                self.journal.write_output(json.dumps(training_data, ensure_ascii=False) + '\n', [name])
+                if self.csv_labels.get(name) != seller:
+                    labels.append({'图片名称': name, '销售方': seller})
+                    self.csv_labels[name] = seller
+                count('ingest.serialized')
+            append_labels(self.config['label_csv'], labels)
+            # 批次边界: 让JSONL与日志落盘，之后样本即可用于训练
+            self.journal.sync()
+        now = time.monotonic()
+        latencies = [now - self.arrived.pop(name) for name, _, _ in labeled if name in self.arrived]
+        if latencies:
+            self.last_latency = max(latencies)
+            for latency in latencies:
+                observe('ingest.latency_seconds', latency)
+        self.write_status()
+        logging.info(f"批次完成: {len(labels)}/{len(labeled)} 个样本已写出"
+                     f"{f'，最长接入延迟 {self.last_latency:.1f} 秒' if latencies else ''}")
+
+    def status(self):
+        """当前数据集的状态。"""
+        states = [record['state'] for record in self.journal.states.values()]
+        samples = states.count('serialized')
+        return {
+            'output_jsonl': self.config['output_jsonl'],
+            'samples': samples,
+            'failed': states.count('failed'),
+            'in_flight': len(self.arrived),
+            'last_batch_latency_seconds': round(self.last_latency, 3) if self.last_latency is not None else None,
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+            'ready': samples >= MIN_TRAINING_SAMPLES
+        }
+
+    def write_status(self):
+        tmp_path = self.status_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.status(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def run(self, once=False):
+        """运行到收到停止信号（once 时处理完目录中的积压后退出），返回最终状态。"""
+        workers = [threading.Thread(target=self.label_worker, name='label', daemon=True),
+                   threading.Thread(target=self.upload_worker, name='upload', daemon=True)]
+        for worker in workers:
+            worker.start()
+        try:
+            self.collect(once)
+        finally:
+            # 处理完已收集的批次后依次停止各阶段
+            self.label_queue.put(None)
+            for worker in workers:
+                worker.join()
+            if self.watcher is not None:
+                self.watcher.close()
+            self.journal.close()
+            dead_letters = self.journal.write_dead_letter()
+            if dead_letters:
+                logging.warning(f"{dead_letters} 张图像处理失败，已写入 {self.journal.dead_letter_path}")
+            self.write_status()
+        return self.status()
+
+def main():
+    """运行接入守护进程的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'ingest_daemon')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    if args.images_dir:
+        config['images_dir'] = args.images_dir
+    if args.output_jsonl:
+        config['output_jsonl'] = args.output_jsonl
+    if args.label_csv:
+        config['label_csv'] = args.label_csv
+    if args.s3_bucket:
+        config['s3_bucket'] = args.s3_bucket
+
+    # 配置日志
+    setup_logging(config['log_file'], 'ingest_daemon')
+
+    if not os.path.isdir(config['images_dir']):
+        logging.error(f"图像目录不存在: {config['images_dir']}")
+        return 1
+    os.makedirs(os.path.dirname(os.path.abspath(config['output_jsonl'])), exist_ok=True)
+
+    logging.info(f"使用配置:")
+    logging.info(f"- 图像目录: {config['images_dir']}")
+    logging.info(f"- 输出JSONL: {config['output_jsonl']}")
+    logging.info(f"- 标注CSV: {config['label_csv']}")
+    logging.info(f"- 微批: {args.batch_size} 张 / {args.batch_window:g} 秒，队列 {args.queue_size} 批")
+
+    router = create_router(args.model, config, args.regions, args.region_concurrency)
+    logging.info(f"- 区域: {', '.join(state.region for state in router.states)}")
+    watcher = None if args.once else create_watcher(config['images_dir'], args.watch, args.poll_interval)
+    daemon = IngestDaemon(config['images_dir'], config, router, args.model, watcher, args.batch_size,
+                          args.batch_window, args.queue_size, args.upload_workers, args.retry_failed)
+
+    # SIGTERM 与 Ctrl+C 都会在处理完已收集的批次后退出
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        status = daemon.run(once=args.once)
+    except KeyboardInterrupt:
+        daemon.stop()
+        status = daemon.status()
+    router.log_summary()
+    logging.info(f"已停止: {status['samples']} 个样本，{status['failed']} 个失败"
+                 f"{'' if status['ready'] else f'（少于微调所需的 {MIN_TRAINING_SAMPLES} 个样本）'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+各脚本共用的日志与指标埋点
+- setup_logging: 代替各脚本中的 logging.basicConfig，文件日志可选JSON行格式（LOG_FORMAT=json）
+- log_event: 带结构化字段的日志事件
+- ItemLogSampler: 逐条目日志按比例采样，避免大数据集上每张图片一行INFO拖慢运行
+- 计数器、直方图（上传延迟、Bedrock延迟、发送字节数、验证耗时等）与分阶段的墙钟/CPU时间
+- 进程退出时把本次运行的汇总写入 METRICS_DIR 下的一个JSON文件，按阶段耗时排序即可找到热点
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+from settings import repo_path
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# 直方图保留的样本数上限（超过后使用蓄水池抽样，分位数为近似值）
+RESERVOIR_SIZE = 4096
+
+# 未配置时，逐条目日志每隔多少条输出一次（前若干条总是输出）
+DEFAULT_SAMPLE_EVERY = 100
+DEFAULT_SAMPLE_FIRST = 10
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行JSON，log_event 的字段会展开到顶层。"""
+
+    def format(self, record):
+        event = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'event', None):
+            event['event'] = record.event
+        event.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+class Counter:
+    """线程安全的计数器。"""
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class Histogram:
+    """记录数量、总和、最值，并用蓄水池抽样保留样本计算分位数。"""
+
+    def __init__(self, reservoir_size=RESERVOIR_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+        self.reservoir_size = reservoir_size
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.count += 1
+            self.total += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+            if len(self.samples) < self.reservoir_size:
+                self.samples.append(value)
+            else:
+                slot = random.randrange(self.count)
+                if slot < self.reservoir_size:
+                    self.samples[slot] = value
+
+    def summary(self):
+        with self.lock:
+            if not self.count:
+                return {'count': 0}
+            ordered = sorted(self.samples)
+        quantile = lambda frac: ordered[min(len(ordered) - 1, int(frac * len(ordered)))]
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'p50': quantile(0.50),
+            'p95': quantile(0.95),
+            'p99': quantile(0.99),
+            'max': self.max
+        }
+
+class StageTimer:
+    """累计某个阶段的调用次数、墙钟时间与进程CPU时间。"""
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, wall, cpu):
+        with self.lock:
+            self.calls += 1
+            self.wall_seconds += wall
+            self.cpu_seconds += cpu
+
+class MetricsRegistry:
+    """一次运行内的全部计数器、直方图和阶段计时。"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.started_monotonic = time.monotonic()
+        self.started_cpu = time.process_time()
+
+    def _get(self, table, name, factory):
+        metric = table.get(name)
+        if metric is None:
+            with self.lock:
+                metric = table.setdefault(name, factory())
+        return metric
+
+    def reset(self):
+        """清空全部指标并重新开始计时（基准测试按阶段分别统计时使用）。"""
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+            self.started_at = time.time()
+            self.started_monotonic = time.monotonic()
+            self.started_cpu = time.process_time()
+
+    def counter(self, name):
+        return self._get(self.counters, name, Counter)
+
+    def histogram(self, name):
+        return self._get(self.histograms, name, Histogram)
+
+    def stage_timer(self, name):
+        return self._get(self.stages, name, StageTimer)
+
+    def summary(self, run_name=None):
+        """汇总本次运行；stages 按墙钟时间从大到小排序。"""
+        stages = sorted(self.stages.items(), key=lambda item: item[1].wall_seconds, reverse=True)
+        return {
+            'run': run_name,
+            'pid': os.getpid(),
+            'argv': sys.argv,
+            'started_at': datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(timespec='seconds'),
+            'wall_seconds': time.monotonic() - self.started_monotonic,
+            'cpu_seconds': time.process_time() - self.started_cpu,
+            'stages': {name: {'calls': stage.calls, 'wall_seconds': stage.wall_seconds,
+                              'cpu_seconds': stage.cpu_seconds}
+                       for name, stage in stages},
+            'counters': {name: counter.value for name, counter in sorted(self.counters.items())},
+            'histograms': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+        }
+
+# 进程级的全局指标注册表
+metrics = MetricsRegistry()
+
+def count(name, amount=1):
+    """计数器加 amount。"""
+    metrics.counter(name).inc(amount)
+
+def observe(name, value):
+    """向直方图记录一个观测值。"""
+    metrics.histogram(name).observe(value)
+
+@contextmanager
+def timed(name):
+    """把代码块的耗时（秒）记录到直方图 name。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+@contextmanager
+def stage(name):
+    """累计一个处理阶段的墙钟时间和CPU时间（CPU时间为整个进程的，含其他线程）。"""
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        metrics.stage_timer(name).add(time.perf_counter() - start_wall, time.process_time() - start_cpu)
+
+def log_event(event, message=None, level=logging.INFO, logger=None, **fields):
+    """输出带结构化字段的日志事件（JSON格式下字段展开为顶层键）。"""
+    if message is None:
+        message = event + (' ' + ' '.join(f"{key}={value}" for key, value in fields.items()) if fields else '')
+    (logger or logging.getLogger()).log(level, message, extra={'event': event, 'fields': fields})
+
+class ItemLogSampler:
+    """逐条目日志采样: 前 first 条全部输出，之后每 every 条输出一条；被省略的条数计入计数器。"""
+
+    def __init__(self, name, every=None, first=DEFAULT_SAMPLE_FIRST):
+        self.name = name
+        self.every = every
+        self.first = first
+        self.seen = 0
+        self.lock = threading.Lock()
+
+    def hit(self):
+        """本条是否需要输出。"""
+        if self.every is None:
+            # 延迟读取环境变量，模块级的采样器也能使用配置文件中的 LOG_SAMPLE_EVERY
+            self.every = max(1, int(os.getenv('LOG_SAMPLE_EVERY', DEFAULT_SAMPLE_EVERY)))
+        with self.lock:
+            self.seen += 1
+            seen = self.seen
+        if seen <= self.first or seen % self.every == 0:
+            return True
+        count(f"log.suppressed.{self.name}")
+        return False
+
+    def info(self, message, *args, logger=None):
+        """采样输出INFO日志；警告和错误请直接调用 logging，不做采样。"""
+        if self.hit():
+            (logger or logging.getLogger()).info(message, *args)
+
+def default_metrics_dir():
+    """指标目录: 环境变量 METRICS_DIR（相对于项目根目录），默认 output/logs/metrics。"""
+    return repo_path(os.getenv('METRICS_DIR', 'output/logs/metrics'))
+
+def write_summary(run_name, metrics_dir=None):
+    """把运行汇总写入 <metrics_dir>/<run_name>-<时间戳>.json，返回文件路径。"""
+    metrics_dir = metrics_dir or default_metrics_dir()
+    os.makedirs(metrics_dir, exist_ok=True)
+    timestamp = datetime.fromtimestamp(metrics.started_at).strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(metrics_dir, f"{run_name}-{timestamp}-{os.getpid()}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(metrics.summary(run_name), f, ensure_ascii=False, indent=2)
+    return path
+
+def setup_logging(log_file, run_name, level=logging.INFO, log_format=None, metrics_dir=None, write_metrics=True):
+    """配置文件与控制台日志，并在进程退出时写出运行汇总。
+
+    log_format 为 'json' 时文件日志使用JSON行格式（默认读取环境变量 LOG_FORMAT，控制台始终为文本）。
+    """
+    log_format = (log_format or os.getenv('LOG_FORMAT', 'text')).lower()
+    if os.path.dirname(log_file):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    logging.basicConfig(level=level, handlers=[file_handler, console_handler])
+
+    if write_metrics:
+        def finish():
+            try:
+                path = write_summary(run_name, metrics_dir)
+                logging.getLogger().info(f"运行指标已写入: {path}")
+            except OSError as e:
+                logging.getLogger().warning(f"写入运行指标失败: {e}")
+        atexit.register(finish)
+    return metrics
+
+def main():
+    """打印指标文件中的热点摘要: python instrumentation.py <metrics.json> [...]。"""
+    for path in sys.argv[1:]:
+        with open(path, 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+        print(f"{path}: {summary['run']}，墙钟 {summary['wall_seconds']:.2f} 秒，CPU {summary['cpu_seconds']:.2f} 秒")
+        for name, stage_summary in summary['stages'].items():
+            share = stage_summary['wall_seconds'] / summary['wall_seconds'] * 100 if summary['wall_seconds'] else 0
+            print(f"  阶段 {name:<32} {stage_summary['wall_seconds']:9.3f} 秒 ({share:5.1f}%)  "
+                  f"CPU {stage_summary['cpu_seconds']:8.3f} 秒  调用 {stage_summary['calls']}")
+        for name, histogram in summary['histograms'].items():
+            if histogram['count']:
+                print(f"  直方图 {name:<30} n={histogram['count']}  p50={histogram['p50']:.4g}  "
+                      f"p95={histogram['p95']:.4g}  max={histogram['max']:.4g}  sum={histogram['sum']:.4g}")
+        for name, value in summary['counters'].items():
+            print(f"  计数器 {name:<30} {value}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
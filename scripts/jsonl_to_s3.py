@@ -4,12 +4,15 @@
 """
 
 import os
-import boto3
 import argparse
 import logging
-import dotenv
 from pathlib import Path
 
+from instrumentation import count, setup_logging, timed
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import get_client
+
 def parse_arguments():
     """解析命令行参数。"""
     parser = argparse.ArgumentParser(description='将JSONL文件上传到S3的适当目录')
@@ -22,23 +25,22 @@ def parse_arguments():
     parser.add_argument('--dry-run', action='store_true', help='打印要上传的文件而不实际上传')
     parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
     
+    add_profile_arguments(parser)
+    
     return parser.parse_args()
 
 def load_config(config_path):
     """加载环境变量配置。"""
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
-    
-    dotenv.load_dotenv(config_path)
+    settings = load_settings(config_path)
     
-    # 获取必要的环境变量
+    # 获取必要的配置
     config = {
-        'train_jsonl': os.path.join('..', os.getenv('TRAIN_JSONL', 'data/bedrock-ft/train_data.jsonl')),
-        'test_jsonl': os.path.join('..', os.getenv('TEST_JSONL', 'data/bedrock-ft/test_data.jsonl')),
-        's3_bucket': os.getenv('S3_BUCKET', 'aigcdemo.plaza.red'),
-        's3_prefix': os.getenv('S3_PREFIX_TRAINING', 'nova-ft/training/data'),
-        'region': os.getenv('AWS_REGION', 'us-east-1'),
-        'log_file': os.path.join('..', os.getenv('LOGS_DIR', 'output/logs'), 'jsonl_to_s3.log')
+        'train_jsonl': str(settings.train_jsonl),
+        'test_jsonl': str(settings.test_jsonl),
+        's3_bucket': settings.s3_bucket,
+        's3_prefix': settings.s3_prefix_training,
+        'region': settings.aws_region,
+        'log_file': str(settings.jsonl_to_s3_log)
     }
     
     return config
@@ -54,8 +56,11 @@ def upload_file_to_s3(file_path, s3_bucket, s3_key, region, dry_run=False):
         return True
     
     try:
-        s3_client = boto3.client('s3', region_name=region)
-        s3_client.upload_file(file_path, s3_bucket, s3_key)
+        s3_client = get_client('s3', region_name=region)
+        with timed('s3.upload_seconds'):
+            s3_client.upload_file(file_path, s3_bucket, s3_key)
+        count('s3.uploads')
+        count('s3.upload_bytes', os.path.getsize(file_path))
         logging.info(f"成功上传 {file_path} 到 s3://{s3_bucket}/{s3_key}")
         return True
     except Exception as e:
@@ -66,6 +71,7 @@ def main():
     """将JSONL文件上传到S3的主函数。"""
     # 解析命令行参数
     args = parse_arguments()
+    start_profiling(args, 'jsonl_to_s3')
     
     # 加载配置
     config = load_config(args.config)
@@ -78,15 +84,7 @@ def main():
     region = args.region if args.region else config['region']
     
     # 配置日志
-    os.makedirs(os.path.dirname(config['log_file']), exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(config['log_file']),
-            logging.StreamHandler()
-        ]
-    )
+    setup_logging(config['log_file'], 'jsonl_to_s3')
     
     # 记录配置
     logging.info(f"使用配置:")
@@ -118,7 +116,7 @@ def main():
     # 验证上传
     if not args.dry_run:
         try:
-            s3_client = boto3.client('s3', region_name=region)
+            s3_client = get_client('s3', region_name=region)
             response = s3_client.list_objects_v2(
                 Bucket=s3_bucket,
                 Prefix=s3_prefix
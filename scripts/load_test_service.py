@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+发票销售方提取微服务的压测脚本
+以固定并发持续发送发票图像，统计吞吐、延迟分位数和状态码分布，
+并根据服务端 /metrics 中的后端吞吐估算达到目标QPS所需的模型单元数
+"""
+
+import os
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import http.client
+from pathlib import Path
+from urllib.parse import urlparse
+
+from profiling import add_profile_arguments, start_profiling
+from settings import repo_path
+from image_scanner import IMAGE_EXTENSIONS
+from nova_inference import percentile
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='发票销售方提取微服务压测')
+
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8080', help='服务地址')
+    parser.add_argument('--images-dir', type=str, default=repo_path('data/images/test'), help='压测使用的发票图像目录')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发连接数')
+    parser.add_argument('--duration', type=float, default=30.0, help='压测时长（秒）')
+    parser.add_argument('--unique', action='store_true', help='为每个请求追加随机字节，绕过服务端结果缓存')
+    parser.add_argument('--model-units', type=int, default=1, help='服务后端当前使用的模型单元数')
+    parser.add_argument('--target-rps', type=float, help='目标QPS，用于估算需要的模型单元数')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_images(images_dir):
+    """读取压测图像到内存。"""
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+    return [p.read_bytes() for p in paths]
+
+def worker(host, port, images, deadline, unique, results, lock):
+    """单个压测线程：在持久连接上循环发送请求。"""
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    local = []
+    while time.monotonic() < deadline:
+        body = random.choice(images)
+        if unique:
+            # JPEG结束标记之后的字节会被解码器忽略，但会改变图像哈希
+            body = body + os.urandom(16)
+        start = time.monotonic()
+        try:
+            connection.request('POST', '/extract', body=body, headers={'Content-Type': 'image/jpeg'})
+            response = connection.getresponse()
+            response.read()
+            local.append((response.status, time.monotonic() - start))
+        except Exception:
+            local.append((None, time.monotonic() - start))
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=60)
+    connection.close()
+    with lock:
+        results.extend(local)
+
+def fetch_metrics(host, port):
+    """读取服务端指标。"""
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        connection.request('GET', '/metrics')
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+def main():
+    """运行压测的主函数。"""
+    args = parse_arguments()
+    start_profiling(args, 'load_test_service')
+    url = urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+
+    images = load_images(args.images_dir)
+    if not images:
+        print(f"目录中未找到图像: {args.images_dir}")
+        return False
+
+    results = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=worker, args=(host, port, images, deadline, args.unique, results, lock))
+               for _ in range(args.concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    status_counts = {}
+    for status, _ in results:
+        status_counts[status] = status_counts.get(status, 0) + 1
+    ok_latencies = sorted(latency for status, latency in results if status == 200)
+
+    print(f"请求总数: {len(results)}，耗时: {elapsed:.1f} 秒，并发: {args.concurrency}")
+    print(f"状态码分布: {status_counts}")
+    print(f"成功吞吐: {len(ok_latencies) / elapsed:.2f} 请求/秒")
+    if ok_latencies:
+        print(f"延迟 p50/p95/p99: {percentile(ok_latencies, 0.50):.3f}/"
+              f"{percentile(ok_latencies, 0.95):.3f}/{percentile(ok_latencies, 0.99):.3f} 秒")
+
+    # 根据后端实测吞吐估算模型单元数
+    metrics = fetch_metrics(host, port)
+    backend = metrics.get('backend', {})
+    backend_rps = backend.get('requests_per_second', 0.0)
+    print(f"服务端: 平均批大小 {metrics.get('mean_batch_size', 0):.2f}，拒绝 {metrics.get('rejected', 0)}，"
+          f"缓存命中 {metrics.get('cache', {}).get('hits', 0)}")
+    if backend.get('p50') is not None:
+        print(f"后端延迟 p50/p95: {backend['p50']:.3f}/{backend['p95']:.3f} 秒")
+    if args.target_rps and len(ok_latencies) and not args.unique:
+        print("提示: 未使用 --unique 时结果包含缓存命中，估算值可能偏低")
+    if args.target_rps:
+        measured_per_unit = (len(ok_latencies) / elapsed) / max(args.model_units, 1)
+        if measured_per_unit > 0:
+            units = math.ceil(args.target_rps / measured_per_unit)
+            print(f"每个模型单元实测吞吐: {measured_per_unit:.2f} 请求/秒，"
+                  f"达到 {args.target_rps} 请求/秒约需 {units} 个模型单元")
+    return True
+
+if __name__ == "__main__":
+    main()
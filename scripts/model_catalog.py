@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Amazon Bedrock 基础模型目录索引
+把 <region>-models.json（aws bedrock list-foundation-models 的原始输出）一次性加载为带索引的结构，
+按区域、提供商、输入/输出模态、定制类型、推理类型和生命周期状态建立位图索引，
+查询只需对几个整数做按位与；记录和索引以纯数据的pickle缓存在磁盘上，源文件变化时自动重建。
+还可以通过 list-foundation-models 接口（或本地替代服务）刷新目录，并为微调作业做基础模型预检。
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import pickle
+import logging
+import argparse
+
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import get_client
+
+# 目录文件命名规则: <region>-models.json
+CATALOG_FILE_SUFFIX = '-models.json'
+CACHE_FILE = 'model_catalog.pkl'
+# 缓存格式变化时递增，旧缓存会被自动重建
+CACHE_VERSION = 2
+
+# 建立索引的字段: 索引名 -> (记录字段, 是否为列表)
+INDEXED_FIELDS = {
+    'region': ('region', False),
+    'provider': ('providerName', False),
+    'input_modality': ('inputModalities', True),
+    'output_modality': ('outputModalities', True),
+    'customization': ('customizationsSupported', True),
+    'inference_type': ('inferenceTypesSupported', True),
+    'status': ('status', False)
+}
+
+ARN_PATTERN = re.compile(r'^arn:aws[\w-]*:bedrock:(?P<region>[\w-]+)::foundation-model/(?P<model_id>.+)$')
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='查询Amazon Bedrock基础模型目录')
+
+    parser.add_argument('--catalog-dir', type=str, help='<region>-models.json 所在目录')
+    parser.add_argument('--cache-dir', type=str, help='索引缓存目录')
+    parser.add_argument('--region', type=str, help='按区域过滤')
+    parser.add_argument('--provider', type=str, help='按提供商过滤（如 Amazon）')
+    parser.add_argument('--input-modality', type=str, help='按输入模态过滤（如 IMAGE）')
+    parser.add_argument('--output-modality', type=str, help='按输出模态过滤（如 TEXT）')
+    parser.add_argument('--customization', type=str, help='按支持的定制类型过滤（如 FINE_TUNING）')
+    parser.add_argument('--inference-type', type=str, help='按推理类型过滤（如 ON_DEMAND）')
+    parser.add_argument('--include-legacy', action='store_true', help='包含非ACTIVE状态的模型')
+    parser.add_argument('--validate', type=str, metavar='MODEL_ID', help='检查模型ID或ARN是否可用于微调')
+    parser.add_argument('--refresh', action='store_true', help='调用 list-foundation-models 刷新目录文件')
+    parser.add_argument('--refresh-region', type=str, action='append', help='要刷新的区域（可重复指定，默认为已有目录文件的区域）')
+    parser.add_argument('--endpoint-url', type=str, help='Bedrock控制面的替代服务地址（如本地模拟服务）')
+    parser.add_argument('--stub-dir', type=str, help='用目录中的JSON文件模拟 list-foundation-models 接口')
+    parser.add_argument('--rebuild', action='store_true', help='忽略缓存，重新构建索引')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出查询结果')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'catalog_dir': str(settings.model_catalog_dir),
+        'cache_dir': str(settings.cache_dir),
+        'region': settings.aws_region
+    }
+
+    return config
+
+def parse_model_identifier(identifier):
+    """把模型ARN或模型ID拆分为 (区域或None, 模型ID)。"""
+    match = ARN_PATTERN.match(identifier)
+    if match:
+        return match.group('region'), match.group('model_id')
+    return None, identifier
+
+def catalog_files(catalog_dir):
+    """列出目录文件，返回 {区域: 路径}。"""
+    files = {}
+    for path in sorted(glob.glob(os.path.join(catalog_dir, '*' + CATALOG_FILE_SUFFIX))):
+        region = os.path.basename(path)[:-len(CATALOG_FILE_SUFFIX)]
+        files[region] = path
+    return files
+
+def source_fingerprints(files):
+    """目录文件的指纹（大小与修改时间），用于判断缓存是否过期。"""
+    fingerprints = {}
+    for region, path in files.items():
+        stat = os.stat(path)
+        fingerprints[region] = f"{stat.st_size}-{stat.st_mtime_ns}"
+    return fingerprints
+
+class ModelCatalog:
+    """带位图索引的模型目录。
+
+    每条记录在 records 中有一个序号；每个索引值对应一个Python整数位图，
+    第 i 位为1表示第 i 条记录具有该值。多条件查询即位图按位与。
+    """
+
+    def __init__(self, records, fingerprints=None, indexes=None):
+        self.records = records
+        self.fingerprints = fingerprints or {}
+        self.by_key = {(record['region'], record['modelId']): position
+                       for position, record in enumerate(records)}
+        self.all_mask = (1 << len(records)) - 1
+        if indexes is not None:
+            self.indexes = indexes
+            return
+
+        self.indexes = {name: {} for name in INDEXED_FIELDS}
+        for position, record in enumerate(records):
+            bit = 1 << position
+            for name, (field, is_list) in INDEXED_FIELDS.items():
+                values = (record.get(field) or []) if is_list else [record.get(field)]
+                index = self.indexes[name]
+                for value in values:
+                    if value is None:
+                        continue
+                    key = value.upper()
+                    index[key] = index.get(key, 0) | bit
+
+    @classmethod
+    def from_dumps(cls, files):
+        """从 {区域: 目录文件路径} 构建目录。"""
+        records = []
+        for region, path in files.items():
+            with open(path, 'r', encoding='utf-8') as f:
+                summaries = json.load(f).get('modelSummaries', [])
+            for summary in summaries:
+                records.append({
+                    'region': region,
+                    'modelId': summary['modelId'],
+                    'modelArn': summary.get('modelArn', ''),
+                    'modelName': summary.get('modelName', ''),
+                    'providerName': summary.get('providerName', ''),
+                    'inputModalities': tuple(summary.get('inputModalities', [])),
+                    'outputModalities': tuple(summary.get('outputModalities', [])),
+                    'customizationsSupported': tuple(summary.get('customizationsSupported', [])),
+                    'inferenceTypesSupported': tuple(summary.get('inferenceTypesSupported', [])),
+                    'responseStreamingSupported': summary.get('responseStreamingSupported', False),
+                    'status': summary.get('modelLifecycle', {}).get('status', 'ACTIVE')
+                })
+        return cls(records, source_fingerprints(files))
+
+    def to_state(self):
+        """缓存用的纯数据（只含dict/list/tuple/str/int），不依赖本类的导入路径。"""
+        return {'version': CACHE_VERSION, 'fingerprints': self.fingerprints,
+                'records': self.records, 'indexes': self.indexes}
+
+    @classmethod
+    def from_state(cls, state):
+        """由 to_state() 的结果重建目录，无需重新计算位图。"""
+        return cls(state['records'], state['fingerprints'], state['indexes'])
+
+    @property
+    def regions(self):
+        # 索引键是大写的，这里返回记录中的原始区域名，才能与 by_key 对应
+        return sorted({record['region'] for record in self.records})
+
+    def mask(self, include_legacy=False, **filters):
+        """计算满足所有过滤条件的记录位图（过滤值不区分大小写）。"""
+        mask = self.all_mask
+        if not include_legacy:
+            mask &= self.indexes['status'].get('ACTIVE', 0)
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in self.indexes:
+                raise ValueError(f"不支持的过滤条件: {name}，可选 {sorted(self.indexes)}")
+            mask &= self.indexes[name].get(value.upper(), 0)
+            if not mask:
+                break
+        return mask
+
+    def find(self, include_legacy=False, **filters):
+        """返回满足过滤条件的模型记录列表。"""
+        mask = self.mask(include_legacy, **filters)
+        results = []
+        while mask:
+            low = mask & -mask
+            results.append(self.records[low.bit_length() - 1])
+            mask ^= low
+        return results
+
+    def count(self, include_legacy=False, **filters):
+        """满足过滤条件的模型数量。"""
+        return self.mask(include_legacy, **filters).bit_count()
+
+    def get(self, identifier, region=None):
+        """按模型ID或ARN查找记录；ARN中的区域优先于 region 参数。"""
+        arn_region, model_id = parse_model_identifier(identifier)
+        position = self.by_key.get((arn_region or region, model_id))
+        return None if position is None else self.records[position]
+
+    def regions_for(self, identifier, **filters):
+        """返回提供指定模型（且满足过滤条件）的区域列表。"""
+        _, model_id = parse_model_identifier(identifier)
+        mask = self.mask(**filters)
+        return [region for region in self.regions
+                if (position := self.by_key.get((region, model_id))) is not None and mask >> position & 1]
+
+def load_catalog(catalog_dir, cache_dir=None, rebuild=False):
+    """加载目录: 缓存有效时直接反序列化，否则从目录文件重建并写入缓存。"""
+    files = catalog_files(catalog_dir)
+    if not files:
+        raise FileNotFoundError(f"目录中没有 *{CATALOG_FILE_SUFFIX} 文件: {catalog_dir}")
+    fingerprints = source_fingerprints(files)
+
+    cache_path = os.path.join(cache_dir, CACHE_FILE) if cache_dir else None
+    if cache_path and not rebuild and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                state = pickle.load(f)
+            if not isinstance(state, dict) or state.get('version') != CACHE_VERSION:
+                logging.info(f"索引缓存格式已变化，重新构建: {cache_path}")
+            elif state['fingerprints'] != fingerprints:
+                logging.info(f"目录文件已变化，重新构建索引缓存: {cache_path}")
+            else:
+                return ModelCatalog.from_state(state)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError) as e:
+            logging.warning(f"无法读取索引缓存 {cache_path}，重新构建: {e}")
+
+    catalog = ModelCatalog.from_dumps(files)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(catalog.to_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    return catalog
+
+class StubCatalogAPI:
+    """list-foundation-models 的本地替代: 从目录中的 <region>-models.json 读取响应。"""
+
+    def __init__(self, stub_dir, region):
+        self.path = os.path.join(stub_dir, region + CATALOG_FILE_SUFFIX)
+
+    def list_foundation_models(self, **kwargs):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"替代服务中没有该区域的数据: {self.path}")
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+def create_catalog_client(region, endpoint_url=None, stub_dir=None):
+    """创建用于刷新目录的客户端（本地替代服务或 aws_clients 中共享的boto3客户端）。"""
+    if stub_dir:
+        return StubCatalogAPI(stub_dir, region)
+    return get_client('bedrock', region_name=region, endpoint_url=endpoint_url)
+
+def refresh_catalog(catalog_dir, regions, endpoint_url=None, stub_dir=None):
+    """调用 list-foundation-models 并原子地覆盖各区域的目录文件，返回 {区域: 模型数}。"""
+    counts = {}
+    for region in regions:
+        client = create_catalog_client(region, endpoint_url, stub_dir)
+        response = client.list_foundation_models()
+        payload = {'modelSummaries': response.get('modelSummaries', [])}
+        path = os.path.join(catalog_dir, region + CATALOG_FILE_SUFFIX)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        counts[region] = len(payload['modelSummaries'])
+    return counts
+
+def validate_base_model(catalog, identifier, region, customization='FINE_TUNING'):
+    """检查基础模型能否在指定区域做指定类型的定制，返回 (是否通过, 问题列表, 可选替代模型)。"""
+    arn_region, model_id = parse_model_identifier(identifier)
+    problems = []
+    if arn_region and arn_region != region:
+        problems.append(f"模型ARN中的区域 {arn_region} 与作业区域 {region} 不一致")
+
+    record = catalog.get(model_id, region)
+    if record is None:
+        other_regions = catalog.regions_for(model_id, include_legacy=True)
+        if other_regions:
+            problems.append(f"区域 {region} 中没有模型 {model_id}（可用区域: {', '.join(other_regions)}）")
+        else:
+            problems.append(f"目录中没有模型 {model_id}")
+    else:
+        if customization not in record['customizationsSupported']:
+            supported = ', '.join(record['customizationsSupported']) or '无'
+            problems.append(f"模型 {model_id} 不支持 {customization}（支持的定制类型: {supported}）")
+        if record['status'] != 'ACTIVE':
+            problems.append(f"模型 {model_id} 的生命周期状态为 {record['status']}")
+
+    alternatives = []
+    if problems:
+        filters = {'region': region, 'customization': customization}
+        if record is not None:
+            filters['provider'] = record['providerName']
+            if 'IMAGE' in record['inputModalities']:
+                filters['input_modality'] = 'IMAGE'
+            if record['outputModalities']:
+                filters['output_modality'] = record['outputModalities'][0]
+        alternatives = [candidate['modelArn'] for candidate in catalog.find(**filters)]
+
+    return not problems, problems, alternatives
+
+def format_record(record):
+    """单行展示模型记录。"""
+    return (f"{record['region']:<10} {record['modelId']:<48} {record['providerName']:<12} "
+            f"in={','.join(record['inputModalities'])} out={','.join(record['outputModalities'])} "
+            f"custom={','.join(record['customizationsSupported']) or '-'} "
+            f"infer={','.join(record['inferenceTypesSupported']) or '-'}")
+
+def main():
+    """查询模型目录的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'model_catalog')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    if args.catalog_dir:
+        config['catalog_dir'] = args.catalog_dir
+    if args.cache_dir:
+        config['cache_dir'] = args.cache_dir
+
+    if args.refresh:
+        regions = args.refresh_region or list(catalog_files(config['catalog_dir'])) or [config['region']]
+        counts = refresh_catalog(config['catalog_dir'], regions, args.endpoint_url, args.stub_dir)
+        for region, count in counts.items():
+            print(f"已刷新 {region}: {count} 个模型")
+
+    start = time.perf_counter()
+    catalog = load_catalog(config['catalog_dir'], config['cache_dir'], rebuild=args.rebuild)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    if args.validate:
+        region = args.region or parse_model_identifier(args.validate)[0] or config['region']
+        ok, problems, alternatives = validate_base_model(catalog, args.validate, region)
+        if ok:
+            print(f"模型 {args.validate} 可在 {region} 微调")
+            return 0
+        for problem in problems:
+            print(f"错误: {problem}")
+        if alternatives:
+            print("可用于微调的替代模型:")
+            for arn in alternatives:
+                print(f"  {arn}")
+        return 1
+
+    filters = {
+        'region': args.region,
+        'provider': args.provider,
+        'input_modality': args.input_modality,
+        'output_modality': args.output_modality,
+        'customization': args.customization,
+        'inference_type': args.inference_type
+    }
+    start = time.perf_counter()
+    results = catalog.find(include_legacy=args.include_legacy, **filters)
+    query_us = (time.perf_counter() - start) * 1e6
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for record in results:
+            print(format_record(record))
+        print(f"共 {len(results)} 个模型（{len(catalog.records)} 条记录，{len(catalog.regions)} 个区域；"
+              f"加载 {load_ms:.2f} ms，查询 {query_us:.1f} µs）")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Constants, exceptions and helpers shared by nova_ft_dataset_validator and nova_ft_schema.
+
+Both modules import from here (and never from each other), so running the validator as
+__main__ cannot load a second copy of NovaClientError & co. through the schema module.
+Standard library only.
+"""
+
+import re
+
+
+IMAGE_FORMATS = ["jpeg", "png", "gif", "webp"]
+VIDEO_FORMATS = ["mov", "mkv", "mp4", "webm"]
+MAX_NUM_IMAGES = 10
+MODEL_TO_NUM_SAMPLES_MAP = {"micro": (8, 20000), "lite": (8, 20000), "pro": (8, 20000)}
+
+
+class ConverseRoles:
+    """Defines the possible roles in a conversation according to converse format"""
+
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
+
+
+CONVERSE_ROLES_WITHOUT_SYSTEM = [ConverseRoles.USER, ConverseRoles.ASSISTANT]
+
+
+class NovaClientError(ValueError):
+    """Custom exception for Nova client validation errors."""
+
+    def __init__(self, message):
+        super().__init__(message)
+
+class NovaInternalError(Exception):
+    """Base exception for Nova Fine Tuning validation errors"""
+    pass
+
+
+def check_roles_order(messages):
+    """Validates that messages alternate between user and assistant roles."""
+
+    if len(messages) < 2:
+        raise ValueError(
+            f"Invalid messages, both {CONVERSE_ROLES_WITHOUT_SYSTEM} are needed in sample"
+        )
+
+    for i, message in enumerate(messages):
+        if i % 2 == 0 and message.role != ConverseRoles.USER:
+            raise ValueError(
+                f"Invalid messages, expected {ConverseRoles.USER} role but found {message.role}"
+            )
+        elif i % 2 == 1 and message.role != ConverseRoles.ASSISTANT:
+            raise ValueError(
+                f"Invalid messages, expected {ConverseRoles.ASSISTANT} role but found {message.role}"
+            )
+
+    # When turns are odd
+    if messages[-1].role != ConverseRoles.ASSISTANT:
+        raise ValueError(f"Invalid messages, last turn should have {ConverseRoles.ASSISTANT} role")
+
+
+def is_valid_path(file_path):
+    """Validates that file path contains only alphanumeric characters, underscores, hyphens, slashes, and dots."""
+    pattern = r"^[\w\-/\.]+$"
+    if not re.match(pattern, file_path):
+        raise ValueError(
+            f"Invalid characters in 'uri'. Only alphanumeric, underscores, hyphens, slashes, and dots are allowed"
+        )
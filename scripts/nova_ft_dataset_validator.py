@@ -1,40 +1,18 @@
 import argparse
 import json
-import re
-import os
-import dotenv
 import logging
+import time
 
-from pydantic import BaseModel, ValidationError, ValidationInfo, field_validator, model_validator
-from typing import List, Optional
 
+from instrumentation import observe, setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from nova_ft_common import (
+    MODEL_TO_NUM_SAMPLES_MAP,
+    NovaClientError,
+    NovaInternalError,
+)
 
-IMAGE_FORMATS = ["jpeg", "png", "gif", "webp"]
-VIDEO_FORMATS = ["mov", "mkv", "mp4", "webm"]
-MAX_NUM_IMAGES = 10
-MODEL_TO_NUM_SAMPLES_MAP = {"micro": (8, 20000), "lite": (8, 20000), "pro": (8, 20000)}
-
-
-class ConverseRoles:
-    """Defines the possible roles in a conversation according to converse format"""
-
-    SYSTEM = "system"
-    USER = "user"
-    ASSISTANT = "assistant"
-
-
-CONVERSE_ROLES_WITHOUT_SYSTEM = [ConverseRoles.USER, ConverseRoles.ASSISTANT]
-
-
-class NovaClientError(ValueError):
-    """Custom exception for Nova client validation errors."""
-
-    def __init__(self, message):
-        super().__init__(message)
-
-class NovaInternalError(Exception):
-    """Base exception for Nova Fine Tuning validation errors"""
-    pass
 
 def check_jsonl_file(file_path):
     """Validates that the input file has a .jsonl extension."""
@@ -61,173 +39,13 @@ def load_jsonl_data(file_path: str):
         raise NovaClientError(f"Error loading data from {file_path}: {str(e)}")
 
 
-class S3Location(BaseModel):
-    """Represents and validates an S3 URI location."""
-
-    uri: str
-
-    @field_validator("uri")
-    def validate_format(cls, uri):
-        """Validates that the URI starts with 's3://'."""
-        if not uri.startswith("s3://"):
-            raise ValueError(f"Invalid S3 URI, must start with 's3://'")
-        is_valid_path(uri.replace("s3://", ""))
-        return uri
-
-
-class Source(BaseModel):
-    """Defines the source location for media content."""
-
-    s3Location: S3Location
-
-
-class ImageContent(BaseModel):
-    """Represents and validates image content with format and source."""
-
-    format: str
-    source: Source
-
-    @field_validator("format")
-    def validate_format(cls, image_format):
-        """Validates that the image format is supported."""
-        if image_format.lower() not in IMAGE_FORMATS:
-            raise ValueError(f"Invalid image format, supported formats are {IMAGE_FORMATS}")
-        return image_format
-
-
-class VideoContent(BaseModel):
-    """Represents and validates video content with format and source."""
-
-    format: str
-    source: Source
-
-    @field_validator("format")
-    def validate_format(cls, video_format):
-        """Validates that the video format is supported."""
-        if video_format.lower() not in VIDEO_FORMATS:
-            raise ValueError(f"Invalid video format, supported formats are {VIDEO_FORMATS}")
-        return video_format
-
-
-class ContentItem(BaseModel):
-    """Represents a content item that can contain text, image, or video."""
-
-    text: Optional[str] = None
-    image: Optional[ImageContent] = None
-    video: Optional[VideoContent] = None
-
-    @model_validator(mode="after")
-    def validate_model_fields(cls, values):
-        """Validates that at least one content type is provided."""
-        if not any(getattr(values, field) is not None for field in cls.model_fields.keys()):
-            raise ValueError(
-                f"Invalid content, at least one of {list(cls.model_fields.keys())} must be provided"
-            )
-        return values
-
-
-class Message(BaseModel):
-    """Represents a conversation message with role and content."""
-
-    role: str
-    content: List[ContentItem]
-
-    @field_validator("role")
-    def validate_role(cls, role):
-        """Validates that the role is either user or assistant."""
-        if role.lower() not in CONVERSE_ROLES_WITHOUT_SYSTEM:
-            raise ValueError(
-                f"Invalid value for role, valid values are {CONVERSE_ROLES_WITHOUT_SYSTEM}"
-            )
-        return role
-
-    @model_validator(mode="after")
-    def validate_content_rules(cls, values):
-        """Validates content rules for assistant messages."""
-        content_items = values.content
-        has_video = any(item.video is not None for item in content_items)
-        has_image = any(item.image is not None for item in content_items)
-
-        if has_image or has_video:
-            if values.role.lower() == "assistant":
-                raise ValueError(
-                    "Invalid content, image/video cannot be included when role is 'assistant'"
-                )
-
-        return values
-
-    @field_validator("content")
-    def validate_content(cls, content, info: ValidationInfo):
-        """Validates message content against Nova's rules for text, images, and videos.
-        Ensures content follows size limits (max 10 images, 1 video), format restrictions,
-        and model-specific constraints (no media for micro models). Checks that text content
-        is not empty and media types don't mix (can't have both images and video).
-
-        Args:
-            content (List[ContentItem]): List of content items to validate
-            info (ValidationInfo): Validation context with model_name
-
-        Raises:
-            ValueError: If content violates Nova's rules
-            Exception: If validation context is missing
-        """
-        has_text = any(item.text is not None for item in content)
-        has_video = any(item.video is not None for item in content)
-        has_image = any(item.image is not None for item in content)
-
-        total_text_length = sum(len(item.text) for item in content if item.text is not None)
-        if has_text and not (has_image or has_video) and total_text_length == 0:
-            raise ValueError("Invalid content, empty text content")
-
-        if not info.context:
-            raise NovaInternalError("context is not set for validating model type")
-
-        is_micro_model = "micro" in info.context["model_name"]
-        if is_micro_model and (has_image or has_video):
-            raise ValueError(
-                "Invalid content, image/video samples not supported by Nova Micro model"
-            )
-
-        if sum(1 for item in content if item.video is not None) > 1:
-            raise ValueError("Only one video is allowed per sample")
-
-        if has_video and has_image:
-            raise ValueError(
-                "'content' list cannot contain both video items and image items for a given sample"
-            )
-
-        num_images = sum(1 for item in content if item.image is not None)
-        if num_images > MAX_NUM_IMAGES:
-            raise ValueError(
-                f"Invalid content, number of images {num_images} exceed maximum allowed limit of {MAX_NUM_IMAGES}"
-            )
-
-        return content
-
-
-class SystemMessage(BaseModel):
-    """Represents a system message with text content."""
-
-    text: str
-
-
-class ConverseDatasetSample(BaseModel):
-    """Represents a complete conversation sample with system message and message turns."""
-
-    schemaVersion: Optional[str] = None
-    system: Optional[List[SystemMessage]] = None
-    messages: List[Message]
-
-    @field_validator("messages")
-    def validate_data_sample_rules(cls, messages):
-        """Validates the order and structure of messages in the conversation."""
-        check_roles_order(messages)
-        return messages
-
-
 def validate_converse_dataset(args):
     """Validates the entire conversation dataset against Nova format requirements."""
-    samples = load_jsonl_data(args.input_file)
+    from pydantic import ValidationError
+    from nova_ft_schema import ConverseDatasetSample
+
+    with stage('load_jsonl'):
+        samples = load_jsonl_data(args.input_file)
     num_samples = len(samples)
     validate_data_record_bounds(num_samples, args.model_name)
 
@@ -235,9 +53,12 @@ def validate_converse_dataset(args):
     failed_samples_id_list = []
 
     for i, sample in enumerate(samples):
+        start = time.perf_counter()
         try:
             ConverseDatasetSample.model_validate(sample, context={"model_name": args.model_name})
+            observe('validation.sample_seconds', time.perf_counter() - start)
         except ValidationError as e:
+            observe('validation.sample_seconds', time.perf_counter() - start)
             failed_samples_id_list.append(i)
             error_message += f"Sample {i} - "
             for err in e.errors():
@@ -264,38 +85,6 @@ def validate_converse_dataset(args):
         print("Validation successful, all samples passed")
 
 
-def check_roles_order(messages):
-    """Validates that messages alternate between user and assistant roles."""
-
-    if len(messages) < 2:
-        raise ValueError(
-            f"Invalid messages, both {CONVERSE_ROLES_WITHOUT_SYSTEM} are needed in sample"
-        )
-
-    for i, message in enumerate(messages):
-        if i % 2 == 0 and message.role != ConverseRoles.USER:
-            raise ValueError(
-                f"Invalid messages, expected {ConverseRoles.USER} role but found {message.role}"
-            )
-        elif i % 2 == 1 and message.role != ConverseRoles.ASSISTANT:
-            raise ValueError(
-                f"Invalid messages, expected {ConverseRoles.ASSISTANT} role but found {message.role}"
-            )
-
-    # When turns are odd
-    if messages[-1].role != ConverseRoles.ASSISTANT:
-        raise ValueError(f"Invalid messages, last turn should have {ConverseRoles.ASSISTANT} role")
-
-
-def is_valid_path(file_path):
-    """Validates that file path contains only alphanumeric characters, underscores, hyphens, slashes, and dots."""
-    pattern = r"^[\w\-/\.]+$"
-    if not re.match(pattern, file_path):
-        raise ValueError(
-            f"Invalid characters in 'uri'. Only alphanumeric, underscores, hyphens, slashes, and dots are allowed"
-        )
-
-
 def get_data_record_bounds(model_name: str):
     """Returns the minimum and maximum number of samples allowed for a given model."""
     return MODEL_TO_NUM_SAMPLES_MAP[model_name]
@@ -313,7 +102,7 @@ def validate_data_record_bounds(num_samples: int, model_name: str):
         )
 
 
-if __name__ == "__main__":
+def main():
     description = """
     This script is for validating Nova converse format.
     Takes input a jsonl file with samples in the Nova converse format:
@@ -342,26 +131,27 @@ if __name__ == "__main__":
         default="../config.env",
         help="配置文件路径",
     )
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profiling(args, 'nova_ft_dataset_validator')
     
-    # 加载环境变量配置
-    if os.path.exists(args.config):
-        dotenv.load_dotenv(args.config)
-        
+    # 加载环境变量配置（配置文件不存在时只验证命令行指定的文件）
+    try:
+        settings = load_settings(args.config)
+    except FileNotFoundError:
+        pass
+    else:
         # 配置日志
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(os.path.join('..', os.getenv('VALIDATION_LOG', 'output/logs/nova_validation.log'))),
-                logging.StreamHandler()
-            ]
-        )
-        
-        # 如果未提供输入文件，则使用环境变量中的默认值
+        setup_logging(str(settings.validation_log), 'nova_ft_dataset_validator')
+
+        # 如果未提供输入文件，则使用配置中的默认值
         if not args.input_file:
-            bedrock_ft_dir = os.getenv('BEDROCK_FT_DIR', 'data/bedrock-ft')
-            args.input_file = os.path.join('..', bedrock_ft_dir, 'training_data.jsonl')
+            args.input_file = str(settings.bedrock_ft_dir / 'training_data.jsonl')
             logging.info(f"使用默认输入文件: {args.input_file}")
-    
-    validate_converse_dataset(args)
+
+    with stage('validate_dataset'):
+        validate_converse_dataset(args)
+
+
+if __name__ == "__main__":
+    main()
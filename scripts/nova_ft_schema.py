@@ -0,0 +1,182 @@
+"""
+Pydantic schema for Nova converse-format samples, split out of nova_ft_dataset_validator
+so that importing the validator (or printing its usage) does not pay for pydantic.
+Shared constants and exceptions come from nova_ft_common, never from the validator.
+"""
+
+from pydantic import BaseModel, ValidationInfo, field_validator, model_validator
+from typing import List, Optional
+
+from nova_ft_common import (
+    CONVERSE_ROLES_WITHOUT_SYSTEM,
+    IMAGE_FORMATS,
+    MAX_NUM_IMAGES,
+    VIDEO_FORMATS,
+    NovaInternalError,
+    check_roles_order,
+    is_valid_path,
+)
+
+
+class S3Location(BaseModel):
+    """Represents and validates an S3 URI location."""
+
+    uri: str
+
+    @field_validator("uri")
+    def validate_format(cls, uri):
+        """Validates that the URI starts with 's3://'."""
+        if not uri.startswith("s3://"):
+            raise ValueError(f"Invalid S3 URI, must start with 's3://'")
+        is_valid_path(uri.replace("s3://", ""))
+        return uri
+
+
+class Source(BaseModel):
+    """Defines the source location for media content."""
+
+    s3Location: S3Location
+
+
+class ImageContent(BaseModel):
+    """Represents and validates image content with format and source."""
+
+    format: str
+    source: Source
+
+    @field_validator("format")
+    def validate_format(cls, image_format):
+        """Validates that the image format is supported."""
+        if image_format.lower() not in IMAGE_FORMATS:
+            raise ValueError(f"Invalid image format, supported formats are {IMAGE_FORMATS}")
+        return image_format
+
+
+class VideoContent(BaseModel):
+    """Represents and validates video content with format and source."""
+
+    format: str
+    source: Source
+
+    @field_validator("format")
+    def validate_format(cls, video_format):
+        """Validates that the video format is supported."""
+        if video_format.lower() not in VIDEO_FORMATS:
+            raise ValueError(f"Invalid video format, supported formats are {VIDEO_FORMATS}")
+        return video_format
+
+
+class ContentItem(BaseModel):
+    """Represents a content item that can contain text, image, or video."""
+
+    text: Optional[str] = None
+    image: Optional[ImageContent] = None
+    video: Optional[VideoContent] = None
+
+    @model_validator(mode="after")
+    def validate_model_fields(cls, values):
+        """Validates that at least one content type is provided."""
+        if not any(getattr(values, field) is not None for field in cls.model_fields.keys()):
+            raise ValueError(
+                f"Invalid content, at least one of {list(cls.model_fields.keys())} must be provided"
+            )
+        return values
+
+
+class Message(BaseModel):
+    """Represents a conversation message with role and content."""
+
+    role: str
+    content: List[ContentItem]
+
+    @field_validator("role")
+    def validate_role(cls, role):
+        """Validates that the role is either user or assistant."""
+        if role.lower() not in CONVERSE_ROLES_WITHOUT_SYSTEM:
+            raise ValueError(
+                f"Invalid value for role, valid values are {CONVERSE_ROLES_WITHOUT_SYSTEM}"
+            )
+        return role
+
+    @model_validator(mode="after")
+    def validate_content_rules(cls, values):
+        """Validates content rules for assistant messages."""
+        content_items = values.content
+        has_video = any(item.video is not None for item in content_items)
+        has_image = any(item.image is not None for item in content_items)
+
+        if has_image or has_video:
+            if values.role.lower() == "assistant":
+                raise ValueError(
+                    "Invalid content, image/video cannot be included when role is 'assistant'"
+                )
+
+        return values
+
+    @field_validator("content")
+    def validate_content(cls, content, info: ValidationInfo):
+        """Validates message content against Nova's rules for text, images, and videos.
+        Ensures content follows size limits (max 10 images, 1 video), format restrictions,
+        and model-specific constraints (no media for micro models). Checks that text content
+        is not empty and media types don't mix (can't have both images and video).
+
+        Args:
+            content (List[ContentItem]): List of content items to validate
+            info (ValidationInfo): Validation context with model_name
+
+        Raises:
+            ValueError: If content violates Nova's rules
+            Exception: If validation context is missing
+        """
+        has_text = any(item.text is not None for item in content)
+        has_video = any(item.video is not None for item in content)
+        has_image = any(item.image is not None for item in content)
+
+        total_text_length = sum(len(item.text) for item in content if item.text is not None)
+        if has_text and not (has_image or has_video) and total_text_length == 0:
+            raise ValueError("Invalid content, empty text content")
+
+        if not info.context:
+            raise NovaInternalError("context is not set for validating model type")
+
+        is_micro_model = "micro" in info.context["model_name"]
+        if is_micro_model and (has_image or has_video):
+            raise ValueError(
+                "Invalid content, image/video samples not supported by Nova Micro model"
+            )
+
+        if sum(1 for item in content if item.video is not None) > 1:
+            raise ValueError("Only one video is allowed per sample")
+
+        if has_video and has_image:
+            raise ValueError(
+                "'content' list cannot contain both video items and image items for a given sample"
+            )
+
+        num_images = sum(1 for item in content if item.image is not None)
+        if num_images > MAX_NUM_IMAGES:
+            raise ValueError(
+                f"Invalid content, number of images {num_images} exceed maximum allowed limit of {MAX_NUM_IMAGES}"
+            )
+
+        return content
+
+
+class SystemMessage(BaseModel):
+    """Represents a system message with text content."""
+
+    text: str
+
+
+class ConverseDatasetSample(BaseModel):
+    """Represents a complete conversation sample with system message and message turns."""
+
+    schemaVersion: Optional[str] = None
+    system: Optional[List[SystemMessage]] = None
+    messages: List[Message]
+
+    @field_validator("messages")
+    def validate_data_sample_rules(cls, messages):
+        """Validates the order and structure of messages in the conversation."""
+        check_roles_order(messages)
+        return messages
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+调用已部署（预置吞吐量）的自定义Nova模型提取发票销售方
+构建与训练数据一致的Converse多模态请求，共享连接池并发流水线调用，支持流式响应，
+并统计延迟分位数（p50/p95/p99）和每秒token数
+"""
+
+import time
+import argparse
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import count, observe, setup_logging
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import get_client
+from image_scanner import IMAGE_EXTENSIONS, image_format_from_name
+from process_images_for_training import SYSTEM_PROMPT, USER_PROMPT
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='调用已部署的Nova自定义模型提取发票销售方')
+
+    parser.add_argument('--model-id', type=str, help='模型ID、自定义模型ARN或预置吞吐量ARN')
+    parser.add_argument('--images-dir', type=str, help='包含发票图像的目录')
+    parser.add_argument('--image', type=str, action='append', help='单个发票图像路径（可重复指定）')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+    parser.add_argument('--repeat', type=int, default=1, help='每张图像重复请求的次数（用于压测）')
+    parser.add_argument('--stream', action='store_true', help='使用流式响应（ConverseStream）')
+    parser.add_argument('--max-tokens', type=int, default=256, help='最大输出token数')
+    parser.add_argument('--region', type=str, help='AWS区域')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'model_id': settings.inference_model_id,
+        'images_dir': str(settings.test_images_dir),
+        'region': settings.aws_region,
+        'log_file': str(settings.log_path('nova_inference.log'))
+    }
+
+    return config
+
+def create_runtime_client(region, max_pool_connections=16):
+    """返回共享连接池的bedrock-runtime客户端（长连接、adaptive重试；boto3客户端本身是线程安全的）。"""
+    return get_client('bedrock-runtime', region_name=region, max_pool_connections=max_pool_connections,
+                      max_attempts=10, retry_mode='adaptive', tcp_keepalive=True)
+
+def build_seller_request(image_bytes=None, image_format='jpeg', s3_uri=None, bucket_owner=None,
+                         max_tokens=256):
+    """构建与训练数据相同提示词的Converse多模态请求（不含modelId）。"""
+    if s3_uri:
+        s3_location = {'uri': s3_uri}
+        if bucket_owner:
+            s3_location['bucketOwner'] = bucket_owner
+        source = {'s3Location': s3_location}
+    else:
+        source = {'bytes': image_bytes}
+
+    return {
+        'system': [{'text': SYSTEM_PROMPT}],
+        'messages': [{
+            'role': 'user',
+            'content': [
+                {'text': USER_PROMPT},
+                {'image': {'format': image_format, 'source': source}}
+            ]
+        }],
+        'inferenceConfig': {'maxTokens': max_tokens, 'temperature': 0.0}
+    }
+
+def percentile(sorted_values, fraction):
+    """对已排序的列表计算线性插值分位数。"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+class LatencyStats:
+    """线程安全的调用统计：延迟、首token延迟和token吞吐。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.first_token_latencies = []
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.errors = 0
+        self.started = time.monotonic()
+
+    def record(self, latency, input_tokens=0, output_tokens=0, first_token_latency=None):
+        with self.lock:
+            self.latencies.append(latency)
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            if first_token_latency is not None:
+                self.first_token_latencies.append(first_token_latency)
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def summary(self):
+        """返回统计摘要（延迟单位为秒）。"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            first_token = sorted(self.first_token_latencies)
+            elapsed = time.monotonic() - self.started
+            summary = {
+                'requests': len(latencies),
+                'errors': self.errors,
+                'elapsed_seconds': elapsed,
+                'requests_per_second': len(latencies) / elapsed if elapsed > 0 else 0.0,
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'input_tokens': self.input_tokens,
+                'output_tokens': self.output_tokens,
+                'output_tokens_per_second': self.output_tokens / elapsed if elapsed > 0 else 0.0
+            }
+            if first_token:
+                summary['first_token_p50'] = percentile(first_token, 0.50)
+                summary['first_token_p95'] = percentile(first_token, 0.95)
+            return summary
+
+class NovaInferenceClient:
+    """面向单个已部署模型的推理客户端，所有线程共享同一个连接池。"""
+
+    def __init__(self, model_id, region, max_concurrency=16, client=None):
+        self.model_id = model_id
+        self.max_concurrency = max_concurrency
+        self.client = client if client is not None else create_runtime_client(region, max_concurrency)
+        self.stats = LatencyStats()
+
+    def converse(self, request):
+        """同步调用Converse API，返回 (文本, 原始响应)。"""
+        start = time.monotonic()
+        try:
+            response = self.client.converse(modelId=self.model_id, **request)
+        except Exception:
+            self.stats.record_error()
+            count('bedrock.errors')
+            raise
+        usage = response.get('usage', {})
+        latency = time.monotonic() - start
+        self.stats.record(latency, usage.get('inputTokens', 0), usage.get('outputTokens', 0))
+        observe('bedrock.converse_seconds', latency)
+        content = response['output']['message']['content']
+        return ''.join(item.get('text', '') for item in content).strip(), response
+
+    def converse_stream(self, request):
+        """流式调用ConverseStream API，逐块返回文本。"""
+        start = time.monotonic()
+        first_token_latency = None
+        usage = {}
+        try:
+            response = self.client.converse_stream(modelId=self.model_id, **request)
+            for event in response['stream']:
+                if 'contentBlockDelta' in event:
+                    text = event['contentBlockDelta']['delta'].get('text', '')
+                    if text and first_token_latency is None:
+                        first_token_latency = time.monotonic() - start
+                    yield text
+                elif 'metadata' in event:
+                    usage = event['metadata'].get('usage', {})
+        except Exception:
+            self.stats.record_error()
+            raise
+        self.stats.record(time.monotonic() - start, usage.get('inputTokens', 0),
+                          usage.get('outputTokens', 0), first_token_latency)
+
+    def extract_seller(self, request, stream=False):
+        """提取单张发票的销售方名称。"""
+        if stream:
+            return ''.join(self.converse_stream(request)).strip()
+        return self.converse(request)[0]
+
+    def extract_many(self, requests, stream=False, concurrency=None):
+        """并发流水线调用，按输入顺序返回 (销售方名称, 错误) 列表。"""
+        def run(request):
+            try:
+                return self.extract_seller(request, stream), None
+            except Exception as e:
+                return None, str(e)
+
+        with ThreadPoolExecutor(max_workers=concurrency or self.max_concurrency) as executor:
+            return list(executor.map(run, requests))
+
+def collect_images(images_dir=None, image_paths=None):
+    """收集要推理的图像路径。"""
+    paths = [Path(p) for p in (image_paths or [])]
+    if images_dir:
+        paths.extend(sorted(p for p in Path(images_dir).iterdir()
+                            if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS))
+    return paths
+
+def main():
+    """批量调用已部署模型的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'nova_inference')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    model_id = args.model_id if args.model_id else config['model_id']
+    region = args.region if args.region else config['region']
+    images_dir = args.images_dir if args.images_dir or args.image else config['images_dir']
+
+    # 配置日志
+    setup_logging(config['log_file'], 'nova_inference')
+
+    if not model_id:
+        logging.error("未指定模型。请使用 --model-id 或在配置文件中设置 INFERENCE_MODEL_ID")
+        return False
+
+    image_paths = collect_images(images_dir, args.image)
+    if not image_paths:
+        logging.error("未找到要推理的图像")
+        return False
+
+    # 预先读取图像，避免磁盘IO占用调用并发
+    requests = []
+    for image_path in image_paths:
+        with open(image_path, 'rb') as f:
+            request = build_seller_request(f.read(), image_format_from_name(image_path.name),
+                                           max_tokens=args.max_tokens)
+        requests.extend([request] * args.repeat)
+
+    logging.info(f"模型: {model_id}，图像: {len(image_paths)}，请求: {len(requests)}，并发: {args.concurrency}")
+
+    client = NovaInferenceClient(model_id, region, args.concurrency)
+    results = client.extract_many(requests, stream=args.stream)
+
+    for i, (seller_name, error) in enumerate(results[::args.repeat]):
+        if error:
+            logging.error(f"{image_paths[i].name}: 调用失败: {error}")
+        else:
+            logging.info(f"{image_paths[i].name}: {seller_name}")
+
+    summary = client.stats.summary()
+    logging.info(f"请求数: {summary['requests']}，失败: {summary['errors']}，吞吐: {summary['requests_per_second']:.2f} 请求/秒")
+    if summary['requests']:
+        logging.info(f"延迟 p50/p95/p99: {summary['p50']:.3f}/{summary['p95']:.3f}/{summary['p99']:.3f} 秒")
+    logging.info(f"输出token吞吐: {summary['output_tokens_per_second']:.1f} tokens/秒")
+    if 'first_token_p50' in summary:
+        logging.info(f"首token延迟 p50/p95: {summary['first_token_p50']:.3f}/{summary['first_token_p95']:.3f} 秒")
+    return True
+
+if __name__ == "__main__":
+    main()
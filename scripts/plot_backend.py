@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+训练指标图表的渲染后端
+强制使用无界面的Agg后端、延迟导入matplotlib/numpy，对长序列降采样，并支持多进程并行渲染
+"""
+
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# 正式出图与快速出图的分辨率
+DEFAULT_DPI = 300
+FAST_DPI = 100
+
+# 指标文件的默认名称
+METRICS_FILE_NAME = 'step_wise_training_metrics.csv'
+
+def get_pyplot(show=False):
+    """延迟导入matplotlib.pyplot；不需要交互显示时强制使用Agg后端。"""
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    return plt
+
+def load_metrics_csv(metrics_file):
+    """使用csv模块读取指标文件，按列返回numpy数组（不依赖pandas）。"""
+    import numpy as np
+
+    columns = {}
+    with open(metrics_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [row for row in reader if row]
+
+    for i, name in enumerate(header):
+        values = [row[i] for row in rows]
+        try:
+            columns[name] = np.asarray(values, dtype=np.float64)
+        except ValueError:
+            columns[name] = np.asarray(values, dtype=object)
+
+    return columns
+
+def lttb_decimate(x, y, threshold):
+    """Largest-Triangle-Three-Buckets降采样，保留曲线的视觉形状。"""
+    import numpy as np
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold is None or threshold >= n or threshold < 3:
+        return x, y
+
+    # 首尾两点固定保留，中间的点均分为 threshold-2 个桶
+    every = (n - 2) / (threshold - 2)
+    bounds = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    bounds[-1] = n - 1
+
+    # 每个桶的平均点，用作上一个桶选点时的第三个顶点
+    counts = np.diff(bounds)
+    avg_x = np.add.reduceat(x[1:-1], bounds[:-1] - 1) / counts
+    avg_y = np.add.reduceat(y[1:-1], bounds[:-1] - 1) / counts
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y[i] - y[a])
+        )
+        a = start + int(np.nanargmax(area)) if not np.all(np.isnan(area)) else start
+        selected[i + 1] = a
+
+    return x[selected], y[selected]
+
+def minmax_decimate(x, y, n_buckets):
+    """按像素桶保留每个桶的最小值和最大值，适合需要保留尖峰的序列。"""
+    import numpy as np
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_buckets is None or n <= 2 * n_buckets:
+        return x, y
+
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        segment = y[start:end]
+        if np.all(np.isnan(segment)):
+            indices.append(start)
+            continue
+        lo = start + int(np.nanargmin(segment))
+        hi = start + int(np.nanargmax(segment))
+        indices.extend(sorted({lo, hi}))
+
+    indices = np.asarray(indices, dtype=np.int64)
+    return x[indices], y[indices]
+
+def decimate(x, y, max_points=None, method='lttb'):
+    """按指定方法把序列降采样到不超过max_points个点。"""
+    if not max_points or len(x) <= max_points:
+        return x, y
+    if method == 'minmax':
+        return minmax_decimate(x, y, max_points // 2)
+    return lttb_decimate(x, y, max_points)
+
+def save_figure(fig, output_path, fast=False):
+    """保存图表；快速模式下降低分辨率并跳过bbox_inches='tight'的二次布局计算。"""
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if fast:
+        fig.savefig(output_path, dpi=FAST_DPI)
+    else:
+        fig.savefig(output_path, dpi=DEFAULT_DPI, bbox_inches='tight')
+
+    # 在批量渲染时释放图形占用的内存
+    import matplotlib.pyplot as plt
+    plt.close(fig)
+    return output_path
+
+def find_metrics_files(runs_dir, file_name=METRICS_FILE_NAME):
+    """递归查找目录下所有作业输出的指标CSV文件。"""
+    found = []
+    for root, _, files in os.walk(runs_dir):
+        if file_name in files:
+            found.append(os.path.join(root, file_name))
+    return sorted(found)
+
+def render_parallel(render_fn, jobs, max_workers=None):
+    """使用进程池并行执行多个渲染任务。
+
+    render_fn 必须是模块级函数（可被pickle），jobs 为传给它的关键字参数字典列表。
+    返回 (成功结果列表, 失败列表[(任务, 错误)])。
+    """
+    results = []
+    failures = []
+    if not jobs:
+        return results, failures
+
+    if max_workers == 1 or len(jobs) == 1:
+        for job in jobs:
+            try:
+                results.append(render_fn(**job))
+            except Exception as e:
+                failures.append((job, e))
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(render_fn, **job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failures.append((futures[future], e))
+
+    return results, failures
+
+def render_runs(render_fn, runs_dir, output_dir=None, max_workers=None, label='图表', **options):
+    """为目录下每个作业的指标文件并行调用 render_fn，图表默认保存在各自的作业目录中。
+
+    options 原样传给 render_fn；返回 (成功结果列表, 失败列表[(任务, 错误)])。
+    """
+    jobs = []
+    for metrics_file in find_metrics_files(runs_dir):
+        run_dir = os.path.dirname(metrics_file)
+        if output_dir:
+            run_output_dir = os.path.join(output_dir, os.path.relpath(run_dir, runs_dir))
+        else:
+            run_output_dir = run_dir
+        jobs.append(dict(options, metrics_file=metrics_file, output_dir=run_output_dir))
+
+    if not jobs:
+        print(f"目录中未找到指标文件: {runs_dir}")
+        return [], []
+
+    results, failures = render_parallel(render_fn, jobs, max_workers=max_workers)
+    print(f"已为 {len(results)}/{len(jobs)} 个作业生成{label}")
+    for job, error in failures:
+        print(f"生成{label}失败 {job['metrics_file']}: {error}")
+    return results, failures
@@ -2,12 +2,31 @@
 import os
 import csv
 import json
-import boto3
 import argparse
 from pathlib import Path
 import logging
-import dotenv
 import sys
+from types import SimpleNamespace
+
+from instrumentation import ItemLogSampler, count, setup_logging, stage, timed
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import get_client
+from nova_ft_common import MAX_NUM_IMAGES, check_roles_order
+from run_journal import RunJournal, load_item_names
+from image_scanner import image_format_from_name, list_images
+from estimate_training_cost import (DEFAULT_IMAGE_SIZE, DIMENSIONS_CACHE_FILE, MESSAGE_OVERHEAD_TOKENS,
+                                    ImageDimensionCache, estimate_image_tokens, estimate_text_tokens)
+
+# 训练数据与推理请求共用的提示词
+SYSTEM_PROMPT = "You are a smart assistant that answers questions respectfully"
+USER_PROMPT = "这是一张发票图片。请识别并提取出销售方名称。只需要返回销售方名称，不要有其他文字。请确保提取的是销售方（开票方），而不是购买方（收票方）。"
+# 打包模式下同一对话中后续发票使用的简短指令（完整指令只在第一轮出现一次）
+PACKED_FOLLOW_UP_PROMPT = "这是另一张发票图片，请同样只返回销售方名称。"
+
+# 逐张图片的INFO日志按比例采样输出
+upload_log_sampler = ItemLogSampler('upload')
+training_data_log_sampler = ItemLogSampler('training_data')
 
 # 解析命令行参数
 def parse_arguments():
@@ -16,33 +35,42 @@ def parse_arguments():
     parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
     parser.add_argument('--train-only', action='store_true', help='仅处理训练数据')
     parser.add_argument('--test-only', action='store_true', help='仅处理测试数据')
+    parser.add_argument('--pack-token-budget', type=int,
+                        help='打包模式: 把训练集中的多张发票打包为一个多轮对话样本，每个样本不超过该token预算')
+    parser.add_argument('--pack-max-images', type=int, default=MAX_NUM_IMAGES,
+                        help=f'打包模式下每个样本最多包含的图像数（不超过{MAX_NUM_IMAGES}）')
+    parser.add_argument('--journal', action='store_true',
+                        help='记录预写日志（<输出JSONL>.journal），中断后再次运行时从中断处继续')
+    parser.add_argument('--restart', action='store_true', help='日志模式下丢弃已有日志，从头开始处理')
+    parser.add_argument('--retry-failed', action='store_true', help='日志模式下重试之前失败的全部条目')
+    parser.add_argument('--retry-from', type=str,
+                        help='日志模式下只重试该死信文件（或每行一个图片名称的文本文件）中的失败条目')
+    add_profile_arguments(parser)
     return parser.parse_args()
 
 # 加载环境变量
 def load_config(config_path):
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
+    settings = load_settings(config_path)
     
-    dotenv.load_dotenv(config_path)
-    
-    # 获取必要的环境变量
+    # 获取必要的配置
     config = {
-        'train_csv_path': os.path.join('..', os.getenv('TRAIN_LABEL_CSV', 'data/label_data/train_label.csv')),
-        'test_csv_path': os.path.join('..', os.getenv('TEST_LABEL_CSV', 'data/label_data/test_label.csv')),
-        'train_images_dir': os.path.join('..', os.getenv('TRAIN_IMAGES_DIR', 'data/images/train')),
-        'test_images_dir': os.path.join('..', os.getenv('TEST_IMAGES_DIR', 'data/images/test')),
-        's3_bucket': os.getenv('S3_BUCKET'),
-        's3_prefix': os.getenv('S3_PREFIX_IMAGES'),
-        'account_id': os.getenv('AWS_ACCOUNT_ID'),
-        'output_dir': os.path.join('..', os.getenv('BEDROCK_FT_DIR')),
-        'log_file': os.path.join('..', os.getenv('DATA_PREPARATION_LOG'))
+        'train_csv_path': str(settings.train_label_csv),
+        'test_csv_path': str(settings.test_label_csv),
+        'train_images_dir': str(settings.train_images_dir),
+        'test_images_dir': str(settings.test_images_dir),
+        's3_bucket': settings.s3_bucket,
+        's3_prefix': settings.s3_prefix_images,
+        'account_id': settings.aws_account_id,
+        'output_dir': str(settings.bedrock_ft_dir),
+        'cache_dir': str(settings.cache_dir),
+        'log_file': str(settings.data_preparation_log)
     }
     
     return config
 
 # 处理单个数据集（训练或测试）
-def process_dataset(csv_path, images_dir, output_jsonl, config, dataset_type="训练"):
-    """处理单个数据集（训练或测试）并创建JSONL文件。"""
+def process_dataset(csv_path, images_dir, output_jsonl, config, dataset_type="训练", packer=None):
+    """处理单个数据集（训练或测试）并创建JSONL文件；提供 packer 时把多张发票打包为多轮对话样本。"""
     # 检查CSV文件是否存在
     if not os.path.exists(csv_path):
         logging.error(f"{dataset_type}集CSV文件不存在: {csv_path}")
@@ -52,7 +80,8 @@ def process_dataset(csv_path, images_dir, output_jsonl, config, dataset_type="
             return True, 0, 0, 0  # 测试集可以不存在
     
     # 读取CSV数据
-    csv_data = read_csv_data(csv_path)
+    with stage('read_csv'):
+        csv_data = read_csv_data(csv_path)
     if not csv_data:
         logging.error(f"{dataset_type}集CSV文件中没有有效数据。")
         if dataset_type == "训练":
@@ -64,9 +93,34 @@ def process_dataset(csv_path, images_dir, output_jsonl, config, dataset_type="
     successful_entries = 0
     failed_entries = 0
     skipped_entries = 0
+    resumed_entries = 0
+    
+    # 一次列出图像目录，代替逐条检查文件是否存在（带子目录的名称再单独检查）
+    with stage('list_images'):
+        available_images = set(list_images(images_dir))
+    
+    # 日志模式: 回放日志，从中断处继续
+    journal = None
+    if config.get('journal'):
+        journal = RunJournal(output_jsonl, restart=config.get('restart', False))
+        if journal.states:
+            logging.info(f"{dataset_type}集: 从日志 {journal.path} 恢复 {len(journal.states)} 个条目的状态")
+    
+    def write_line(line, image_names):
+        """写出一行JSONL（日志模式下同时记录 serialized）。"""
+        with stage('write_jsonl'):
+            if journal is not None:
+                journal.write_output(line, image_names)
+            else:
+                jsonl_file.write(line)
+    
+    def record_failure(image_name, seller_name, reason):
+        """日志模式下记录失败条目及原因。"""
+        if journal is not None and image_name:
+            journal.record(image_name, 'failed', seller=seller_name, reason=reason)
     
     # 打开JSONL文件进行写入
-    with open(output_jsonl, 'w', encoding='utf-8') as jsonl_file:
+    with (journal.open_output() if journal is not None else open(output_jsonl, 'w', encoding='utf-8')) as jsonl_file:
         for entry in csv_data:
             try:
                 image_name = entry['图片名称']
@@ -76,43 +130,129 @@ def process_dataset(csv_path, images_dir, output_jsonl, config, dataset_type="
                 if not seller_name or len(seller_name.strip()) == 0 or '提取失败' in seller_name:
                     logging.warning(f"{dataset_type}集: 销售方名称无效: {image_name}。跳过。")
                     skipped_entries += 1
+                    count('items.skipped')
                     continue
-                    
+                
+                # 日志中已有记录的条目: 已写出的跳过，已上传的不再上传，失败的只在要求重试时处理
+                s3_uri = None
+                state = journal.state(image_name) if journal is not None else None
+                if state is not None:
+                    if state['state'] == 'serialized':
+                        resumed_entries += 1
+                        successful_entries += 1
+                        count('items.resumed')
+                        continue
+                    if state['state'] == 'failed' and not should_retry(image_name, config):
+                        failed_entries += 1
+                        count('items.failed')
+                        continue
+                    if state['state'] == 'uploaded' and state.get('s3_uri'):
+                        s3_uri = state['s3_uri']
+                        count('items.upload_reused')
+                
                 # 检查图像是否存在
                 image_path = os.path.join(images_dir, image_name)
-                if not os.path.exists(image_path):
+                if image_name not in available_images and not os.path.exists(image_path):
                     logging.warning(f"{dataset_type}集: 图像不存在: {image_path}")
+                    record_failure(image_name, seller_name, '图像不存在')
                     failed_entries += 1
+                    count('items.failed')
                     continue
                 
                 # 上传图像到S3
-                s3_uri = upload_image_to_s3(image_path, image_name, config)
-                if not s3_uri:
-                    failed_entries += 1
+                if s3_uri is None:
+                    with stage('upload_image'):
+                        s3_uri = upload_image_to_s3(image_path, image_name, config)
+                    if not s3_uri:
+                        record_failure(image_name, seller_name, '上传到S3失败')
+                        failed_entries += 1
+                        count('items.failed')
+                        continue
+                    if journal is not None:
+                        journal.record(image_name, 'uploaded', s3_uri=s3_uri, seller=seller_name)
+                
+                # 打包模式: 样本装满后才写出
+                if packer is not None:
+                    with stage('pack_training_data'):
+                        finished = packer.add(image_path, image_name, seller_name, s3_uri)
+                    for items in finished:
+                        written = write_packed_sample(items, config, write_line, record_failure)
+                        successful_entries += written
+                        failed_entries += len(items) - written
                     continue
                 
                 # 创建训练数据
-                training_data = create_training_data(image_name, seller_name, s3_uri, config)
+                with stage('create_training_data'):
+                    training_data = create_training_data(image_name, seller_name, s3_uri, config)
                 if training_data:
                     # 将训练数据作为单行写入JSONL文件
-                    jsonl_file.write(json.dumps(training_data, ensure_ascii=False) + '\n')
+                    write_line(json.dumps(training_data, ensure_ascii=False) + '\n', [image_name])
                     successful_entries += 1
+                    count('items.success')
                 else:
+                    record_failure(image_name, seller_name, '训练数据验证失败')
                     failed_entries += 1
+                    count('items.failed')
                     
             except Exception as e:
                 logging.error(f"{dataset_type}集: 处理条目时出错 {entry}: {e}")
+                record_failure(entry.get('图片名称'), entry.get('销售方'), str(e))
                 failed_entries += 1
+                count('items.failed')
+        
+        if packer is not None:
+            for items in packer.flush():
+                written = write_packed_sample(items, config, write_line, record_failure)
+                successful_entries += written
+                failed_entries += len(items) - written
+        
+        # 退出前让JSONL与日志落盘
+        if journal is not None:
+            journal.sync()
+    
+    if packer is not None and packer.samples:
+        saved = 1 - packer.packed_tokens / packer.unpacked_tokens if packer.unpacked_tokens else 0
+        logging.info(f"{dataset_type}集: 打包为 {packer.samples} 个样本（平均每个样本 "
+                     f"{(successful_entries - resumed_entries) / packer.samples:.1f} 张发票），估算每轮token {packer.packed_tokens:,}，"
+                     f"不打包时约 {packer.unpacked_tokens:,}（减少 {saved:.1%}）")
+    
+    if journal is not None:
+        journal.close()
+        dead_letters = journal.write_dead_letter()
+        if resumed_entries:
+            logging.info(f"{dataset_type}集: {resumed_entries} 个条目在之前的运行中已写出，已跳过")
+        if dead_letters:
+            logging.warning(f"{dataset_type}集: {dead_letters} 个失败条目已写入死信文件 {journal.dead_letter_path}，"
+                            f"可使用 --retry-failed 或 --retry-from 重试")
     
     logging.info(f"{dataset_type}集数据准备完成。")
     logging.info(f"{dataset_type}集: 成功: {successful_entries}, 失败: {failed_entries}, 跳过: {skipped_entries}")
     
     return True, successful_entries, failed_entries, skipped_entries
 
+def should_retry(image_name, config):
+    """日志中失败的条目是否需要在本次运行中重试。"""
+    return config.get('retry_failed', False) or image_name in config.get('retry_items', ())
+
+def write_packed_sample(items, config, write_line, record_failure):
+    """创建并写出一个打包样本，返回写入的发票数。"""
+    with stage('create_training_data'):
+        training_data = create_packed_training_data(items, config)
+    if not training_data:
+        for image_name, seller_name, _ in items:
+            record_failure(image_name, seller_name, '训练数据验证失败')
+        count('items.failed', len(items))
+        return 0
+    write_line(json.dumps(training_data, ensure_ascii=False) + '\n', [item[0] for item in items])
+    count('items.success', len(items))
+    count('samples.packed')
+    return len(items)
+
 # 主函数
 def main():
     # 解析命令行参数
     args = parse_arguments()
+    start_profiling(args, 'process_images_for_training')
     
     # 加载配置
     config = load_config(args.config)
@@ -120,17 +260,13 @@ def main():
     # 如果命令行提供了S3存储桶，则覆盖配置
     if args.s3_bucket:
         config['s3_bucket'] = args.s3_bucket
+    config['journal'] = args.journal or args.retry_failed or bool(args.retry_from)
+    config['restart'] = args.restart
+    config['retry_failed'] = args.retry_failed
+    config['retry_items'] = load_item_names(args.retry_from) if args.retry_from else set()
     
     # 配置日志
-    os.makedirs(os.path.dirname(config['log_file']), exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(config['log_file']),
-            logging.StreamHandler()
-        ]
-    )
+    setup_logging(config['log_file'], 'process_images_for_training')
     
     # 创建输出目录
     os.makedirs(config['output_dir'], exist_ok=True)
@@ -149,6 +285,14 @@ def main():
     logging.info(f"- 输出目录: {config['output_dir']}")
     logging.info(f"- 训练集输出JSONL: {train_output_jsonl}")
     logging.info(f"- 测试集输出JSONL: {test_output_jsonl}")
+    if config['journal']:
+        logging.info(f"- 预写日志: 开启{'（丢弃已有日志）' if config['restart'] else ''}")
+    
+    # 打包模式只用于训练集；测试集保持每张发票一个样本，供评估与验证损失使用
+    packer = None
+    if args.pack_token_budget:
+        packer = SamplePacker(args.pack_token_budget, args.pack_max_images, config['cache_dir'])
+        logging.info(f"- 打包模式: 每个样本不超过 {args.pack_token_budget} token、{packer.max_images} 张图像")
     
     # 处理训练集（除非指定只处理测试集）
     if not args.test_only:
@@ -158,7 +302,8 @@ def main():
             config['train_images_dir'], 
             train_output_jsonl, 
             config, 
-            "训练"
+            "训练",
+            packer
         )
         
         if not train_success:
@@ -214,15 +359,19 @@ def read_csv_data(csv_path):
 
 def upload_image_to_s3(image_path, image_name, config):
     """将图像上传到S3并返回S3 URI。"""
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     s3_key = f"{config['s3_prefix']}/{image_name}"
     
     try:
-        s3_client.upload_file(image_path, config['s3_bucket'], s3_key)
+        with timed('s3.upload_seconds'):
+            s3_client.upload_file(image_path, config['s3_bucket'], s3_key)
+        count('s3.uploads')
+        count('s3.upload_bytes', os.path.getsize(image_path))
         s3_uri = f"s3://{config['s3_bucket']}/{s3_key}"
-        logging.info(f"成功上传 {image_name} 到S3: {s3_uri}")
+        upload_log_sampler.info(f"成功上传 {image_name} 到S3: {s3_uri}")
         return s3_uri
     except Exception as e:
+        count('s3.upload_errors')
         logging.error(f"上传 {image_name} 到S3时出错: {e}")
         return None
 
@@ -244,37 +393,50 @@ def validate_training_data(training_data):
             logging.warning("训练数据中的消息缺失或无效")
             return False
         
-        # 检查用户消息
-        user_message = training_data.get('messages')[0]
-        if user_message.get('role') != 'user' or not user_message.get('content'):
-            logging.warning("训练数据中的用户消息无效")
-            return False
-        
-        # 检查用户消息中的图像
-        user_content = user_message.get('content', [])
-        has_image = False
-        for content_item in user_content:
-            if 'image' in content_item:
-                has_image = True
-                image_data = content_item.get('image', {})
-                if not image_data.get('format') or not image_data.get('source', {}).get('s3Location', {}).get('uri'):
-                    logging.warning("训练数据中的图像数据无效")
-                    return False
-        
-        if not has_image:
-            logging.warning("训练数据中的用户消息中未找到图像")
+        # 检查角色顺序（打包模式下一个样本包含多轮 user/assistant 对话）
+        messages = training_data.get('messages')
+        try:
+            check_roles_order([SimpleNamespace(role=message.get('role')) for message in messages])
+        except ValueError as e:
+            logging.warning(f"训练数据中的消息顺序无效: {e}")
             return False
         
-        # 检查助手消息
-        assistant_message = training_data.get('messages')[1]
-        if assistant_message.get('role') != 'assistant' or not assistant_message.get('content'):
-            logging.warning("训练数据中的助手消息无效")
-            return False
+        num_images = 0
+        for user_message, assistant_message in zip(messages[0::2], messages[1::2]):
+            # 检查用户消息
+            if not user_message.get('content'):
+                logging.warning("训练数据中的用户消息无效")
+                return False
+            
+            # 检查用户消息中的图像
+            user_content = user_message.get('content', [])
+            has_image = False
+            for content_item in user_content:
+                if 'image' in content_item:
+                    has_image = True
+                    num_images += 1
+                    image_data = content_item.get('image', {})
+                    if not image_data.get('format') or not image_data.get('source', {}).get('s3Location', {}).get('uri'):
+                        logging.warning("训练数据中的图像数据无效")
+                        return False
+            
+            if not has_image:
+                logging.warning("训练数据中的用户消息中未找到图像")
+                return False
+            
+            # 检查助手消息
+            if not assistant_message.get('content'):
+                logging.warning("训练数据中的助手消息无效")
+                return False
+            
+            # 检查助手响应
+            assistant_content = assistant_message.get('content', [])
+            if len(assistant_content) == 0 or not assistant_content[0].get('text'):
+                logging.warning("训练数据中的助手响应无效")
+                return False
         
-        # 检查助手响应
-        assistant_content = assistant_message.get('content', [])
-        if len(assistant_content) == 0 or not assistant_content[0].get('text'):
-            logging.warning("训练数据中的助手响应无效")
+        if num_images > MAX_NUM_IMAGES:
+            logging.warning(f"训练数据中的图像数 {num_images} 超过上限 {MAX_NUM_IMAGES}")
             return False
         
         return True
@@ -285,18 +447,17 @@ def validate_training_data(training_data):
 
 def create_training_data(image_name, seller_name, s3_uri, config):
     """为Nova微调创建训练数据对象。"""
-    # 获取文件扩展名
-    file_format = image_name.split('.')[-1].lower()
+    file_format = image_format_from_name(image_name)
     
     training_data = {
         "schemaVersion": "bedrock-conversation-2024",
         "system": [{
-            "text": "You are a smart assistant that answers questions respectfully"
+            "text": SYSTEM_PROMPT
         }],
         "messages": [{
                 "role": "user",
                 "content": [{
-                        "text": "这是一张发票图片。请识别并提取出销售方名称。只需要返回销售方名称，不要有其他文字。请确保提取的是销售方（开票方），而不是购买方（收票方）。"
+                        "text": USER_PROMPT
                     },
                     {
                         "image": {
@@ -321,12 +482,112 @@ def create_training_data(image_name, seller_name, s3_uri, config):
     }
     
     # 验证创建的训练数据
-    if validate_training_data(training_data):
-        logging.info(f"已创建并验证 {image_name} 的训练数据")
+    with timed('validation_seconds'):
+        valid = validate_training_data(training_data)
+    if valid:
+        training_data_log_sampler.info(f"已创建并验证 {image_name} 的训练数据")
         return training_data
     else:
         logging.error(f"已创建但验证失败的训练数据: {image_name}")
         return None
 
+class SamplePacker:
+    """打包模式: 按token预算把多张发票组合为一个多轮对话样本。
+
+    系统提示词与完整指令每个样本只出现一次，后续发票使用简短指令；
+    消息严格按 user/assistant 交替，满足 check_roles_order，每个样本最多 MAX_NUM_IMAGES 张图像。
+    """
+
+    def __init__(self, token_budget, max_images=MAX_NUM_IMAGES, cache_dir=None):
+        self.token_budget = token_budget
+        self.max_images = max(1, min(max_images, MAX_NUM_IMAGES))
+        self.dimensions = ImageDimensionCache(os.path.join(cache_dir, DIMENSIONS_CACHE_FILE) if cache_dir else None)
+        self.system_tokens = estimate_text_tokens(SYSTEM_PROMPT)
+        self.first_turn_tokens = estimate_text_tokens(USER_PROMPT) + 2 * MESSAGE_OVERHEAD_TOKENS
+        self.follow_up_turn_tokens = estimate_text_tokens(PACKED_FOLLOW_UP_PROMPT) + 2 * MESSAGE_OVERHEAD_TOKENS
+        self.items = []
+        self.tokens = 0
+        self.samples = 0
+        self.packed_tokens = 0
+        self.unpacked_tokens = 0
+
+    def add(self, image_path, image_name, seller_name, s3_uri):
+        """加入一张发票，返回已装满的样本（每个样本为 (图像名, 销售方, S3 URI) 列表）。"""
+        size = self.dimensions.lookup(image_path)
+        item_tokens = estimate_image_tokens(*(size or DEFAULT_IMAGE_SIZE)) + estimate_text_tokens(seller_name)
+        self.unpacked_tokens += self.system_tokens + self.first_turn_tokens + item_tokens
+
+        finished = []
+        if self.items and (len(self.items) >= self.max_images
+                           or self.tokens + self.follow_up_turn_tokens + item_tokens > self.token_budget):
+            finished.append(self.close_sample())
+        if self.items:
+            self.tokens += self.follow_up_turn_tokens + item_tokens
+        else:
+            # 单张发票超过预算时仍单独成为一个样本
+            self.tokens = self.system_tokens + self.first_turn_tokens + item_tokens
+        self.items.append((image_name, seller_name, s3_uri))
+        return finished
+
+    def close_sample(self):
+        items = self.items
+        self.samples += 1
+        self.packed_tokens += self.tokens
+        self.items = []
+        self.tokens = 0
+        return items
+
+    def flush(self):
+        """返回尚未装满的最后一个样本，并保存图像尺寸缓存。"""
+        self.dimensions.save()
+        return [self.close_sample()] if self.items else []
+
+def create_packed_training_data(items, config):
+    """把多张发票创建为一个多轮对话训练数据对象。"""
+    messages = []
+    for index, (image_name, seller_name, s3_uri) in enumerate(items):
+        messages.append({
+            "role": "user",
+            "content": [{
+                    "text": USER_PROMPT if index == 0 else PACKED_FOLLOW_UP_PROMPT
+                },
+                {
+                    "image": {
+                        "format": image_format_from_name(image_name),
+                        "source": {
+                            "s3Location": {
+                                "uri": s3_uri,
+                                "bucketOwner": config['account_id']
+                            }
+                        }
+                    }
+                }
+            ]
+        })
+        messages.append({
+            "role": "assistant",
+            "content": [{
+                "text": seller_name
+            }]
+        })
+    
+    training_data = {
+        "schemaVersion": "bedrock-conversation-2024",
+        "system": [{
+            "text": SYSTEM_PROMPT
+        }],
+        "messages": messages
+    }
+    
+    # 验证创建的训练数据
+    with timed('validation_seconds'):
+        valid = validate_training_data(training_data)
+    if valid:
+        training_data_log_sampler.info(f"已创建并验证 {len(items)} 张发票的打包训练数据")
+        return training_data
+    else:
+        logging.error(f"已创建但验证失败的打包训练数据: {[item[0] for item in items]}")
+        return None
+
 if __name__ == "__main__":
     main()
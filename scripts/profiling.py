@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+各入口脚本共用的 --profile 性能分析
+开启后在一次运行中同时记录:
+- cProfile 统计（.pstats 原始数据与按累计/自身耗时排序的文本报告，只覆盖主线程）
+- tracemalloc 内存分配热点与峰值
+- instrumentation.stage 记录的各阶段墙钟/CPU时间
+- 定时（SIGALRM）采样所有线程的调用栈，导出火焰图工具（flamegraph.pl、speedscope 等）可直接读取的折叠栈格式
+结果写入 PROFILE_DIR/<脚本名>-<时间戳>/，生产运行时加上 --profile 即可直接定位性能回退。
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import atexit
+import pstats
+import signal
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+from instrumentation import metrics
+from settings import repo_path
+
+# tracemalloc 为每次分配保存的调用栈深度（越深开销越大）
+TRACEMALLOC_FRAMES = 10
+
+# 文本报告中列出的条目数
+REPORT_TOP = 40
+
+def add_profile_arguments(parser):
+    """为入口脚本的参数解析器添加性能分析选项。"""
+    parser.add_argument('--profile', action='store_true',
+                        help='记录cProfile、tracemalloc、分阶段耗时和折叠调用栈，输出到性能分析目录')
+    parser.add_argument('--profile-dir', type=str, help='性能分析输出目录（默认为配置中的 PROFILE_DIR）')
+    parser.add_argument('--profile-interval', type=float, default=0.005, help='调用栈采样间隔（秒）')
+
+def frame_label(frame):
+    """折叠栈中单个栈帧的名称。"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """定时采样所有线程的调用栈，按折叠栈累计次数。
+
+    在主线程中用 SIGALRM 定时器采样：Python 3.12 起 cProfile 基于全局的 sys.monitoring，
+    额外的采样线程会混入 cProfile 的统计，而信号处理函数总在主线程上执行，不会打乱统计。
+    不支持 setitimer 的平台（或不在主线程中启动时）不采集调用栈。
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.previous_handler = None
+        self.enabled = hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+
+    def sample(self, signum, frame):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        main_id = threading.main_thread().ident
+        for thread_id, thread_frame in sys._current_frames().items():
+            # 主线程当前的栈帧就是本处理函数，使用被信号中断的栈帧
+            current = frame if thread_id == main_id else thread_frame
+            stack = []
+            while current is not None:
+                stack.append(frame_label(current))
+                current = current.f_back
+            if not stack:
+                continue
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def start(self):
+        if self.enabled:
+            self.previous_handler = signal.signal(signal.SIGALRM, self.sample)
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self):
+        if self.enabled:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous_handler or signal.SIG_DFL)
+
+    def write_collapsed(self, path):
+        """写出 “帧1;帧2;...;帧N 次数” 格式的折叠栈。"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, hits in sorted(self.counts.items(), key=lambda item: item[1], reverse=True):
+                f.write(f"{stack} {hits}\n")
+
+class Profiler:
+    """一次运行的性能分析会话。"""
+
+    def __init__(self, run_name, profile_dir=None, interval=0.005):
+        self.run_name = run_name
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(interval)
+        self.started = False
+
+    def start(self):
+        self.start_time = datetime.now()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.sampler.start()
+        self.profile.enable()
+        self.started = True
+        return self
+
+    def output_dir(self):
+        """输出目录在结束时才确定，此时配置文件已加载，可以读取 PROFILE_DIR。"""
+        base = self.profile_dir or repo_path(os.getenv('PROFILE_DIR', 'output/profiles'))
+        return os.path.join(base, f"{self.run_name}-{self.start_time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+    def stop(self):
+        """停止采集并写出全部报告，返回输出目录。"""
+        if not self.started:
+            return None
+        self.started = False
+        self.profile.disable()
+        wall_seconds = time.perf_counter() - self.start_wall
+        cpu_seconds = time.process_time() - self.start_cpu
+        self.sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        output_dir = self.output_dir()
+        os.makedirs(output_dir, exist_ok=True)
+
+        # cProfile: 原始数据可用 snakeviz / pstats 打开
+        self.profile.dump_stats(os.path.join(output_dir, 'cprofile.pstats'))
+        with open(os.path.join(output_dir, 'cprofile.txt'), 'w', encoding='utf-8') as f:
+            for sort_key in ('cumulative', 'tottime'):
+                buffer = io.StringIO()
+                pstats.Stats(self.profile, stream=buffer).strip_dirs().sort_stats(sort_key).print_stats(REPORT_TOP)
+                f.write(f"===== 按 {sort_key} 排序 =====\n{buffer.getvalue()}\n")
+
+        # tracemalloc: 按代码行和按调用栈的分配热点
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+        with open(os.path.join(output_dir, 'tracemalloc.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"当前已分配: {current / 1e6:.2f} MB，峰值: {peak / 1e6:.2f} MB\n\n")
+            f.write("===== 按代码行 =====\n")
+            for stat in snapshot.statistics('lineno')[:REPORT_TOP]:
+                f.write(f"{stat}\n")
+            f.write("\n===== 按调用栈（前10） =====\n")
+            for stat in snapshot.statistics('traceback')[:10]:
+                f.write(f"{stat.size / 1e6:.2f} MB，{stat.count} 个块\n")
+                for line in stat.traceback.format():
+                    f.write(f"{line}\n")
+                f.write("\n")
+
+        # 火焰图: flamegraph.pl stacks.collapsed > flame.svg，或直接拖入 speedscope
+        self.sampler.write_collapsed(os.path.join(output_dir, 'stacks.collapsed'))
+
+        summary = metrics.summary(self.run_name)
+        with open(os.path.join(output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'run': self.run_name,
+                'argv': sys.argv,
+                'wall_seconds': wall_seconds,
+                'cpu_seconds': cpu_seconds,
+                'tracemalloc_peak_mb': peak / 1e6,
+                'stack_samples': self.sampler.samples,
+                'sample_interval': self.interval,
+                'stages': summary['stages'],
+                'counters': summary['counters'],
+                'histograms': summary['histograms']
+            }, f, ensure_ascii=False, indent=2)
+
+        return output_dir
+
+def start_profiling(args, run_name):
+    """args.profile 为真时开始性能分析，并在进程退出时写出报告；否则返回None。"""
+    if not getattr(args, 'profile', False):
+        return None
+    profiler = Profiler(run_name, getattr(args, 'profile_dir', None), getattr(args, 'profile_interval', 0.005))
+
+    def finish():
+        output_dir = profiler.stop()
+        if output_dir:
+            print(f"性能分析结果已写入: {output_dir}", file=sys.stderr)
+
+    atexit.register(finish)
+    return profiler.start()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+多区域的Bedrock请求路由
+- 从模型目录（<region>-models.json）中找出可以按需调用某个模型的区域
+- 每个区域一个客户端（连接池大小等于该区域的并发上限），并发上限近似该区域的配额，
+  总并发为各区域并发之和
+- 按观测到的延迟和限流率（指数滑动平均）为区域加权，把请求分给 权重/(在途请求数+1) 最大的区域
+- 每个区域的有效并发按 AIMD 调整: 成功时缓慢增加到上限，限流时按比例减小；请求换到其他区域重试
+- 连续失败（限流或服务端错误）达到阈值的区域视为降级，按连续失败次数指数退避冷却，期间不再分配请求；
+  无权访问或模型不存在的区域在本次运行中停用
+"""
+
+import time
+import random
+import logging
+import threading
+
+from instrumentation import count, observe
+from aws_clients import get_client
+from model_catalog import load_catalog
+
+# 触发换区域重试的错误码
+THROTTLE_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException',
+                  'ModelNotReadyException'}
+SERVER_ERROR_CODES = {'InternalServerException', 'ServiceUnavailableException', 'ModelTimeoutException'}
+# 区域本身不可用（未开通模型访问、模型不存在等），本次运行中停用该区域
+REGION_UNAVAILABLE_CODES = {'AccessDeniedException', 'ResourceNotFoundException', 'UnrecognizedClientException'}
+
+EWMA_ALPHA = 0.2
+# 尚无观测时假定的延迟（秒）
+INITIAL_LATENCY = 1.0
+# 限流时有效并发乘以该系数
+THROTTLE_BACKOFF = 0.7
+# 连续失败达到该次数后区域进入冷却，冷却时间: BASE * 2^(连续失败次数-阈值)，不超过 MAX
+DEGRADED_AFTER_FAILURES = 3
+BASE_COOLDOWN_SECONDS = 0.5
+MAX_COOLDOWN_SECONDS = 30.0
+# 换区域重试前的随机等待上限: BASE * 2^(尝试次数-1)（full jitter）
+BASE_RETRY_DELAY_SECONDS = 0.05
+DEFAULT_REGION_CONCURRENCY = 4
+DEFAULT_MAX_ATTEMPTS = 8
+
+def error_code(error):
+    """botocore ClientError 的错误码，其他异常返回 None。"""
+    response = getattr(error, 'response', None)
+    return response.get('Error', {}).get('Code') if isinstance(response, dict) else None
+
+def classify_error(error):
+    """把异常归类为 throttle / error / unavailable / fatal（只有 fatal 不换区域重试）。"""
+    code = error_code(error)
+    if code in THROTTLE_CODES:
+        return 'throttle'
+    if code in REGION_UNAVAILABLE_CODES:
+        return 'unavailable'
+    if code in SERVER_ERROR_CODES:
+        return 'error'
+    # 连接错误、读取超时等没有错误码的 botocore / urllib3 异常
+    if code is None and type(error).__module__.split('.')[0] in ('botocore', 'urllib3'):
+        return 'error'
+    return 'fatal'
+
+def parse_region_specs(specs, default_concurrency=DEFAULT_REGION_CONCURRENCY):
+    """解析 ["us-east-1=8", "us-west-2"] 形式的区域列表，返回 {区域: 并发上限}。"""
+    regions = {}
+    for spec in specs:
+        region, _, concurrency = spec.partition('=')
+        regions[region.strip()] = int(concurrency) if concurrency else default_concurrency
+    return regions
+
+def discover_regions(model_id, catalog_dir, cache_dir=None, fallback_region=None):
+    """从模型目录中找出可按需调用 model_id 的区域；目录缺失或没有匹配时返回 [fallback_region]。"""
+    try:
+        catalog = load_catalog(catalog_dir, cache_dir)
+    except FileNotFoundError as e:
+        logging.warning(f"未找到模型目录，只使用区域 {fallback_region}: {e}")
+        return [fallback_region]
+    regions = catalog.regions_for(model_id, include_legacy=True, inference_type='ON_DEMAND')
+    if not regions:
+        logging.warning(f"模型目录中没有可按需调用 {model_id} 的区域，只使用区域 {fallback_region}")
+        return [fallback_region]
+    return regions
+
+class RegionState:
+    """单个区域的客户端与运行状况。"""
+
+    def __init__(self, region, client, max_in_flight):
+        self.region = region
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.limit = float(max_in_flight)
+        self.in_flight = 0
+        self.latency = None
+        self.throttle_rate = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self.requests = 0
+        self.throttles = 0
+        self.errors = 0
+
+    def weight(self):
+        """每个并发槽位的期望成功吞吐: (1 - 限流率) / 延迟。"""
+        return (1.0 - self.throttle_rate) / (self.latency or INITIAL_LATENCY)
+
+    def has_slot(self, now):
+        return not self.disabled and self.cooldown_until <= now and self.in_flight < max(1, int(self.limit))
+
+    def record_success(self, latency):
+        self.latency = latency if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+        self.throttle_rate *= 1 - EWMA_ALPHA
+        self.limit = min(self.max_in_flight, self.limit + 1 / self.limit)
+        self.consecutive_failures = 0
+
+    def record_failure(self, throttled, now):
+        if throttled:
+            self.throttle_rate = (1 - EWMA_ALPHA) * self.throttle_rate + EWMA_ALPHA
+            self.limit = max(1.0, self.limit * THROTTLE_BACKOFF)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= DEGRADED_AFTER_FAILURES:
+            exponent = self.consecutive_failures - DEGRADED_AFTER_FAILURES
+            self.cooldown_until = now + min(MAX_COOLDOWN_SECONDS, BASE_COOLDOWN_SECONDS * 2 ** exponent)
+
+class RegionRouter:
+    """把同一服务的请求分散到多个区域，并在区域降级时故障转移。"""
+
+    def __init__(self, regions, service_name='bedrock-runtime', max_attempts=DEFAULT_MAX_ATTEMPTS, client_factory=None):
+        """regions 为 {区域: 并发上限}；client_factory(区域, 并发上限) 默认返回缓存的 boto3 客户端。"""
+        if not regions:
+            raise ValueError("至少需要一个区域")
+        client_factory = client_factory or (
+            lambda region, concurrency: get_client(service_name, region_name=region,
+                                                   max_pool_connections=concurrency, max_attempts=1))
+        self.states = [RegionState(region, client_factory(region, concurrency), concurrency)
+                       for region, concurrency in regions.items()]
+        self.max_attempts = max_attempts
+        self.condition = threading.Condition()
+
+    @property
+    def capacity(self):
+        """所有区域的并发上限之和。"""
+        return sum(state.max_in_flight for state in self.states)
+
+    def acquire(self, avoid=()):
+        """选出一个区域并占用一个并发槽位；所有可用区域都已满或在冷却中时等待。"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                enabled = [state for state in self.states if not state.disabled]
+                if not enabled:
+                    raise RuntimeError("所有区域都不可用")
+                ready = [state for state in enabled if state.has_slot(now)]
+                # 尽量避开本请求已经失败过的区域
+                preferred = [state for state in ready if state.region not in avoid] or ready
+                if preferred:
+                    state = max(preferred, key=lambda s: s.weight() / (s.in_flight + 1))
+                    state.in_flight += 1
+                    state.requests += 1
+                    return state
+                cooling = [state.cooldown_until - now for state in enabled if state.cooldown_until > now]
+                self.condition.wait(timeout=min(cooling) if cooling else None)
+
+    def release(self, state, latency, outcome):
+        """释放槽位并按结果（ok / throttle / error / unavailable / fatal）更新区域状况。"""
+        with self.condition:
+            state.in_flight -= 1
+            if outcome == 'ok':
+                state.record_success(latency)
+            elif outcome in ('throttle', 'error'):
+                state.record_failure(outcome == 'throttle', time.monotonic())
+                if outcome == 'throttle':
+                    state.throttles += 1
+                else:
+                    state.errors += 1
+            elif outcome == 'unavailable':
+                state.disabled = True
+                state.errors += 1
+            self.condition.notify_all()
+        count(f"router.{state.region}.{outcome}")
+        if outcome == 'ok':
+            observe(f"router.{state.region}.latency_seconds", latency)
+        elif outcome == 'unavailable':
+            logging.warning(f"区域 {state.region} 不可用，本次运行中停用")
+
+    def call(self, operation):
+        """在选出的区域上执行 operation(client)；限流或区域故障时换区域重试，其他错误直接抛出。"""
+        tried = set()
+        for attempt in range(1, self.max_attempts + 1):
+            state = self.acquire(tried)
+            start = time.monotonic()
+            try:
+                result = operation(state.client)
+            except Exception as e:
+                outcome = classify_error(e)
+                self.release(state, time.monotonic() - start, outcome)
+                if outcome == 'fatal' or attempt == self.max_attempts:
+                    raise
+                tried.add(state.region)
+                count('router.failovers')
+                time.sleep(random.uniform(0, BASE_RETRY_DELAY_SECONDS * 2 ** (attempt - 1)))
+                continue
+            self.release(state, time.monotonic() - start, 'ok')
+            return result
+
+    def summary(self):
+        """各区域的请求数、限流数、错误数、平均延迟与当前权重。"""
+        with self.condition:
+            return {state.region: {'requests': state.requests, 'throttles': state.throttles, 'errors': state.errors,
+                                   'latency_ms': (state.latency or 0) * 1000, 'throttle_rate': state.throttle_rate,
+                                   'concurrency': state.limit,
+                                   'weight': state.weight(), 'disabled': state.disabled}
+                    for state in self.states}
+
+    def log_summary(self, logger=None):
+        logger = logger or logging.getLogger()
+        for region, stats in self.summary().items():
+            logger.info(f"区域 {region}: 请求 {stats['requests']}，限流 {stats['throttles']}，错误 {stats['errors']}，"
+                        f"延迟 {stats['latency_ms']:.0f} ms，限流率 {stats['throttle_rate']:.2f}，有效并发 {stats['concurrency']:.1f}"
+                        f"{'，已停用' if stats['disabled'] else ''}")
@@ -12,6 +12,9 @@ fi
 
 source "$CONFIG_FILE"
 
+# 校验配置（变量展开、类型与取值），出错时在执行任何步骤之前退出
+python3 settings.py --config "$CONFIG_FILE" --check || exit 1
+
 # 设置日志文件
 LOG_FILE="../${PIPELINE_LOG}"
 TIMESTAMP=$(date +"%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+数据准备的预写日志（journal）与断点续跑
+- 每个条目的状态变化（uploaded / serialized / failed）以JSON行追加到日志文件，按条数或时间批量 fsync
+- fsync 日志之前先 fsync 输出的JSONL，日志中记录的 serialized 条目在JSONL中一定已经落盘
+- 重新运行时回放日志得到每个条目的最新状态，把JSONL截断到最后一个已记录的偏移量后继续追加：
+  已写出的条目直接跳过，已上传的条目不再重复上传，失败的条目默认不重试
+- 失败的条目写入死信文件（JSON行，含失败原因），可以编辑后用 --retry-from 只重试其中的条目
+"""
+
+import os
+import json
+import time
+import logging
+
+from instrumentation import observe
+
+JOURNAL_SUFFIX = '.journal'
+DEAD_LETTER_SUFFIX = '.dead_letter.jsonl'
+STATES = ('uploaded', 'serialized', 'failed')
+# 状态变化时沿用上一条记录中的这些字段: 退回 uploaded 的条目仍能直接用它们重新写出
+CARRIED_FIELDS = ('s3_uri', 'seller')
+
+# 累计多少条记录或多长时间（秒）后 fsync 一次
+DEFAULT_SYNC_EVERY = 64
+DEFAULT_SYNC_INTERVAL = 1.0
+
+def replay_journal(path):
+    """回放日志，返回 ({条目: 最新记录}, 已落盘的JSONL偏移量)。
+
+    最后一行不完整（写入时进程中断）时忽略该行。
+    """
+    states = {}
+    offset = 0
+    if not os.path.exists(path):
+        return states, offset
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    for line_number, line in enumerate(lines, 1):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if line_number < len(lines):
+                logging.warning(f"日志 {path} 第 {line_number} 行损坏，已忽略")
+            continue
+        states[record['item']] = record
+        if record['state'] == 'serialized':
+            offset = max(offset, record.get('offset', 0))
+    return states, offset
+
+def load_item_names(path):
+    """读取死信文件（或每行一个名称的文本文件）中的条目名称。"""
+    names = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            names.add(json.loads(line)['item'] if line.startswith('{') else line)
+    return names
+
+class RunJournal:
+    """一个输出JSONL对应的预写日志。"""
+
+    def __init__(self, output_path, restart=False, sync_every=DEFAULT_SYNC_EVERY, sync_interval=DEFAULT_SYNC_INTERVAL):
+        self.output_path = output_path
+        self.path = output_path + JOURNAL_SUFFIX
+        self.dead_letter_path = output_path + DEAD_LETTER_SUFFIX
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        if restart and os.path.exists(self.path):
+            os.remove(self.path)
+        self.states, self.output_offset = replay_journal(self.path)
+        self.output_file = None
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def open_output(self):
+        """把JSONL截断到日志记录的偏移量并以追加方式打开。
+
+        JSONL比日志记录的更短（被删除或覆盖）时，已写出的条目退回 uploaded 状态重新写出；
+        旧日志中没有 S3 URI 的 serialized 记录无法直接重新写出，清除其状态，按新条目重新处理。
+        """
+        size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+        if size < self.output_offset:
+            logging.warning(f"{self.output_path} 比日志记录的短（{size} < {self.output_offset} 字节），重新写出全部条目")
+            for item, record in list(self.states.items()):
+                if record['state'] != 'serialized':
+                    continue
+                if record.get('s3_uri'):
+                    record['state'] = 'uploaded'
+                else:
+                    del self.states[item]
+            self.output_offset = 0
+        with open(self.output_path, 'a', encoding='utf-8') as f:
+            f.truncate(self.output_offset)
+        self.output_file = open(self.output_path, 'a', encoding='utf-8')
+        return self.output_file
+
+    def state(self, item):
+        """条目的最新记录，没有记录时返回 None。"""
+        return self.states.get(item)
+
+    def record(self, item, state, **fields):
+        """追加一条状态记录，按批次 fsync；未指定的 CARRIED_FIELDS 沿用该条目上一条记录中的值。"""
+        record = {'item': item, 'state': state, 'ts': round(time.time(), 3)}
+        previous = self.states.get(item)
+        if previous is not None:
+            record.update((field, previous[field]) for field in CARRIED_FIELDS if field in previous)
+        record.update(fields)
+        self.states[item] = record
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.pending += 1
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def write_output(self, line, items):
+        """把一行写入JSONL，并为其中的条目记录 serialized 与写入后的偏移量。"""
+        self.output_file.write(line)
+        self.output_offset += len(line.encode('utf-8'))
+        for item in items:
+            self.record(item, 'serialized', offset=self.output_offset)
+
+    def sync(self):
+        """先让JSONL落盘，再让日志落盘。"""
+        start = time.perf_counter()
+        if self.output_file is not None and not self.output_file.closed:
+            self.output_file.flush()
+            os.fsync(self.output_file.fileno())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        observe('journal.fsync_seconds', time.perf_counter() - start)
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def failed_records(self):
+        return [record for record in self.states.values() if record['state'] == 'failed']
+
+    def write_dead_letter(self):
+        """把当前处于 failed 状态的条目写入死信文件（没有失败条目时删除旧文件），返回条目数。"""
+        failed = self.failed_records()
+        if not failed:
+            if os.path.exists(self.dead_letter_path):
+                os.remove(self.dead_letter_path)
+            return 0
+        tmp_path = self.dead_letter_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in failed:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.dead_letter_path)
+        return len(failed)
+
+    def close(self):
+        self.sync()
+        self.file.close()
+        if self.output_file is not None:
+            self.output_file.close()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+发票销售方提取的本地HTTP微服务（基于asyncio标准库）
+接收发票图像并返回销售方名称：图像预处理、按图像哈希的内存LRU结果缓存、
+对后端（已部署的Bedrock模型或本地桩）微批处理与准入控制，并提供健康检查和指标接口
+
+接口:
+  POST /extract   请求体为原始图像字节（或JSON {"image": "<base64>"}），返回 {"seller_name": ...}
+  GET  /health    健康检查
+  GET  /metrics   服务指标（JSON）
+"""
+
+import os
+import io
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import setup_logging
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from nova_inference import LatencyStats, build_seller_request, percentile
+
+MAX_BODY_BYTES = 20 * 1024 * 1024
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='发票销售方提取HTTP微服务')
+
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8080, help='监听端口')
+    parser.add_argument('--backend', type=str, choices=['bedrock', 'stub'], default='bedrock', help='模型后端')
+    parser.add_argument('--model-id', type=str, help='模型ID或预置吞吐量ARN')
+    parser.add_argument('--region', type=str, help='AWS区域')
+    parser.add_argument('--stub-latency', type=float, default=0.5, help='本地桩每批次的模拟延迟（秒）')
+    parser.add_argument('--batch-size', type=int, default=8, help='每个微批次的最大请求数')
+    parser.add_argument('--batch-wait-ms', type=float, default=10.0, help='凑批的最长等待时间（毫秒）')
+    parser.add_argument('--max-inflight-batches', type=int, default=4, help='同时发往后端的最大批次数')
+    parser.add_argument('--queue-size', type=int, default=256, help='等待队列上限，超过后返回503')
+    parser.add_argument('--cache-size', type=int, default=10000, help='LRU结果缓存的最大条目数')
+    parser.add_argument('--max-image-side', type=int, default=2048, help='预处理时图像最长边的像素上限')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'model_id': settings.inference_model_id,
+        'region': settings.aws_region,
+        'log_file': str(settings.log_path('seller_extraction_service.log'))
+    }
+
+    return config
+
+def preprocess_image(image_bytes, max_side=2048):
+    """统一转换为RGB JPEG并限制最长边，减少发往模型的字节数。
+
+    尺寸合规的RGB/灰度JPEG只读取文件头即原样返回，避免解码和重新编码。
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        if image.format == 'JPEG' and image.mode in ('RGB', 'L') and max(image.size) <= max_side:
+            return image_bytes
+        if image.format == 'JPEG':
+            # 让JPEG解码器直接以缩小的尺寸解码
+            image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side))
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+class LRUCache:
+    """按图像哈希缓存提取结果的LRU缓存（仅在事件循环线程中访问）。"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return self.items[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+class StubExtractor:
+    """本地桩后端：模拟每批次的固定延迟，返回固定格式的结果。"""
+
+    def __init__(self, latency=0.5):
+        self.latency = latency
+        self.stats = LatencyStats()
+
+    def extract_many(self, requests, stream=False, concurrency=None):
+        start = time.monotonic()
+        time.sleep(self.latency)
+        elapsed = time.monotonic() - start
+        results = []
+        for request in requests:
+            image_bytes = request['messages'][0]['content'][1]['image']['source']['bytes']
+            self.stats.record(elapsed)
+            results.append((f"桩销售方-{hashlib.sha256(image_bytes).hexdigest()[:8]}", None))
+        return results
+
+class MicroBatcher:
+    """把并发到达的请求合并成微批次，并限制同时在途的批次数。"""
+
+    def __init__(self, backend, executor, batch_size=8, batch_wait_ms=10.0, max_inflight_batches=4,
+                 queue_size=256):
+        self.backend = backend
+        self.executor = executor
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.inflight = asyncio.Semaphore(max_inflight_batches)
+        self.batch_sizes = []
+        self.rejected = 0
+        self.tasks = set()
+
+    def start(self):
+        self.spawn(self.run())
+
+    def spawn(self, coroutine):
+        """创建后台任务并保留引用，避免任务被垃圾回收。"""
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def submit(self, request):
+        """提交请求；队列已满时抛出 asyncio.QueueFull（准入控制）。"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((request, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        return future
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.inflight.acquire()
+            self.spawn(self.dispatch(batch))
+
+    async def dispatch(self, batch):
+        try:
+            self.batch_sizes.append(len(batch))
+            if len(self.batch_sizes) > 10000:
+                del self.batch_sizes[:5000]
+            requests = [request for request, _ in batch]
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, lambda: self.backend.extract_many(requests, concurrency=len(requests)))
+            except Exception as e:
+                results = [(None, str(e))] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.inflight.release()
+
+class SellerExtractionService:
+    """HTTP请求处理：缓存、去重合并、预处理与微批处理。"""
+
+    def __init__(self, backend, batcher, executor, cache_size=10000, max_image_side=2048):
+        self.backend = backend
+        self.batcher = batcher
+        self.executor = executor
+        self.cache = LRUCache(cache_size)
+        self.pending = {}
+        self.max_image_side = max_image_side
+        self.started = time.time()
+        self.request_latencies = []
+        self.status_counts = {}
+
+    async def extract(self, image_bytes):
+        """返回 (HTTP状态码, 响应体字典)。"""
+        key = hashlib.sha256(image_bytes).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            return 200, {'seller_name': cached, 'image_hash': key, 'cached': True}
+
+        # 相同图像的并发请求共享同一次预处理和后端调用；future在预处理前登记，
+        # 避免预处理期间到达的重复请求各自调用后端
+        if key in self.pending:
+            return await asyncio.shield(self.pending[key])
+
+        shared = asyncio.get_running_loop().create_future()
+        self.pending[key] = shared
+        try:
+            result = await self._extract_uncached(key, image_bytes)
+            shared.set_result(result)
+            return result
+        except BaseException as e:
+            if not shared.done():
+                shared.set_exception(e)
+                # 没有等待者时避免"Future exception was never retrieved"警告
+                shared.exception()
+            raise
+        finally:
+            self.pending.pop(key, None)
+
+    async def _extract_uncached(self, key, image_bytes):
+        loop = asyncio.get_running_loop()
+        try:
+            processed = await loop.run_in_executor(
+                self.executor, preprocess_image, image_bytes, self.max_image_side)
+        except Exception as e:
+            return 400, {'error': f"无法解析图像: {e}"}
+        try:
+            future = self.batcher.submit(build_seller_request(processed, 'jpeg'))
+        except asyncio.QueueFull:
+            return 503, {'error': '服务繁忙，请稍后重试'}
+        seller_name, error = await future
+
+        if error:
+            return 500, {'error': error}
+        self.cache.put(key, seller_name)
+        return 200, {'seller_name': seller_name, 'image_hash': key, 'cached': False}
+
+    def metrics(self):
+        latencies = sorted(self.request_latencies[-10000:])
+        batch_sizes = self.batcher.batch_sizes
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'status_counts': self.status_counts,
+            'queue_depth': self.batcher.queue.qsize(),
+            'rejected': self.batcher.rejected,
+            'cache': {'size': len(self.cache.items), 'hits': self.cache.hits, 'misses': self.cache.misses},
+            'batches': len(batch_sizes),
+            'mean_batch_size': sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+            'request_latency': {'p50': percentile(latencies, 0.50), 'p95': percentile(latencies, 0.95),
+                                'p99': percentile(latencies, 0.99)},
+            'backend': self.backend.stats.summary()
+        }
+
+    async def route(self, method, path, headers, body):
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.metrics()
+        if path != '/extract':
+            return 404, {'error': f"未知路径: {path}"}
+        if method != 'POST':
+            return 405, {'error': '仅支持POST'}
+        if not body:
+            return 400, {'error': '请求体为空'}
+
+        if headers.get('content-type', '').startswith('application/json'):
+            try:
+                body = base64.b64decode(json.loads(body)['image'])
+            except Exception as e:
+                return 400, {'error': f"无效的JSON请求: {e}"}
+        return await self.extract(body)
+
+    async def handle_connection(self, reader, writer):
+        """处理一个HTTP/1.1连接（支持keep-alive）。"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                start = time.monotonic()
+                length = int(headers.get('content-length', 0) or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, {'error': '请求体过大'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        status, payload = await self.route(method.upper(), target.split('?', 1)[0], headers, body)
+                    except Exception as e:
+                        logging.error(f"处理请求时出错: {e}")
+                        status, payload = 500, {'error': str(e)}
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+
+                self.status_counts[status] = self.status_counts.get(status, 0) + 1
+                if target.startswith('/extract'):
+                    self.request_latencies.append(time.monotonic() - start)
+                    if len(self.request_latencies) > 20000:
+                        del self.request_latencies[:10000]
+
+                data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+                response_headers = [
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                    'Content-Type: application/json; charset=utf-8',
+                    f"Content-Length: {len(data)}",
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}"
+                ]
+                if status == 503:
+                    response_headers.append('Retry-After: 1')
+                writer.write(('\r\n'.join(response_headers) + '\r\n\r\n').encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+def create_backend(args, config):
+    """根据参数创建模型后端。"""
+    if args.backend == 'stub':
+        return StubExtractor(args.stub_latency)
+
+    from nova_inference import NovaInferenceClient
+    model_id = args.model_id if args.model_id else config['model_id']
+    if not model_id:
+        raise ValueError("未指定模型。请使用 --model-id 或在配置文件中设置 INFERENCE_MODEL_ID")
+    region = args.region if args.region else config['region']
+    return NovaInferenceClient(model_id, region, args.batch_size * args.max_inflight_batches)
+
+async def serve(args, config):
+    """启动服务并一直运行。"""
+    backend = create_backend(args, config)
+    executor = ThreadPoolExecutor(max_workers=args.max_inflight_batches + os.cpu_count())
+    batcher = MicroBatcher(backend, executor, args.batch_size, args.batch_wait_ms,
+                           args.max_inflight_batches, args.queue_size)
+    batcher.start()
+    service = SellerExtractionService(backend, batcher, executor, args.cache_size, args.max_image_side)
+
+    server = await asyncio.start_server(service.handle_connection, args.host, args.port)
+    logging.info(f"服务已启动: http://{args.host}:{args.port} (后端: {args.backend})")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    """启动HTTP微服务的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'seller_extraction_service')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 配置日志
+    setup_logging(config['log_file'], 'seller_extraction_service')
+
+    try:
+        asyncio.run(serve(args, config))
+    except KeyboardInterrupt:
+        logging.info("服务已停止")
+
+if __name__ == "__main__":
+    main()
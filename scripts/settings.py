@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+统一的类型化配置
+- 只解析一次 config.env（与 shell 的 source 兼容的 KEY="value" 子集），展开 ${VAR} / $VAR 引用
+- 环境变量优先于配置文件（与 dotenv.load_dotenv 的默认行为一致），并把结果导出到 os.environ
+- 按 Settings 的字段类型校验并转换取值，路径统一解析为相对于项目根目录的绝对路径
+- 所有默认值只在这里定义一次；按配置文件路径缓存，各阶段共享同一个 Settings 对象
+- 只依赖标准库（不导入 boto3 / dotenv），入口脚本导入它几乎没有开销
+
+命令行:
+  python settings.py            打印解析后的配置
+  python settings.py --check    只做校验，出错时以非零状态退出（流水线脚本启动时调用）
+  python settings.py --json     以JSON输出
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Optional
+from dataclasses import dataclass, fields
+
+# 项目根目录（scripts/ 的上一级）
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CONFIG_FILE = REPO_ROOT / 'config.env'
+
+LOG_FORMATS = ('text', 'json')
+
+LINE_PATTERN = re.compile(r'^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*?)\s*$')
+VARIABLE_PATTERN = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)\}|\$([A-Za-z_][A-Za-z0-9_]*)')
+
+class SettingsError(ValueError):
+    """配置文件中的取值无效。"""
+    pass
+
+@dataclass(frozen=True)
+class Settings:
+    """config.env 中的全部配置；字段名是变量名的小写形式，Path 字段为绝对路径。"""
+
+    config_file: Path
+
+    # 本地目录
+    data_dir: Path = Path('data')
+    images_dir: Path = Path('data/images')
+    label_data_dir: Path = Path('data/label_data')
+    bedrock_ft_dir: Path = Path('data/bedrock-ft')
+    output_dir: Path = Path('output')
+    logs_dir: Path = Path('output/logs')
+    models_dir: Path = Path('output/models')
+    reports_dir: Path = Path('output/reports')
+    cache_dir: Path = Path('output/cache')
+    docs_dir: Path = Path('docs')
+    train_images_dir: Path = Path('data/images/train')
+    test_images_dir: Path = Path('data/images/test')
+    train_label_csv: Path = Path('data/label_data/train_label.csv')
+    test_label_csv: Path = Path('data/label_data/test_label.csv')
+    train_jsonl: Path = Path('data/bedrock-ft/train_data.jsonl')
+    test_jsonl: Path = Path('data/bedrock-ft/test_data.jsonl')
+    dataset_store: Path = Path('data/dataset_store.parquet')
+
+    # AWS
+    s3_bucket: str = 'aigcdemo.plaza.red'
+    s3_prefix_training: str = 'nova-ft/training/data'
+    s3_prefix_images: str = 'nova-ft/images'
+    s3_prefix_output: str = 'nova-ft/output'
+    aws_account_id: str = ''
+    aws_region: str = 'us-east-1'
+
+    # 微调作业
+    base_model_id: str = 'arn:aws:bedrock:us-east-1::foundation-model/amazon.nova-pro-v1:0:300k'
+    role_arn: Optional[str] = None
+    job_name: Optional[str] = None
+    custom_model_name: Optional[str] = None
+    epoch_count: int = 3
+    batch_size: int = 1
+    learning_rate: float = 0.0001
+    model_catalog_dir: Path = Path('.')
+
+    # 推理
+    inference_model_id: Optional[str] = None
+
+    # 日志、指标、性能分析与基准测试
+    log_format: str = 'text'
+    log_sample_every: int = 100
+    metrics_dir: Path = Path('output/logs/metrics')
+    profile_dir: Path = Path('output/profiles')
+    benchmark_dir: Path = Path('output/benchmark')
+    benchmark_baseline: Path = Path('benchmarks/pipeline_baseline.json')
+
+    # 日志文件
+    data_preparation_log: Path = Path('output/logs/nova_data_preparation.log')
+    upload_data_log: Path = Path('output/logs/upload_training_data.log')
+    validation_log: Path = Path('output/logs/nova_validation.log')
+    pipeline_log: Path = Path('output/logs/complete_pipeline.log')
+    generate_labels_log: Path = Path('output/logs/generate_labels.log')
+    finetuning_job_log: Path = Path('output/logs/nova_finetuning_job.log')
+    jsonl_to_s3_log: Path = Path('output/logs/jsonl_to_s3.log')
+
+    def log_path(self, name):
+        """LOGS_DIR 下的日志文件路径。"""
+        return self.logs_dir / name
+
+    def training_role_arn(self):
+        """微调作业使用的IAM角色；未配置 ROLE_ARN 时按账户ID拼出默认角色。"""
+        return self.role_arn or f"arn:aws:iam::{self.aws_account_id}:role/service-role/AmazonBedrockExecutionRoleForNova"
+
+    def as_dict(self):
+        """{变量名: 取值} 形式，路径转换为字符串。"""
+        return {f.name.upper(): (str(value) if isinstance(value, Path) else value)
+                for f in fields(self) for value in [getattr(self, f.name)] if f.name != 'config_file'}
+
+def unquote(value):
+    """去掉值两侧的引号与未加引号时的行尾注释；单引号内不展开变量，返回 (值, 是否展开)。"""
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1], value[0] == '"'
+    return value.split(' #', 1)[0].strip(), True
+
+def expand(value, variables):
+    """展开 ${VAR} 与 $VAR，未定义的变量展开为空字符串（与 shell 一致）。"""
+    return VARIABLE_PATTERN.sub(lambda match: variables.get(match.group(1) or match.group(2), ''), value)
+
+def parse_env_file(path, environ=None):
+    """解析配置文件，返回 {变量名: 展开后的字符串}。
+
+    已在环境变量中设置的变量优先，且后续引用它的变量也使用环境变量中的值。
+    """
+    environ = os.environ if environ is None else environ
+    values = {}
+    variables = dict(environ)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#'):
+                continue
+            match = LINE_PATTERN.match(line)
+            if not match:
+                raise SettingsError(f"{path}:{line_number}: 无法解析的配置行: {stripped}")
+            name, raw = match.groups()
+            value, expandable = unquote(raw)
+            if name in environ:
+                value = environ[name]
+            elif expandable:
+                value = expand(value, variables)
+            values[name] = value
+            variables[name] = value
+    return values
+
+def resolve_path(path):
+    """相对路径按项目根目录解析为绝对路径。"""
+    path = Path(path).expanduser()
+    return path if path.is_absolute() else REPO_ROOT / path
+
+def convert(field, raw, problems):
+    """按字段类型转换一个取值，错误追加到 problems。"""
+    name = field.name.upper()
+    kind = field.type
+    if kind == Optional[str]:
+        return raw or None
+    if kind is Path:
+        return resolve_path(raw or field.default)
+    if kind in (int, float):
+        try:
+            value = kind(raw)
+        except ValueError:
+            problems.append(f"{name}={raw!r} 不是有效的{'整数' if kind is int else '数值'}")
+            return field.default
+        if value <= 0:
+            problems.append(f"{name}={raw!r} 必须大于0")
+        return value
+    return raw
+
+def build_settings(values, config_file):
+    """由 {变量名: 字符串} 构造并校验 Settings；全部问题一并报告。"""
+    problems = []
+    kwargs = {}
+    for field in fields(Settings):
+        if field.name == 'config_file':
+            continue
+        raw = values.get(field.name.upper())
+        if raw is None:
+            raw = os.environ.get(field.name.upper())
+        if raw is None:
+            default = field.default
+            kwargs[field.name] = resolve_path(default) if isinstance(default, Path) else default
+            continue
+        kwargs[field.name] = convert(field, raw, problems)
+
+    if kwargs['log_format'] not in LOG_FORMATS:
+        problems.append(f"LOG_FORMAT={kwargs['log_format']!r} 无效，可选 {LOG_FORMATS}")
+    if not kwargs['s3_bucket']:
+        problems.append("S3_BUCKET 不能为空")
+    if problems:
+        raise SettingsError(f"配置文件 {config_file} 无效:\n  " + '\n  '.join(problems))
+    return Settings(config_file=Path(config_file), **kwargs)
+
+_cache = {}
+_current = None
+
+def load_settings(config_path=None, export=True):
+    """解析并校验配置文件（默认为项目根目录下的 config.env），同一路径只解析一次。
+
+    export 为真时把配置写入 os.environ（不覆盖已有的环境变量），供子进程和按需读取环境变量的模块使用。
+    """
+    global _current
+    path = Path(config_path) if config_path else DEFAULT_CONFIG_FILE
+    if not path.is_absolute() and not path.exists():
+        # 脚本参数的默认值 ../config.env 是相对于 scripts/ 的，从其他目录运行时按 scripts/ 解析
+        path = Path(__file__).resolve().parent / path
+    path = path.resolve()
+    settings = _cache.get(path)
+    if settings is None:
+        if not path.exists():
+            raise FileNotFoundError(f"配置文件不存在: {config_path or path}")
+        values = parse_env_file(path)
+        settings = build_settings(values, path)
+        if export:
+            for name, value in values.items():
+                os.environ.setdefault(name, value)
+        _cache[path] = settings
+    _current = settings
+    return settings
+
+def get_settings():
+    """返回最近一次加载的配置；尚未加载时加载默认配置文件。"""
+    return _current or load_settings()
+
+def repo_path(path):
+    """把相对于项目根目录的路径（例如环境变量中的目录）转换为绝对路径字符串。"""
+    return str(resolve_path(path))
+
+def main():
+    parser = argparse.ArgumentParser(description='解析、校验并打印项目配置')
+    parser.add_argument('--config', type=str, help='配置文件路径（默认为项目根目录下的 config.env）')
+    parser.add_argument('--check', action='store_true', help='只做校验，不打印配置')
+    parser.add_argument('--json', action='store_true', help='以JSON输出')
+    args = parser.parse_args()
+
+    try:
+        settings = load_settings(args.config, export=False)
+    except (FileNotFoundError, SettingsError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    if args.check:
+        return 0
+    if args.json:
+        print(json.dumps(settings.as_dict(), ensure_ascii=False, indent=2))
+    else:
+        for name, value in settings.as_dict().items():
+            print(f"{name}={'' if value is None else value}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+微调作业训练过程中的实时异常检测
+- 作业运行期间定期增量读取 step_wise_training_metrics.csv: S3上只用 Range 请求拉取上次读取之后新增的字节，
+  本地文件同样从上次的偏移量继续读；也可以从已有的指标文件回放，用于调试阈值
+- 在线检测器逐行更新: NaN/Inf 与损失爆炸、EMA 相对最佳值的持续发散、滚动窗口斜率过小（平台期）；
+  平台期只在损失相对训练开始时几乎没有下降时报警，已经收敛的作业不会被停止（停止的作业不产出模型）
+- 任一检测器超过阈值时调用 stop_model_customization_job 停止作业，坏的训练只花几分钟而不是几小时的费用
+"""
+
+import os
+import io
+import csv
+import sys
+import math
+import time
+import logging
+import argparse
+from collections import deque
+
+from instrumentation import count, setup_logging
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from aws_clients import get_client
+from plot_backend import METRICS_FILE_NAME
+from compare_training_runs import parse_s3_uri
+
+# 这些状态下作业仍在运行（还可能写入新的指标）
+ACTIVE_JOB_STATUSES = ('InProgress',)
+DEFAULT_POLL_INTERVAL = 60
+
+def parse_arguments():
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(description='实时检测微调作业的训练异常，超过阈值时自动停止作业')
+
+    parser.add_argument('--job-arn', type=str, help='要监视的微调作业ARN')
+    parser.add_argument('--metrics-file', type=str,
+                        help='从本地指标文件读取（未指定 --job-arn 时为回放模式，读完即结束）')
+    parser.add_argument('--replay-rows', type=int, help='回放模式下每次轮询送入的行数（默认一次送入全部）')
+    parser.add_argument('--interval', type=float, help=f'轮询间隔秒数（默认{DEFAULT_POLL_INTERVAL}，回放模式默认0）')
+    parser.add_argument('--no-stop', action='store_true', help='只报告异常，不停止作业')
+    parser.add_argument('--region', type=str, help='AWS区域')
+    parser.add_argument('--ema-alpha', type=float, default=0.05, help='EMA平滑系数')
+    parser.add_argument('--warmup', type=int, default=50, help='前多少行不判定发散和损失爆炸')
+    parser.add_argument('--divergence-tolerance', type=float, default=0.5,
+                        help='EMA高于其最佳值的相对幅度超过该值视为发散')
+    parser.add_argument('--divergence-patience', type=int, default=20, help='连续多少行发散才报警')
+    parser.add_argument('--explosion-factor', type=float, default=10.0, help='单步损失超过EMA最佳值的倍数视为爆炸')
+    parser.add_argument('--nan-patience', type=int, default=1, help='连续多少行NaN/Inf损失才报警')
+    parser.add_argument('--plateau-window', type=int, default=500, help='平台期检测的滚动窗口行数（0表示不检测）')
+    parser.add_argument('--plateau-min-improvement', type=float, default=0.001,
+                        help='窗口内按斜率估计的相对下降低于该值视为平台期')
+    parser.add_argument('--plateau-min-progress', type=float, default=0.1,
+                        help='窗口均值相对第一个窗口均值的下降低于该值时，平台期才报警（已收敛的作业不报警）')
+    parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
+
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+def load_config(config_path):
+    """加载环境变量配置。"""
+    settings = load_settings(config_path)
+
+    # 获取必要的配置
+    config = {
+        'region': settings.aws_region,
+        'output_s3_uri': f"s3://{settings.s3_bucket}/{settings.s3_prefix_output}/",
+        'log_file': str(settings.log_path('training_watchdog.log'))
+    }
+
+    return config
+
+def parse_loss(value):
+    """解析损失值，空值或无法解析时返回NaN。"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+class MetricsCsvParser:
+    """增量解析指标CSV: 每次送入新读到的字节，返回其中完整的行；不完整的最后一行留到下次。"""
+
+    def __init__(self):
+        self.buffer = b''
+        self.columns = None
+
+    def feed(self, data):
+        self.buffer += data
+        complete, _, self.buffer = self.buffer.rpartition(b'\n')
+        if not complete:
+            return []
+        rows = []
+        for fields in csv.reader(io.StringIO(complete.decode('utf-8'))):
+            if not fields:
+                continue
+            if self.columns is None:
+                self.columns = {name.strip(): index for index, name in enumerate(fields)}
+                continue
+            try:
+                step = int(float(fields[self.columns['step_number']]))
+            except (KeyError, IndexError, ValueError):
+                continue
+            epoch_index = self.columns.get('epoch_number')
+            loss_index = self.columns.get('training_loss')
+            rows.append({
+                'step': step,
+                'epoch': fields[epoch_index] if epoch_index is not None and epoch_index < len(fields) else None,
+                'loss': parse_loss(fields[loss_index]) if loss_index is not None and loss_index < len(fields) else math.nan
+            })
+        return rows
+
+class FileMetricsSource:
+    """从本地指标文件读取新增的行。
+
+    follow 为假时是回放模式: 每次轮询最多返回 batch_rows 行，读完文件后 finished 为真。
+    """
+
+    def __init__(self, path, batch_rows=None, follow=False):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.follow = follow
+        self.offset = 0
+        self.parser = MetricsCsvParser()
+        self.pending = deque()
+
+    @property
+    def finished(self):
+        return not self.follow and not self.pending and self.offset >= os.path.getsize(self.path)
+
+    def poll(self):
+        if os.path.exists(self.path):
+            size = os.path.getsize(self.path)
+            if size < self.offset:
+                # 文件被重写，从头读（已处理过的步数会被跳过）
+                self.offset, self.parser = 0, MetricsCsvParser()
+            if size > self.offset:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.offset)
+                    data = f.read(size - self.offset)
+                self.offset += len(data)
+                self.pending.extend(self.parser.feed(data))
+        limit = len(self.pending) if self.batch_rows is None else min(self.batch_rows, len(self.pending))
+        return [self.pending.popleft() for _ in range(limit)]
+
+class S3MetricsSource:
+    """用 Range 请求增量读取作业写到S3的指标文件（作业ID出现在对象键中）。"""
+
+    finished = False
+
+    def __init__(self, s3_client, output_s3_uri, job_id):
+        self.s3_client = s3_client
+        self.bucket, self.prefix = parse_s3_uri(output_s3_uri)
+        self.job_id = job_id
+        self.key = None
+        self.offset = 0
+        self.parser = MetricsCsvParser()
+
+    def find_key(self):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith(METRICS_FILE_NAME) and self.job_id in obj['Key']:
+                    return obj['Key']
+        return None
+
+    def poll(self):
+        if self.key is None:
+            self.key = self.find_key()
+            if self.key is None:
+                return []
+            logging.info(f"找到指标文件: s3://{self.bucket}/{self.key}")
+        size = self.s3_client.head_object(Bucket=self.bucket, Key=self.key)['ContentLength']
+        if size < self.offset:
+            self.offset, self.parser = 0, MetricsCsvParser()
+        if size == self.offset:
+            return []
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.offset}-{size - 1}")
+        data = response['Body'].read()
+        self.offset += len(data)
+        count('watchdog.bytes_fetched', len(data))
+        return self.parser.feed(data)
+
+class NonFiniteDetector:
+    """NaN/Inf 损失，或单步损失超过EMA最佳值的 explosion_factor 倍。"""
+
+    name = 'nan_explosion'
+
+    def __init__(self, patience=1, explosion_factor=10.0, alpha=0.05, warmup=50):
+        self.patience = patience
+        self.explosion_factor = explosion_factor
+        self.alpha = alpha
+        self.warmup = warmup
+        self.bad_rows = 0
+        self.rows = 0
+        self.ema = None
+        self.best_ema = math.inf
+
+    def update(self, step, loss):
+        if not math.isfinite(loss):
+            self.bad_rows += 1
+            if self.bad_rows >= self.patience:
+                return f"连续 {self.bad_rows} 步损失为 {loss}"
+            return None
+        self.bad_rows = 0
+        self.rows += 1
+        if (self.rows > self.warmup and self.explosion_factor and self.best_ema > 0
+                and loss > self.explosion_factor * self.best_ema):
+            return f"损失 {loss:.4g} 超过EMA最佳值 {self.best_ema:.4g} 的 {self.explosion_factor:g} 倍"
+        self.ema = loss if self.ema is None else self.alpha * loss + (1 - self.alpha) * self.ema
+        self.best_ema = min(self.best_ema, self.ema)
+        return None
+
+class EmaDivergenceDetector:
+    """损失的EMA连续 patience 步高于其最佳值的 (1 + tolerance) 倍。"""
+
+    name = 'ema_divergence'
+
+    def __init__(self, alpha=0.05, tolerance=0.5, patience=20, warmup=50):
+        self.alpha = alpha
+        self.tolerance = tolerance
+        self.patience = patience
+        self.warmup = warmup
+        self.rows = 0
+        self.ema = None
+        self.best_ema = math.inf
+        self.diverging_rows = 0
+
+    def update(self, step, loss):
+        if not math.isfinite(loss):
+            return None
+        self.rows += 1
+        self.ema = loss if self.ema is None else self.alpha * loss + (1 - self.alpha) * self.ema
+        if self.rows <= self.warmup or self.ema <= self.best_ema + self.tolerance * abs(self.best_ema):
+            self.best_ema = min(self.best_ema, self.ema)
+            self.diverging_rows = 0
+            return None
+        self.diverging_rows += 1
+        if self.diverging_rows >= self.patience:
+            return (f"损失EMA {self.ema:.4g} 已连续 {self.diverging_rows} 步高于最佳值 {self.best_ema:.4g} "
+                    f"的 {1 + self.tolerance:g} 倍")
+        return None
+
+class PlateauDetector:
+    """滚动窗口内损失的最小二乘斜率: 按斜率估计的窗口内相对下降低于 min_improvement，
+    且窗口均值相对第一个窗口均值的下降低于 min_progress（从未真正学到东西）时视为平台期。
+
+    窗口的 Σx、Σx² 用整数精确维护，Σy、Σxy 每滑过一个窗口重新求和一次以限制浮点误差累积，每行更新为O(1)。
+    """
+
+    name = 'plateau'
+
+    def __init__(self, window=500, min_improvement=0.001, min_progress=0.1, warmup=None):
+        self.window = window
+        self.min_improvement = min_improvement
+        self.min_progress = min_progress
+        self.initial_mean = None
+        self.warmup = window if warmup is None else max(window, warmup)
+        self.points = deque()
+        self.rows = 0
+        self.sum_x = self.sum_xx = 0
+        self.sum_y = self.sum_xy = 0.0
+
+    def update(self, step, loss):
+        if not math.isfinite(loss):
+            return None
+        x = self.rows
+        self.rows += 1
+        self.points.append((x, loss))
+        self.sum_x += x
+        self.sum_xx += x * x
+        self.sum_y += loss
+        self.sum_xy += x * loss
+        if len(self.points) > self.window:
+            old_x, old_y = self.points.popleft()
+            self.sum_x -= old_x
+            self.sum_xx -= old_x * old_x
+            self.sum_y -= old_y
+            self.sum_xy -= old_x * old_y
+        if self.rows % self.window == 0:
+            self.sum_y = sum(y for _, y in self.points)
+            self.sum_xy = sum(px * py for px, py in self.points)
+        if len(self.points) < self.window:
+            return None
+        n = len(self.points)
+        mean = self.sum_y / n
+        if self.initial_mean is None:
+            self.initial_mean = mean
+        if self.rows < self.warmup or not mean:
+            return None
+
+        progress = 1 - mean / self.initial_mean if self.initial_mean else 0.0
+        if progress >= self.min_progress:
+            return None
+        slope = (n * self.sum_xy - self.sum_x * self.sum_y) / (n * self.sum_xx - self.sum_x * self.sum_x)
+        improvement = -slope * (n - 1) / abs(mean)
+        if improvement < self.min_improvement:
+            return (f"最近 {n} 步损失的相对下降仅 {improvement:.3%}（均值 {mean:.4g}），"
+                    f"相对训练开始只下降了 {progress:.1%}")
+        return None
+
+def create_detectors(args):
+    """根据命令行阈值创建检测器。"""
+    detectors = [
+        NonFiniteDetector(args.nan_patience, args.explosion_factor, args.ema_alpha, args.warmup),
+        EmaDivergenceDetector(args.ema_alpha, args.divergence_tolerance, args.divergence_patience, args.warmup)
+    ]
+    if args.plateau_window > 0:
+        detectors.append(PlateauDetector(args.plateau_window, args.plateau_min_improvement,
+                                         args.plateau_min_progress, args.warmup))
+    return detectors
+
+class TrainingWatchdog:
+    """轮询指标来源，把新行依次送入检测器；第一次报警时停止作业（bedrock_client 可以替换为桩对象测试）。"""
+
+    def __init__(self, source, detectors, bedrock_client=None, job_arn=None, stop_job=True):
+        self.source = source
+        self.detectors = detectors
+        self.bedrock_client = bedrock_client
+        self.job_arn = job_arn
+        self.stop_job = stop_job
+        self.last_step = None
+        self.rows = 0
+        self.alert = None
+
+    def feed(self, rows):
+        """送入新的指标行，返回第一个报警（没有时返回 None）。"""
+        for row in rows:
+            # 文件被重写后重复读到的步数
+            if self.last_step is not None and row['step'] <= self.last_step:
+                continue
+            self.last_step = row['step']
+            self.rows += 1
+            for detector in self.detectors:
+                reason = detector.update(row['step'], row['loss'])
+                if reason:
+                    return {'detector': detector.name, 'step': row['step'], 'epoch': row['epoch'],
+                            'loss': row['loss'], 'reason': reason}
+        return None
+
+    def job_status(self):
+        if not self.bedrock_client or not self.job_arn:
+            return None
+        return self.bedrock_client.get_model_customization_job(jobIdentifier=self.job_arn).get('status', 'UNKNOWN')
+
+    def trigger(self, alert):
+        """记录报警并停止作业。"""
+        self.alert = alert
+        count(f"watchdog.alert.{alert['detector']}")
+        logging.warning(f"检测到训练异常（{alert['detector']}，第 {alert['step']} 步）: {alert['reason']}")
+        if not self.stop_job or not self.bedrock_client or not self.job_arn:
+            logging.warning("未停止作业（回放模式或指定了 --no-stop）")
+            return
+        self.bedrock_client.stop_model_customization_job(jobIdentifier=self.job_arn)
+        alert['stopped'] = True
+        logging.warning(f"已请求停止作业: {self.job_arn}")
+
+    def run(self, interval=DEFAULT_POLL_INTERVAL, max_polls=None):
+        """轮询直到报警、作业结束或回放完毕，返回报警（没有时返回 None）。"""
+        polls = 0
+        while True:
+            # 先查状态再读指标: 作业结束时最后写出的指标也会被检查
+            status = self.job_status()
+            alert = self.feed(self.source.poll())
+            polls += 1
+            if alert:
+                self.trigger(alert)
+                return alert
+            if status is not None and status not in ACTIVE_JOB_STATUSES:
+                logging.info(f"作业已结束（{status}），共检查 {self.rows} 步，未发现异常")
+                return None
+            if self.source.finished or (max_polls is not None and polls >= max_polls):
+                logging.info(f"共检查 {self.rows} 步，未发现异常")
+                return None
+            time.sleep(interval)
+
+def main():
+    """监视微调作业训练指标的主函数。"""
+    # 解析命令行参数
+    args = parse_arguments()
+    start_profiling(args, 'training_watchdog')
+
+    # 加载配置
+    config = load_config(args.config)
+
+    # 命令行参数覆盖配置文件
+    if args.region:
+        config['region'] = args.region
+
+    # 配置日志
+    setup_logging(config['log_file'], 'training_watchdog')
+
+    if not args.job_arn and not args.metrics_file:
+        logging.error("需要指定 --job-arn 或 --metrics-file")
+        return 1
+
+    bedrock_client = None
+    if args.job_arn:
+        bedrock_client = get_client('bedrock', region_name=config['region'])
+        job = bedrock_client.get_model_customization_job(jobIdentifier=args.job_arn)
+        logging.info(f"作业: {job.get('jobName', args.job_arn)}，状态: {job.get('status')}")
+        output_s3_uri = job.get('outputDataConfig', {}).get('s3Uri') or config['output_s3_uri']
+
+    if args.metrics_file:
+        source = FileMetricsSource(args.metrics_file, args.replay_rows, follow=bool(args.job_arn))
+    else:
+        job_id = args.job_arn.rsplit('/', 1)[-1]
+        source = S3MetricsSource(get_client('s3', region_name=config['region']), output_s3_uri, job_id)
+        logging.info(f"从 {output_s3_uri} 增量读取作业 {job_id} 的指标")
+
+    interval = args.interval
+    if interval is None:
+        interval = DEFAULT_POLL_INTERVAL if args.job_arn else 0
+
+    watchdog = TrainingWatchdog(source, create_detectors(args), bedrock_client, args.job_arn, not args.no_stop)
+    try:
+        alert = watchdog.run(interval)
+    except KeyboardInterrupt:
+        alert = None
+    if alert:
+        print(f"异常: {alert['detector']} 第 {alert['step']} 步 - {alert['reason']}"
+              f"{'，已停止作业' if alert.get('stopped') else ''}")
+    else:
+        print(f"共检查 {watchdog.rows} 步，未发现异常")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
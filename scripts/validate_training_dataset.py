@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
 import os
+import json
+import hashlib
 import argparse
 import subprocess
 import logging
 import glob
-import dotenv
 from pathlib import Path
+from collections import Counter
+
+from instrumentation import count, setup_logging, stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from nova_ft_common import IMAGE_FORMATS, VIDEO_FORMATS, ConverseRoles
+from image_scanner import IMAGE_FORMATS_BY_EXTENSION
+
+VALIDATION_MODEL_NAME = 'lite'
+# 补丁摘要中最多列出的逐行补丁与隔离记录数
+MAX_LISTED_PATCHES = 1000
 
 def parse_arguments():
     """解析命令行参数。"""
@@ -14,32 +26,249 @@ def parse_arguments():
     parser.add_argument('--input-dir', type=str, help='包含训练数据的目录')
     parser.add_argument('--report-file', type=str, help='保存验证报告的路径')
     parser.add_argument('--fix', action='store_true', help='尝试修复数据集中的常见问题')
+    parser.add_argument('--fix-output', type=str, help='修复后的JSONL路径（默认原地替换输入文件）')
+    parser.add_argument('--quarantine-file', type=str,
+                        help='无法修复的样本追加到该文件（默认为 <输入文件名>.quarantine.jsonl）')
     parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
     
+    add_profile_arguments(parser)
+    
     return parser.parse_args()
 
 def load_config(config_path):
     """加载环境变量配置。"""
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
-    
-    dotenv.load_dotenv(config_path)
+    settings = load_settings(config_path)
     
-    # 获取必要的环境变量
+    # 获取必要的配置
     config = {
-        'input_dir': os.path.join('..', os.getenv('BEDROCK_FT_DIR')),
-        'report_file': os.path.join('..', os.getenv('LOGS_DIR'), 'validation_report.txt'),
-        'log_file': os.path.join('..', os.getenv('VALIDATION_LOG'))
+        'input_dir': str(settings.bedrock_ft_dir),
+        'report_file': str(settings.log_path('validation_report.txt')),
+        'log_file': str(settings.validation_log)
     }
     
     return config
 
-def validate_jsonl_file(jsonl_path, report_file, fix=False):
-    """验证JSONL文件格式。"""
+def run_validator(jsonl_path):
+    """用nova_ft_dataset_validator.py验证JSONL文件，返回子进程结果。"""
+    cmd = ['python3', 'nova_ft_dataset_validator.py', '--input_file', jsonl_path, '--model_name', VALIDATION_MODEL_NAME]
+    return subprocess.run(cmd, capture_output=True, text=True)
+
+def is_empty_text_item(item):
+    """不含图像和视频、文本为空（或只有空白）的内容项。"""
+    return (isinstance(item, dict) and item.get('image') is None and item.get('video') is None
+            and not (item.get('text') or '').strip())
+
+def normalize_media_format(media, formats, extensions=None):
+    """去掉格式的前导点并统一小写，把扩展名（如 jpg）映射为格式名；仍不支持时按S3 URI的扩展名推断。返回是否修改。"""
+    value = media.get('format')
+    media_format = value.strip().lstrip('.').lower() if isinstance(value, str) else ''
+    if extensions:
+        media_format = extensions.get('.' + media_format, media_format)
+        if media_format not in formats:
+            uri = ((media.get('source') or {}).get('s3Location') or {}).get('uri') or ''
+            media_format = extensions.get(os.path.splitext(uri)[1].lower(), media_format)
+    if media_format not in formats or media_format == value:
+        return False
+    media['format'] = media_format
+    return True
+
+def repair_sample(sample):
+    """就地修复一个样本，返回 {修复类型: 次数}；没有可修复的问题时返回空Counter。
+
+    - image_format / video_format: 格式大小写与扩展名
+    - empty_text: 删除空文本内容项
+    - role_case: 角色名统一小写
+    - system_turn: messages 中的 system 消息移到 system 提示词
+    - drop_turn / merge_turns: 删除空消息、开头的助手消息和结尾的用户消息，合并相邻的同角色消息
+    """
+    fixes = Counter()
+    system = sample.get('system')
+    if isinstance(system, list):
+        kept = [item for item in system if not is_empty_text_item(item)]
+        if len(kept) != len(system):
+            fixes['empty_text'] += len(system) - len(kept)
+            sample['system'] = kept
+            if not kept:
+                del sample['system']
+
+    messages = sample.get('messages')
+    if not isinstance(messages, list) or not all(isinstance(m, dict) and isinstance(m.get('content'), list) for m in messages):
+        return fixes
+
+    for message in messages:
+        role = message.get('role')
+        if isinstance(role, str) and role != role.strip().lower():
+            message['role'] = role.strip().lower()
+            fixes['role_case'] += 1
+        kept = []
+        for item in message['content']:
+            if is_empty_text_item(item):
+                fixes['empty_text'] += 1
+                continue
+            if isinstance(item.get('image'), dict) and normalize_media_format(item['image'], IMAGE_FORMATS, IMAGE_FORMATS_BY_EXTENSION):
+                fixes['image_format'] += 1
+            if isinstance(item.get('video'), dict) and normalize_media_format(item['video'], VIDEO_FORMATS):
+                fixes['video_format'] += 1
+            kept.append(item)
+        message['content'] = kept
+
+    # messages 中的 system 消息（OpenAI风格）移到 system 提示词
+    system_turns = [m for m in messages if m.get('role') == ConverseRoles.SYSTEM]
+    if system_turns:
+        sample.setdefault('system', []).extend({'text': item['text']} for m in system_turns
+                                               for item in m['content'] if item.get('text'))
+        messages = [m for m in messages if m.get('role') != ConverseRoles.SYSTEM]
+        fixes['system_turn'] += len(system_turns)
+    if any(m.get('role') not in (ConverseRoles.USER, ConverseRoles.ASSISTANT) for m in messages):
+        # 未知角色无法自动修复
+        sample['messages'] = messages
+        return fixes
+
+    # 修正角色交替: 删除空消息，合并相邻的同角色消息，对话必须以用户开始、以助手结束
+    ordered = []
+    for message in messages:
+        if not message['content']:
+            fixes['drop_turn'] += 1
+        elif ordered and ordered[-1]['role'] == message['role']:
+            ordered[-1]['content'].extend(message['content'])
+            fixes['merge_turns'] += 1
+        else:
+            ordered.append(message)
+    while ordered and ordered[0]['role'] != ConverseRoles.USER:
+        ordered.pop(0)
+        fixes['drop_turn'] += 1
+    while ordered and ordered[-1]['role'] != ConverseRoles.ASSISTANT:
+        ordered.pop()
+        fixes['drop_turn'] += 1
+    sample['messages'] = ordered
+    return fixes
+
+def validation_error(sample, model_name):
+    """按Nova格式验证一个样本，通过时返回 None，否则返回错误描述。"""
+    from pydantic import ValidationError
+    from nova_ft_schema import ConverseDatasetSample
+
+    try:
+        ConverseDatasetSample.model_validate(sample, context={"model_name": model_name})
+        return None
+    except ValidationError as e:
+        return '; '.join(f"{err['loc']}: {err['msg'].replace('Value error, ', '')}" for err in e.errors())
+
+def default_fix_paths(jsonl_path):
+    """隔离文件与补丁摘要的默认路径（与数据文件同目录）。"""
+    stem = os.path.splitext(jsonl_path)[0]
+    return stem + '.quarantine.jsonl', stem + '.patch.json'
+
+def repair_jsonl_file(input_path, output_path=None, quarantine_path=None, summary_path=None,
+                      model_name=VALIDATION_MODEL_NAME):
+    """流式修复JSONL文件，返回补丁摘要。
+
+    逐行读取: 没有问题的行按原字节写出；能修复的行重新序列化；修复后仍不合格的行
+    （以及无法解析的行）原样追加到隔离文件，不写入输出。没有任何行被修改或隔离时不重写文件，
+    修改时间不变，增量上传可以跳过它。
+    """
+    output_path = output_path or input_path
+    default_quarantine, default_summary = default_fix_paths(output_path)
+    quarantine_path = quarantine_path or default_quarantine
+    summary_path = summary_path or default_summary
+
+    totals = Counter()
+    fixes_total = Counter()
+    patches = []
+    quarantined = []
+    digest = hashlib.sha256()
+    tmp_path = output_path + '.tmp'
+    quarantine = None
+    try:
+        with open(input_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for line_number, raw in enumerate(src, 1):
+                totals['lines'] += 1
+                if not raw.strip():
+                    fixes_total['blank_line'] += 1
+                    totals['repaired'] += 1
+                    if len(patches) < MAX_LISTED_PATCHES:
+                        patches.append({'line': line_number, 'fixes': {'blank_line': 1}})
+                    continue
+                try:
+                    sample = json.loads(raw)
+                    if not isinstance(sample, dict):
+                        raise ValueError('样本不是JSON对象')
+                    fixes = repair_sample(sample)
+                    error = validation_error(sample, model_name)
+                except (ValueError, TypeError, AttributeError, KeyError) as e:
+                    fixes, error = Counter(), f"无法解析: {e}"
+
+                if error:
+                    if quarantine is None:
+                        quarantine = open(quarantine_path, 'ab')
+                    quarantine.write(raw if raw.endswith(b'\n') else raw + b'\n')
+                    totals['quarantined'] += 1
+                    if len(quarantined) < MAX_LISTED_PATCHES:
+                        quarantined.append({'line': line_number, 'error': error})
+                    continue
+
+                if fixes:
+                    line = (json.dumps(sample, ensure_ascii=False) + '\n').encode('utf-8')
+                    fixes_total.update(fixes)
+                    totals['repaired'] += 1
+                    if len(patches) < MAX_LISTED_PATCHES:
+                        patches.append({'line': line_number, 'fixes': dict(fixes)})
+                else:
+                    line = raw
+                    totals['unchanged'] += 1
+                dst.write(line)
+                digest.update(line)
+    finally:
+        if quarantine is not None:
+            quarantine.close()
+
+    changed = bool(totals['repaired'] or totals['quarantined'])
+    if changed or output_path != input_path:
+        os.replace(tmp_path, output_path)
+    else:
+        os.remove(tmp_path)
+    count('repair.repaired', totals['repaired'])
+    count('repair.quarantined', totals['quarantined'])
+
+    summary = {
+        'input': input_path,
+        'output': output_path,
+        'quarantine': quarantine_path if totals['quarantined'] else None,
+        'changed': changed,
+        'lines': totals['lines'],
+        'samples': totals['unchanged'] + totals['repaired'] - fixes_total['blank_line'],
+        'unchanged': totals['unchanged'],
+        'repaired': totals['repaired'],
+        'quarantined': totals['quarantined'],
+        'fixes': dict(fixes_total.most_common()),
+        'output_sha256': digest.hexdigest(),
+        'patches': patches,
+        'quarantined_lines': quarantined
+    }
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    logging.info(f"修复完成: 共 {totals['lines']} 行，未改动 {totals['unchanged']}，修复 {totals['repaired']}，"
+                 f"隔离 {totals['quarantined']}；补丁摘要: {summary_path}")
+    return summary
+
+def write_repair_summary(f, summary):
+    """把补丁摘要写入验证报告。"""
+    f.write(f"共 {summary['lines']} 行: 未改动 {summary['unchanged']}，修复 {summary['repaired']}，"
+            f"隔离 {summary['quarantined']}\n")
+    for fix, fix_count in summary['fixes'].items():
+        f.write(f"  - {fix}: {fix_count}\n")
+    for item in summary['quarantined_lines'][:10]:
+        f.write(f"  隔离第 {item['line']} 行: {item['error']}\n")
+    if summary['quarantine']:
+        f.write(f"无法修复的样本已追加到: {summary['quarantine']}\n")
+    if not summary['changed']:
+        f.write("没有可自动修复的问题，文件未改动。\n")
+
+def validate_jsonl_file(jsonl_path, report_file, fix=False, fix_output=None, quarantine_file=None):
+    """验证JSONL文件格式；fix 为真且验证失败时流式修复后重新验证。"""
     try:
         # 使用nova_ft_dataset_validator.py验证
-        cmd = ['python3', 'nova_ft_dataset_validator.py', '--input_file', jsonl_path, '--model_name', 'lite']
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_validator(jsonl_path)
         
         with open(report_file, 'w') as f:
             f.write("=== 训练数据验证报告 ===\n\n")
@@ -60,8 +289,17 @@ def validate_jsonl_file(jsonl_path, report_file, fix=False):
                 
                 if fix:
                     f.write("\n\n尝试修复问题...\n")
-                    # 这里可以添加修复逻辑
-                    f.write("自动修复功能尚未实现。请手动修复问题。\n")
+                    with stage('repair_jsonl'):
+                        summary = repair_jsonl_file(jsonl_path, fix_output, quarantine_file)
+                    write_repair_summary(f, summary)
+                    if summary['changed']:
+                        result = run_validator(summary['output'])
+                        if result.returncode == 0:
+                            f.write(f"\n✅ 修复后验证成功: {summary['output']}\n")
+                            logging.info(f"修复后验证成功: {summary['output']}")
+                            return True
+                        f.write("\n❌ 修复后仍未通过验证，请手动修复问题:\n")
+                        f.write(result.stderr)
                 
                 logging.error(f"验证失败: {jsonl_path}")
                 return False
@@ -78,6 +316,7 @@ def main():
     """验证训练数据集的主函数。"""
     # 解析命令行参数
     args = parse_arguments()
+    start_profiling(args, 'validate_training_dataset')
     
     # 加载配置
     config = load_config(args.config)
@@ -87,14 +326,7 @@ def main():
     report_file = args.report_file if args.report_file else config['report_file']
     
     # 配置日志
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(config['log_file']),
-            logging.StreamHandler()
-        ]
-    )
+    setup_logging(config['log_file'], 'validate_training_dataset')
     
     # 记录配置
     logging.info(f"输入目录: {input_dir}")
@@ -111,7 +343,8 @@ def main():
         return False
     
     # 验证JSONL文件
-    success = validate_jsonl_file(jsonl_file, report_file, args.fix)
+    with stage('validate_jsonl'):
+        success = validate_jsonl_file(jsonl_file, report_file, args.fix, args.fix_output, args.quarantine_file)
     
     if success:
         logging.info(f"验证成功完成。报告保存在: {report_file}")
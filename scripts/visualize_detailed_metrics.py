@@ -5,12 +5,11 @@ Script to visualize detailed training metrics with additional analysis
 
 import os
 import argparse
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-import seaborn as sns
-import dotenv
-from scipy import stats
+
+from instrumentation import stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from plot_backend import decimate, get_pyplot, load_metrics_csv, render_runs, save_figure
 
 def parse_arguments():
     """解析命令行参数。"""
@@ -20,52 +19,66 @@ def parse_arguments():
     parser.add_argument('--output-dir', type=str, help='保存生成图表的目录')
     parser.add_argument('--show', action='store_true', help='显示图表而不是保存')
     parser.add_argument('--include-outliers', action='store_true', help='在分析中包含异常值')
+    parser.add_argument('--fast', action='store_true', help='快速渲染模式（低分辨率，不做tight布局，不绘制KDE）')
+    parser.add_argument('--max-points', type=int, help='绘图前将曲线降采样到的最大点数')
+    parser.add_argument('--runs-dir', type=str, help='包含多个作业输出的目录，以快速模式为每个作业并行生成图表')
+    parser.add_argument('--workers', type=int, help='并行渲染的进程数（默认为CPU核数）')
     parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
     
+    add_profile_arguments(parser)
+    
     return parser.parse_args()
 
 def load_config(config_path):
     """加载环境变量配置。"""
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
+    settings = load_settings(config_path)
     
-    dotenv.load_dotenv(config_path)
-    
-    # 获取必要的环境变量
+    # 获取必要的配置
     config = {
-        'metrics_file': os.path.join('..', os.getenv('MODELS_DIR'), 'step_wise_training_metrics.csv'),
-        'output_dir': os.path.join('..', os.getenv('DOCS_DIR'))
+        'metrics_file': str(settings.models_dir / 'step_wise_training_metrics.csv'),
+        'output_dir': str(settings.docs_dir)
     }
     
     return config
 
-def visualize_detailed_metrics(metrics_file, output_dir=None, show=False, include_outliers=False):
+def visualize_detailed_metrics(metrics_file, output_dir=None, show=False, include_outliers=False,
+                               fast=False, max_points=None):
     """生成详细训练指标图表。"""
+    import numpy as np
+
     # 读取CSV文件
-    df = pd.read_csv(metrics_file)
+    with stage('load_metrics'):
+        metrics = load_metrics_csv(metrics_file)
+    steps = metrics['step_number']
+    losses = metrics['training_loss']
+    epoch_numbers = metrics['epoch_number']
+    # 点数较多时省略逐点标记
+    marker = 'o' if min(len(steps), max_points or len(steps)) <= 500 else None
     
     # 创建图形
+    plt = get_pyplot(show)
     fig = plt.figure(figsize=(18, 12))
     
     # 1. 训练损失随时间变化
     ax1 = fig.add_subplot(2, 2, 1)
-    ax1.plot(df['step_number'], df['training_loss'], marker='o', linestyle='-', color='blue')
+    plot_steps, plot_losses = decimate(steps, losses, max_points)
+    ax1.plot(plot_steps, plot_losses, marker=marker, linestyle='-', color='blue')
     ax1.set_title('Training Loss vs Step Number')
     ax1.set_xlabel('Step Number')
     ax1.set_ylabel('Training Loss')
     ax1.grid(True, alpha=0.3)
     
     # 为每个epoch添加标记
-    epochs = df['epoch_number'].unique()
-    for epoch in epochs:
-        epoch_start = df[df['epoch_number'] == epoch].iloc[0]['step_number']
+    epochs, first_index, inverse = np.unique(epoch_numbers, return_index=True, return_inverse=True)
+    for epoch, index in zip(epochs, first_index):
+        epoch_start = steps[index]
         ax1.axvline(x=epoch_start, color='red', linestyle='--', alpha=0.3)
-        ax1.text(epoch_start, ax1.get_ylim()[1]*0.9, f'Epoch {epoch}', rotation=90, alpha=0.7)
+        ax1.text(epoch_start, ax1.get_ylim()[1]*0.9, f'Epoch {int(epoch)}', rotation=90, alpha=0.7)
     
     # 2. 每个epoch的平均损失
     ax2 = fig.add_subplot(2, 2, 2)
-    epoch_avg_loss = df.groupby('epoch_number')['training_loss'].mean()
-    ax2.bar(epoch_avg_loss.index, epoch_avg_loss.values, color='skyblue')
+    epoch_avg_loss = np.bincount(inverse, weights=losses) / np.bincount(inverse)
+    ax2.bar(epochs, epoch_avg_loss, color='skyblue')
     ax2.set_title('Average Loss per Epoch')
     ax2.set_xlabel('Epoch Number')
     ax2.set_ylabel('Average Loss')
@@ -77,24 +90,27 @@ def visualize_detailed_metrics(metrics_file, output_dir=None, show=False, includ
     # 处理异常值
     if not include_outliers:
         # 使用IQR方法识别异常值
-        Q1 = df['training_loss'].quantile(0.25)
-        Q3 = df['training_loss'].quantile(0.75)
+        Q1, Q3 = np.percentile(losses, [25, 75])
         IQR = Q3 - Q1
         lower_bound = Q1 - 1.5 * IQR
         upper_bound = Q3 + 1.5 * IQR
-        filtered_df = df[(df['training_loss'] >= lower_bound) & (df['training_loss'] <= upper_bound)]
+        filtered_losses = losses[(losses >= lower_bound) & (losses <= upper_bound)]
     else:
-        filtered_df = df
+        filtered_losses = losses
     
-    sns.histplot(filtered_df['training_loss'], kde=True, ax=ax3)
+    if fast:
+        ax3.hist(filtered_losses, bins='auto', color='steelblue', alpha=0.7)
+    else:
+        import seaborn as sns
+        sns.histplot(filtered_losses, kde=True, ax=ax3)
     ax3.set_title('Training Loss Distribution' + (' (Outliers Removed)' if not include_outliers else ''))
     ax3.set_xlabel('Training Loss')
     ax3.set_ylabel('Frequency')
     
     # 4. 损失变化率（每步相对于前一步的变化）
     ax4 = fig.add_subplot(2, 2, 4)
-    df['loss_change'] = df['training_loss'].diff()
-    ax4.plot(df['step_number'][1:], df['loss_change'][1:], marker='o', linestyle='-', color='green')
+    change_steps, loss_change = decimate(steps[1:], np.diff(losses), max_points, method='minmax')
+    ax4.plot(change_steps, loss_change, marker=marker, linestyle='-', color='green')
     ax4.set_title('Loss Change Rate')
     ax4.set_xlabel('Step Number')
     ax4.set_ylabel('Loss Change')
@@ -103,23 +119,35 @@ def visualize_detailed_metrics(metrics_file, output_dir=None, show=False, includ
     
     # 添加总标题
     plt.suptitle('Detailed Training Metrics Analysis', fontsize=16)
-    plt.tight_layout(rect=[0, 0, 1, 0.96])
+    if not fast:
+        plt.tight_layout(rect=[0, 0, 1, 0.96])
     
     # 保存或显示图表
     if show:
         plt.show()
     elif output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, 'detailed_training_metrics.png')
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
+        with stage('save_figure'):
+            output_path = save_figure(fig, os.path.join(output_dir, 'detailed_training_metrics.png'), fast)
         print(f"详细指标图表已保存到: {output_path}")
+        return output_path
     else:
         plt.show()
 
+def visualize_runs(runs_dir, output_dir=None, include_outliers=False, max_points=None, workers=None):
+    """为目录下每个作业的指标文件并行生成详细图表。"""
+    return render_runs(visualize_detailed_metrics, runs_dir, output_dir, workers, '详细图表',
+                       include_outliers=include_outliers, fast=True, max_points=max_points)
+
 def main():
     """生成详细训练指标图表的主函数。"""
     # 解析命令行参数
     args = parse_arguments()
+    start_profiling(args, 'visualize_detailed_metrics')
+    
+    # 批量模式：不需要读取配置中的单个指标文件
+    if args.runs_dir:
+        visualize_runs(args.runs_dir, args.output_dir, args.include_outliers, args.max_points, args.workers)
+        return
     
     # 加载配置
     config = load_config(args.config)
@@ -129,7 +157,8 @@ def main():
     output_dir = args.output_dir if args.output_dir else config['output_dir']
     
     # 生成图表
-    visualize_detailed_metrics(metrics_file, output_dir, args.show, args.include_outliers)
+    visualize_detailed_metrics(metrics_file, output_dir, args.show, args.include_outliers,
+                               args.fast, args.max_points)
 
 if __name__ == "__main__":
     main()
@@ -5,10 +5,11 @@ Script to visualize training metrics from step_wise_training_metrics.csv
 
 import os
 import argparse
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-import dotenv
+
+from instrumentation import stage
+from profiling import add_profile_arguments, start_profiling
+from settings import load_settings
+from plot_backend import decimate, get_pyplot, load_metrics_csv, render_runs, save_figure
 
 def parse_arguments():
     """解析命令行参数。"""
@@ -17,42 +18,54 @@ def parse_arguments():
     parser.add_argument('--metrics-file', type=str, help='指标CSV文件路径')
     parser.add_argument('--output-dir', type=str, help='保存生成图表的目录')
     parser.add_argument('--show', action='store_true', help='显示图表而不是保存')
+    parser.add_argument('--fast', action='store_true', help='快速渲染模式（低分辨率，不做tight布局）')
+    parser.add_argument('--max-points', type=int, help='绘图前将曲线降采样到的最大点数')
+    parser.add_argument('--runs-dir', type=str, help='包含多个作业输出的目录，以快速模式为每个作业并行生成图表')
+    parser.add_argument('--workers', type=int, help='并行渲染的进程数（默认为CPU核数）')
     parser.add_argument('--config', type=str, default='../config.env', help='配置文件路径')
     
+    add_profile_arguments(parser)
+    
     return parser.parse_args()
 
 def load_config(config_path):
     """加载环境变量配置。"""
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
-    
-    dotenv.load_dotenv(config_path)
+    settings = load_settings(config_path)
     
-    # 获取必要的环境变量
+    # 获取必要的配置
     config = {
-        'metrics_file': os.path.join('..', os.getenv('MODELS_DIR'), 'step_wise_training_metrics.csv'),
-        'output_dir': os.path.join('..', os.getenv('DOCS_DIR'))
+        'metrics_file': str(settings.models_dir / 'step_wise_training_metrics.csv'),
+        'output_dir': str(settings.docs_dir)
     }
     
     return config
 
-def visualize_metrics(metrics_file, output_dir=None, show=False):
+def visualize_metrics(metrics_file, output_dir=None, show=False, fast=False, max_points=None):
     """生成训练指标图表。"""
+    import numpy as np
+
     # 读取CSV文件
-    df = pd.read_csv(metrics_file)
+    with stage('load_metrics'):
+        metrics = load_metrics_csv(metrics_file)
+    steps = metrics['step_number']
+    losses = metrics['training_loss']
+    epoch_numbers = metrics['epoch_number']
     
     # 创建图形和坐标轴
-    plt.figure(figsize=(12, 6))
+    plt = get_pyplot(show)
+    fig = plt.figure(figsize=(12, 6))
     
-    # 绘制训练损失与步骤数
-    plt.plot(df['step_number'], df['training_loss'], marker='o', linestyle='-', color='blue', label='Training Loss')
+    # 绘制训练损失与步骤数（长序列先降采样，并省略逐点标记）
+    plot_steps, plot_losses = decimate(steps, losses, max_points)
+    marker = 'o' if len(plot_steps) <= 500 else None
+    plt.plot(plot_steps, plot_losses, marker=marker, linestyle='-', color='blue', label='Training Loss')
     
     # 为每个epoch添加标记
-    epochs = df['epoch_number'].unique()
-    for epoch in epochs:
-        epoch_start = df[df['epoch_number'] == epoch].iloc[0]['step_number']
+    epochs, first_index = np.unique(epoch_numbers, return_index=True)
+    for epoch, index in zip(epochs, first_index):
+        epoch_start = steps[index]
         plt.axvline(x=epoch_start, color='red', linestyle='--', alpha=0.3)
-        plt.text(epoch_start, plt.ylim()[1]*0.9, f'Epoch {epoch}', rotation=90, alpha=0.7)
+        plt.text(epoch_start, plt.ylim()[1]*0.9, f'Epoch {int(epoch)}', rotation=90, alpha=0.7)
     
     # 添加标题和标签
     plt.title('Training Loss vs Step Number')
@@ -65,17 +78,27 @@ def visualize_metrics(metrics_file, output_dir=None, show=False):
     if show:
         plt.show()
     elif output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, 'training_loss_plot.png')
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
+        with stage('save_figure'):
+            output_path = save_figure(fig, os.path.join(output_dir, 'training_loss_plot.png'), fast)
         print(f"图表已保存到: {output_path}")
+        return output_path
     else:
         plt.show()
 
+def visualize_runs(runs_dir, output_dir=None, fast=True, max_points=None, workers=None):
+    """为目录下每个作业的指标文件并行生成图表，图表默认保存在各自的作业目录中。"""
+    return render_runs(visualize_metrics, runs_dir, output_dir, workers, fast=fast, max_points=max_points)
+
 def main():
     """生成训练指标图表的主函数。"""
     # 解析命令行参数
     args = parse_arguments()
+    start_profiling(args, 'visualize_training_metrics')
+    
+    # 批量模式：不需要读取配置中的单个指标文件
+    if args.runs_dir:
+        visualize_runs(args.runs_dir, args.output_dir, True, args.max_points, args.workers)
+        return
     
     # 加载配置
     config = load_config(args.config)
@@ -85,7 +108,7 @@ def main():
     output_dir = args.output_dir if args.output_dir else config['output_dir']
     
     # 生成图表
-    visualize_metrics(metrics_file, output_dir, args.show)
+    visualize_metrics(metrics_file, output_dir, args.show, args.fast, args.max_points)
 
 if __name__ == "__main__":
     main()
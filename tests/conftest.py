@@ -0,0 +1,7 @@
+import os
+import sys
+
+# scripts/ 下的脚本以顶层模块的方式互相导入
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
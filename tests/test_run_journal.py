@@ -0,0 +1,154 @@
+"""run_journal: JSONL被删除后断点续跑，process_images_for_training 与 ingest_daemon 都应重新写出全部条目。"""
+
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ingest_daemon
+import process_images_for_training
+from run_journal import RunJournal
+
+IMAGES = [f"vat_{index:04d}.jpeg" for index in range(1, 6)]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    for name in IMAGES:
+        (images_dir / name).write_bytes(b'\xff\xd8\xff\xd9')
+    label_csv = tmp_path / 'train_label.csv'
+    with open(label_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['图片名称', '销售方'])
+        writer.writerows([name, f"销售方{index}有限公司"] for index, name in enumerate(IMAGES))
+    config = {'s3_bucket': 'bucket', 's3_prefix': 'images', 'account_id': '123456789012', 'journal': True,
+              'cache_dir': str(tmp_path / 'cache'), 'output_jsonl': str(tmp_path / 'train_data.jsonl'),
+              'label_csv': str(label_csv)}
+    return images_dir, label_csv, config
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """替换S3上传，记录上传过的图像。"""
+    uploaded = []
+
+    def fake_upload(image_path, image_name, config):
+        uploaded.append(image_name)
+        return f"s3://{config['s3_bucket']}/{config['s3_prefix']}/{image_name}"
+
+    monkeypatch.setattr(process_images_for_training, 'upload_image_to_s3', fake_upload)
+    monkeypatch.setattr(ingest_daemon, 'upload_image_to_s3', fake_upload)
+    return uploaded
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_serialized_records_keep_upload_fields(tmp_path):
+    output = str(tmp_path / 'out.jsonl')
+    journal = RunJournal(output)
+    journal.open_output()
+    journal.record('a.jpeg', 'uploaded', s3_uri='s3://bucket/a.jpeg', seller='甲公司')
+    journal.write_output('{}\n', ['a.jpeg'])
+    journal.close()
+
+    os.remove(output)
+    journal = RunJournal(output)
+    journal.open_output()
+    state = journal.state('a.jpeg')
+    journal.close()
+
+    assert state['state'] == 'uploaded'
+    assert state['s3_uri'] == 's3://bucket/a.jpeg'
+    assert state['seller'] == '甲公司'
+
+
+def test_legacy_serialized_record_without_uri_is_reprocessed(tmp_path):
+    output = str(tmp_path / 'out.jsonl')
+    with open(output + '.journal', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'item': 'a.jpeg', 'state': 'serialized', 'ts': 0, 'offset': 3}) + '\n')
+
+    journal = RunJournal(output)
+    journal.open_output()
+    journal.close()
+
+    assert journal.state('a.jpeg') is None
+
+
+def test_process_dataset_rewrites_deleted_jsonl(dataset, uploads):
+    images_dir, label_csv, config = dataset
+    output = config['output_jsonl']
+    result = process_images_for_training.process_dataset(str(label_csv), str(images_dir), output, config)
+    assert result[0] and len(read_jsonl(output)) == len(IMAGES)
+    assert sorted(uploads) == IMAGES
+
+    os.remove(output)
+    result = process_images_for_training.process_dataset(str(label_csv), str(images_dir), output, config)
+
+    samples = read_jsonl(output)
+    assert result[0] and len(samples) == len(IMAGES)
+    assert not os.path.exists(output + '.dead_letter.jsonl')
+    # 重新写出时复用日志中的S3 URI，不再上传
+    assert len(uploads) == len(IMAGES)
+    uri = samples[0]['messages'][0]['content'][1]['image']['source']['s3Location']['uri']
+    assert uri == f"s3://bucket/images/{IMAGES[0]}"
+
+
+def test_ingest_daemon_rewrites_deleted_jsonl(dataset, uploads):
+    images_dir, label_csv, config = dataset
+    os.remove(label_csv)
+    output = config['output_jsonl']
+    labeled = [(name, f"销售方{index}有限公司", None) for index, name in enumerate(IMAGES)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        daemon = ingest_daemon.IngestDaemon(str(images_dir), config, None, 'model', None)
+        daemon.write_batch(labeled, executor)
+        daemon.journal.close()
+        assert len(read_jsonl(output)) == len(IMAGES)
+
+        os.remove(output)
+        daemon = ingest_daemon.IngestDaemon(str(images_dir), config, None, 'model', None)
+        to_label, to_write = daemon.backlog()
+        assert to_label == []
+        assert sorted(to_write) == sorted(labeled)
+        daemon.write_batch(to_write, executor)
+        daemon.journal.close()
+
+    assert len(read_jsonl(output)) == len(IMAGES)
+    assert len(uploads) == len(IMAGES)
+    # 标注CSV中每张图像只有一行
+    with open(label_csv, 'r', encoding='utf-8') as f:
+        assert sorted(row['图片名称'] for row in csv.DictReader(f)) == IMAGES
+
+
+def test_ingest_daemon_finishes_items_uploaded_by_process_images(dataset, uploads):
+    images_dir, label_csv, config = dataset
+    output = config['output_jsonl']
+    # process_images_for_training 旧版本的日志: 已上传但没有销售方，也没有写出
+    with open(output + '.journal', 'w', encoding='utf-8') as f:
+        for name in IMAGES:
+            f.write(json.dumps({'item': name, 'state': 'uploaded', 'ts': 0,
+                                's3_uri': f"s3://bucket/images/{name}"}) + '\n')
+    # 其中一张图像不在标注CSV中，需要重新标注
+    with open(label_csv, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(label_csv, 'w', encoding='utf-8') as f:
+        f.writelines(lines[:-1])
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        daemon = ingest_daemon.IngestDaemon(str(images_dir), config, None, 'model', None)
+        to_label, to_write = daemon.backlog()
+        assert to_label == [IMAGES[-1]]
+        assert [name for name, _, _ in to_write] == IMAGES[:-1]
+        daemon.write_batch(to_write + [(IMAGES[-1], '新标注有限公司', None)], executor)
+        daemon.journal.close()
+
+    assert len(read_jsonl(output)) == len(IMAGES)
+    assert uploads == []
+    with open(label_csv, 'r', encoding='utf-8') as f:
+        assert sorted(row['图片名称'] for row in csv.DictReader(f)) == IMAGES
@@ -0,0 +1,101 @@
+"""training_watchdog: 用本地指标文件回放合成的训练曲线，桩Bedrock客户端记录是否请求停止作业。"""
+
+import math
+import random
+
+import pytest
+
+import training_watchdog
+from training_watchdog import FileMetricsSource, TrainingWatchdog, create_detectors
+
+JOB_ARN = 'arn:aws:bedrock:us-east-1:123456789012:model-customization-job/test-job'
+STEPS = 3000
+
+
+class StubBedrockClient:
+    """只实现看门狗用到的两个接口，并记录调用。"""
+
+    def __init__(self):
+        self.stopped = []
+
+    def get_model_customization_job(self, jobIdentifier):
+        return {'status': 'Stopping' if self.stopped else 'InProgress'}
+
+    def stop_model_customization_job(self, jobIdentifier):
+        self.stopped.append(jobIdentifier)
+
+
+def healthy_loss(step, rng):
+    return 2.0 * math.exp(-step / 400) + 0.3 + rng.gauss(0, 0.03)
+
+
+def diverging_loss(step, rng):
+    return healthy_loss(step, rng) + max(0, step - 800) * 0.002
+
+
+def nan_loss(step, rng):
+    return math.nan if step >= 1200 else healthy_loss(step, rng)
+
+
+def plateau_loss(step, rng):
+    return 1.2 + rng.gauss(0, 0.05)
+
+
+def write_metrics(path, loss_fn, steps=STEPS, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('step_number,epoch_number,training_loss\n')
+        for step in range(1, steps + 1):
+            loss = loss_fn(step, rng)
+            f.write(f"{step},{step // 1000},{'nan' if math.isnan(loss) else f'{loss:.6f}'}\n")
+    return str(path)
+
+
+@pytest.fixture
+def default_args(monkeypatch):
+    """命令行参数的默认值（检测器阈值与 --help 中的一致）。"""
+    monkeypatch.setattr('sys.argv', ['training_watchdog.py'])
+    return training_watchdog.parse_arguments()
+
+
+def run_watchdog(path, args, batch_rows=100):
+    client = StubBedrockClient()
+    watchdog = TrainingWatchdog(FileMetricsSource(path, batch_rows), create_detectors(args), client, JOB_ARN)
+    return watchdog.run(interval=0), client
+
+
+@pytest.mark.parametrize('loss_fn, detector, first_step, last_step', [
+    (nan_loss, 'nan_explosion', 1200, 1200),
+    (diverging_loss, 'ema_divergence', 800, 1500),
+    (plateau_loss, 'plateau', 1, 1000),
+])
+def test_anomaly_stops_job(tmp_path, default_args, loss_fn, detector, first_step, last_step):
+    path = write_metrics(tmp_path / 'step_wise_training_metrics.csv', loss_fn)
+    alert, client = run_watchdog(path, default_args)
+
+    assert alert is not None
+    assert alert['detector'] == detector
+    assert first_step <= alert['step'] <= last_step
+    assert alert['stopped'] is True
+    assert client.stopped == [JOB_ARN]
+
+
+def test_healthy_run_is_not_stopped(tmp_path, default_args):
+    path = write_metrics(tmp_path / 'step_wise_training_metrics.csv', healthy_loss)
+    alert, client = run_watchdog(path, default_args)
+
+    assert alert is None
+    assert client.stopped == []
+
+
+def test_no_stop_only_reports(tmp_path, default_args):
+    path = write_metrics(tmp_path / 'step_wise_training_metrics.csv', nan_loss)
+    client = StubBedrockClient()
+    watchdog = TrainingWatchdog(FileMetricsSource(path), create_detectors(default_args), client, JOB_ARN,
+                                stop_job=False)
+
+    alert = watchdog.run(interval=0)
+
+    assert alert['detector'] == 'nan_explosion'
+    assert 'stopped' not in alert
+    assert client.stopped == []